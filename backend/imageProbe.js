@@ -0,0 +1,189 @@
+// Header-only checks for uploaded images.
+//
+// The upload filter used to trust the file extension, so a truncated JPEG or
+// a PNG renamed to .jpg only failed once Python had started and cv2.imread
+// returned None.  probeImage() reads the format, dimensions, channels and bit
+// depth from the header of the in-memory upload and checks that the file
+// ends where its format says it should, without decoding pixels.  It mirrors
+// labkit/probe.py, which scripts use for the same checks.
+
+const EXTENSIONS = {
+    jpeg: ['.jpg', '.jpeg', '.jpe', '.jfif'],
+    png: ['.png'],
+    bmp: ['.bmp', '.dib'],
+    tiff: ['.tif', '.tiff'],
+};
+
+// How far from the end to look for the end-of-image marker (JPEG) or IEND
+// chunk (PNG): cameras and editors may append data after it
+const TRAILER_TAIL = 1 << 16;
+// IEND has no data, so its CRC, and the whole chunk, is fixed
+const PNG_IEND = Buffer.from([0, 0, 0, 0, 0x49, 0x45, 0x4e, 0x44, 0xae, 0x42, 0x60, 0x82]);
+const PNG_CHANNELS = { 0: 1, 2: 3, 3: 3, 4: 2, 6: 4 };
+
+export class ProbeError extends Error {
+    constructor(message) {
+        super(message);
+        this.name = 'ProbeError';
+    }
+}
+
+function need(buf, end) {
+    if (end > buf.length) throw new ProbeError('File ends inside its header');
+}
+
+export function detectFormat(buf) {
+    if (buf.length >= 3 && buf[0] === 0xff && buf[1] === 0xd8 && buf[2] === 0xff) return 'jpeg';
+    if (buf.length >= 8 && buf.subarray(0, 8).equals(Buffer.from([0x89, 0x50, 0x4e, 0x47, 0x0d, 0x0a, 0x1a, 0x0a]))) return 'png';
+    if (buf.length >= 2 && buf[0] === 0x42 && buf[1] === 0x4d) return 'bmp';
+    const head = buf.subarray(0, 4).toString('latin1');
+    if (head === 'II*\0' || head === 'MM\0*' || head === 'II+\0' || head === 'MM\0+') return 'tiff';
+    return null;
+}
+
+function probeJpeg(buf) {
+    let pos = 2;
+    for (;;) {
+        need(buf, pos + 2);
+        if (buf[pos] !== 0xff) throw new ProbeError('Corrupt JPEG: expected a marker');
+        while (buf[pos] === 0xff) {  // Fill bytes
+            pos += 1;
+            need(buf, pos + 1);
+        }
+        const code = buf[pos];
+        pos += 1;
+        if (code === 0x01 || (code >= 0xd0 && code <= 0xd7)) continue;  // Standalone markers
+        if (code === 0xd9 || code === 0xda) {
+            throw new ProbeError('Corrupt JPEG: no frame header before the image data');
+        }
+        need(buf, pos + 2);
+        const length = buf.readUInt16BE(pos);
+        if (code >= 0xc0 && code <= 0xcf && code !== 0xc4 && code !== 0xc8 && code !== 0xcc) {
+            need(buf, pos + 8);
+            const tail = buf.subarray(Math.max(0, buf.length - TRAILER_TAIL));
+            return {
+                format: 'jpeg',
+                width: buf.readUInt16BE(pos + 5),
+                height: buf.readUInt16BE(pos + 3),
+                channels: buf[pos + 7],
+                bitDepth: buf[pos + 2],
+                truncated: tail.indexOf(Buffer.from([0xff, 0xd9])) === -1,
+            };
+        }
+        pos += length;
+    }
+}
+
+function probePng(buf) {
+    need(buf, 26);
+    if (buf.readUInt32BE(8) !== 13 || buf.toString('latin1', 12, 16) !== 'IHDR') {
+        throw new ProbeError('Corrupt PNG: missing IHDR chunk');
+    }
+    const colorType = buf[25];
+    if (!(colorType in PNG_CHANNELS)) throw new ProbeError(`Corrupt PNG: unknown colour type ${colorType}`);
+    return {
+        format: 'png',
+        width: buf.readUInt32BE(16),
+        height: buf.readUInt32BE(20),
+        channels: PNG_CHANNELS[colorType],
+        // Palette images carry 1-8 bit indices but decode to 8-bit colour
+        bitDepth: colorType === 3 ? 8 : buf[24],
+        truncated: buf.subarray(Math.max(33, buf.length - TRAILER_TAIL)).indexOf(PNG_IEND) === -1,
+    };
+}
+
+function probeBmp(buf) {
+    need(buf, 18);
+    const declared = buf.readUInt32LE(2);
+    const core = buf.readUInt32LE(14) === 12;  // OS/2 BITMAPCOREHEADER
+    need(buf, core ? 26 : 30);
+    const bpp = core ? buf.readUInt16LE(24) : buf.readUInt16LE(28);
+    return {
+        format: 'bmp',
+        width: core ? buf.readUInt16LE(18) : buf.readInt32LE(18),
+        height: Math.abs(core ? buf.readInt16LE(20) : buf.readInt32LE(22)),
+        // 32-bit files may carry alpha; everything else decodes to 8-bit BGR
+        channels: bpp === 32 ? 4 : 3,
+        bitDepth: 8,
+        truncated: buf.length < declared,
+    };
+}
+
+function probeTiff(buf) {
+    const le = buf[0] === 0x49;
+    const u16 = (pos) => (le ? buf.readUInt16LE(pos) : buf.readUInt16BE(pos));
+    const u32 = (pos) => (le ? buf.readUInt32LE(pos) : buf.readUInt32BE(pos));
+    need(buf, 8);
+    if (u16(2) !== 42) throw new ProbeError('BigTIFF files are not supported');
+    const ifd = u32(4);
+    if (ifd + 2 > buf.length) throw new ProbeError('Truncated TIFF: image directory beyond the end of the file');
+    const count = u16(ifd);
+    need(buf, ifd + 2 + 12 * count);
+
+    // Values of one entry (only the integer types TIFF uses for layout)
+    const values = (entry) => {
+        const type = u16(entry + 2);
+        const n = u32(entry + 4);
+        const size = { 3: 2, 4: 4 }[type];
+        if (!size) return [];
+        let start = entry + 8;
+        if (size * n > 4) {
+            start = u32(entry + 8);
+            if (start + size * n > buf.length) throw new ProbeError('Corrupt TIFF: tag data beyond the end of the file');
+        }
+        const out = [];
+        for (let i = 0; i < n; i++) out.push(size === 2 ? u16(start + 2 * i) : u32(start + 4 * i));
+        return out;
+    };
+
+    const tags = {};
+    for (let i = 0; i < count; i++) {
+        const entry = ifd + 2 + 12 * i;
+        const tag = u16(entry);
+        if ([256, 257, 258, 277, 273, 279, 324, 325].includes(tag)) tags[tag] = values(entry);
+    }
+    if (!tags[256] || !tags[257]) throw new ProbeError('Corrupt TIFF: missing image dimensions');
+    const offsets = tags[273] || tags[324] || [];
+    const counts = tags[279] || tags[325] || [];
+    return {
+        format: 'tiff',
+        width: tags[256][0],
+        height: tags[257][0],
+        channels: (tags[277] || [1])[0],
+        bitDepth: (tags[258] || [1])[0],
+        truncated: offsets.some((offset, i) => offset + (counts[i] || 0) > buf.length),
+    };
+}
+
+const PROBES = { jpeg: probeJpeg, png: probePng, bmp: probeBmp, tiff: probeTiff };
+
+// { format, width, height, channels, bitDepth, truncated } from the header of
+// `buf`; throws ProbeError for unknown formats and corrupt headers
+export function probeImage(buf) {
+    const format = detectFormat(buf);
+    if (!format) throw new ProbeError('Not a JPEG, PNG, BMP or TIFF file');
+    try {
+        return PROBES[format](buf);
+    } catch (error) {
+        if (error instanceof RangeError) throw new ProbeError(`Corrupt ${format.toUpperCase()} header`);
+        throw error;
+    }
+}
+
+// Why the upload `buf` named `name` should be rejected, or null if it is fine
+export function checkUpload(name, buf) {
+    let info;
+    try {
+        info = probeImage(buf);
+    } catch (error) {
+        if (error instanceof ProbeError) return error.message;
+        throw error;
+    }
+    const ext = name.slice(name.lastIndexOf('.')).toLowerCase();
+    if (!EXTENSIONS[info.format].includes(ext)) {
+        return `named ${ext} but contains a ${info.format.toUpperCase()} image`;
+    }
+    if (info.truncated) return 'truncated: the upload did not finish or the file is damaged';
+    if (info.width <= 0 || info.height <= 0) return `reports an empty ${info.width}x${info.height} image`;
+    return null;
+}
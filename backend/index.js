@@ -6,6 +6,12 @@ import { fileURLToPath } from 'url';
 import path from 'path';
 import fs from 'fs';
 import util from 'util';
+import os from 'os';
+import crypto from 'crypto';
+import { PythonWorkerPool } from './pythonPool.js';
+import { FairScheduler, SchedulerFullError } from './scheduler.js';
+import { ResultCache } from './resultCache.js';
+import { checkUpload } from './imageProbe.js';
 const app = express();
 const execPromise = util.promisify(exec);
 
@@ -14,12 +20,115 @@ const pythonPath = process.env.PYTHON_PATH || 'py';
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
 
+// Execution timeout for user scripts (ms)
+const EXECUTION_TIMEOUT = 10000;
+
+// Runs allowed at once; more would only oversubscribe the cores and push
+// everyone past the timeout.  Waiting runs are served round-robin per user.
+const MAX_CONCURRENT = parseInt(process.env.PYTHON_MAX_CONCURRENT || os.cpus().length, 10);
+const scheduler = new FairScheduler({
+    concurrency: MAX_CONCURRENT,
+    maxQueued: parseInt(process.env.PYTHON_MAX_QUEUED || MAX_CONCURRENT * 8, 10),
+    maxQueuedPerUser: parseInt(process.env.PYTHON_MAX_QUEUED_PER_USER || '3', 10),
+});
+
+// Each run gets its share of the cores for OpenCV/BLAS threads, and
+// CPU-time and address-space rlimits (labkit/worker.py applies them)
+const THREADS_PER_RUN = parseInt(
+    process.env.PYTHON_THREADS_PER_RUN || Math.max(1, Math.floor(os.cpus().length / MAX_CONCURRENT)), 10);
+const pythonEnv = {
+    ...process.env,
+    OMP_NUM_THREADS: String(THREADS_PER_RUN),
+    OPENBLAS_NUM_THREADS: String(THREADS_PER_RUN),
+    MKL_NUM_THREADS: String(THREADS_PER_RUN),
+    NUMEXPR_NUM_THREADS: String(THREADS_PER_RUN),
+    LABKIT_THREADS: String(THREADS_PER_RUN),
+    LABKIT_MAX_MEMORY_MB: process.env.PYTHON_MAX_MEMORY_MB || '2048',
+};
+
+// Warm worker pool, one worker per concurrent run; set PYTHON_POOL_SIZE=0 to
+// start a new interpreter per run
+const POOL_SIZE = parseInt(process.env.PYTHON_POOL_SIZE ?? MAX_CONCURRENT, 10);
+const pythonPool = POOL_SIZE > 0
+    ? new PythonWorkerPool({
+        pythonPath,
+        cwd: __dirname,
+        size: POOL_SIZE,
+        maxRuns: parseInt(process.env.PYTHON_WORKER_MAX_RUNS || '100', 10),
+        maxRssMb: parseInt(process.env.PYTHON_WORKER_MAX_RSS_MB || '1024', 10),
+        env: pythonEnv,
+    }).start()
+    : null;
+
+// Per-phase profile returned with every run (labkit/profiler.py); a request
+// may ask for another level with a `profile` field
+const PROFILE_LEVELS = ['off', 'basic', 'memory', 'full'];
+const DEFAULT_PROFILE = PROFILE_LEVELS.includes(process.env.PYTHON_PROFILE) ? process.env.PYTHON_PROFILE : 'basic';
+
+// Results of repeated runs (same script, uploads and library versions) are
+// served from disk; PYTHON_RESULT_CACHE_MB=0 disables the cache
+const RESULT_CACHE_MB = parseInt(process.env.PYTHON_RESULT_CACHE_MB || '256', 10);
+const resultCache = RESULT_CACHE_MB > 0
+    ? new ResultCache({
+        dir: process.env.PYTHON_RESULT_CACHE_DIR || path.join(os.tmpdir(), 'labkit-results'),
+        maxBytes: RESULT_CACHE_MB * 1024 * 1024,
+        pythonPath,
+        labkitDir: path.join(__dirname, 'labkit'),
+        env: pythonEnv,
+    })
+    : null;
+// Probe the library versions now rather than on the first request
+resultCache?.runtimeVersions();
+
 // Define accepted formats
 const ACCEPTED_IMAGE_FORMATS = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff'];
 const ACCEPTED_FORMATS_STRING = 'JPG, JPEG, PNG, BMP, TIFF';
 
 const upload = multer({ storage: multer.memoryStorage() });
 
+// Behind a reverse proxy req.ip is the proxy's address unless Express is told
+// to trust it: TRUST_PROXY=1 (hops), a list of proxy addresses/subnets, or
+// true.  Off by default, since a trusted X-Forwarded-For could be forged.
+const TRUST_PROXY = process.env.TRUST_PROXY;
+if (TRUST_PROXY) {
+    app.set('trust proxy', /^\d+$/.test(TRUST_PROXY) ? parseInt(TRUST_PROXY, 10)
+        : TRUST_PROXY === 'true' ? true : TRUST_PROXY === 'false' ? false : TRUST_PROXY);
+}
+
+// Fair-share key per browser.  A class behind one NAT or proxy shares an
+// address, so each browser gets a signed session cookie and queues under
+// it; a request without a valid cookie (the first one, or a client that
+// drops cookies) queues under its address.  The cookie is signed so a
+// client cannot pick another's key, and only identifies a queue: clearing
+// it just moves the next run back under the address.
+const SESSION_COOKIE = 'runner_session';
+const SESSION_SECRET = process.env.SESSION_SECRET || crypto.randomBytes(32).toString('hex');
+
+function signSession(id) {
+    return crypto.createHmac('sha256', SESSION_SECRET).update(id).digest('base64url').slice(0, 22);
+}
+
+function sessionFromCookie(header = '') {
+    for (const part of header.split(';')) {
+        const [name, value = ''] = part.trim().split('=');
+        const match = name === SESSION_COOKIE && value.match(/^([\w-]{22})\.([\w-]{22})$/);
+        if (match && crypto.timingSafeEqual(Buffer.from(signSession(match[1])), Buffer.from(match[2]))) {
+            return match[1];
+        }
+    }
+    return null;
+}
+
+function schedulingKey(req, res) {
+    const session = sessionFromCookie(req.headers.cookie);
+    if (session) return `session:${session}`;
+    const id = crypto.randomBytes(16).toString('base64url');
+    res.cookie(SESSION_COOKIE, `${id}.${signSession(id)}`, {
+        httpOnly: true, sameSite: 'lax', maxAge: 30 * 24 * 3600 * 1000,
+    });
+    return `ip:${req.ip}`;
+}
+
 app.use(cors({
     origin: ['http://localhost:5173', 'http://127.0.0.1:5173'],
     methods: ['GET', 'POST', 'OPTIONS'],
@@ -46,9 +155,75 @@ app.use((req, res, next) => {
 
 // Health check
 app.get('/health', (req, res) => {
-    res.status(200).json({ status: 'healthy' });
+    res.status(200).json({
+        status: 'healthy',
+        scheduler: scheduler.snapshot(),
+        resultCache: resultCache ? resultCache.snapshot() : null,
+        pool: pythonPool
+            ? { size: pythonPool.size, queued: pythonPool.queue.length, ...pythonPool.stats }
+            : null
+    });
 });
 
+// Read the figures and profile a cold run wrote next to its temp directory
+function readColdResult(resultPath) {
+    try {
+        return JSON.parse(fs.readFileSync(resultPath, 'utf-8'));
+    } catch {
+        return { figures: [] };
+    } finally {
+        fs.rmSync(resultPath, { force: true });
+    }
+}
+
+// Run a saved script and resolve with { stdout, stderr, figures, profile }.
+// Failures reject with an Error carrying stdout/stderr, like
+// child_process.exec does.  `uploads` maps saved image paths to their
+// content hash, size and mtime so labkit.images can reuse previously
+// decoded pixels.  `onEvent`
+// gets output lines, figures and progress while the script runs (pooled
+// workers only; a cold run reports everything at the end).
+async function runPython(scriptPath, cwd, uploads = {}, profile = DEFAULT_PROFILE, onEvent = null) {
+    if (!pythonPool) {
+        const resultPath = `${cwd}.result.json`;
+        try {
+            const { stdout, stderr } = await execPromise(
+                `"${pythonPath}" -m labkit.worker --run "${scriptPath}" --result "${resultPath}" --profile ${profile} --timeout ${EXECUTION_TIMEOUT / 1000}`,
+                {
+                    cwd,
+                    env: {
+                        ...pythonEnv,
+                        PYTHONPATH: __dirname,
+                        MPLBACKEND: 'Agg',
+                        LABKIT_UPLOADS: JSON.stringify(uploads),
+                        LABKIT_LAUNCHED_AT: String(Date.now())
+                    },
+                    timeout: EXECUTION_TIMEOUT,
+                    windowsHide: true
+                }
+            );
+            return { stdout, stderr, ...readColdResult(resultPath) };
+        } catch (error) {
+            Object.assign(error, readColdResult(resultPath));
+            throw error;
+        }
+    }
+
+    const result = await pythonPool.run({ scriptPath, cwd, timeout: EXECUTION_TIMEOUT, uploads, profile, onEvent });
+    if (result.timedOut || result.exitCode !== 0) {
+        const error = new Error(result.timedOut
+            ? `Execution timed out after ${EXECUTION_TIMEOUT / 1000} seconds`
+            : `Command failed with exit code ${result.exitCode}`);
+        error.killed = result.timedOut;
+        error.stdout = result.stdout;
+        error.stderr = result.stderr;
+        error.figures = result.figures;
+        error.profile = result.profile;
+        throw error;
+    }
+    return result;
+}
+
 // Function to validate file formats
 function validateFileFormats(files) {
     const invalidFiles = [];
@@ -57,14 +232,18 @@ function validateFileFormats(files) {
     for (const file of files) {
         const ext = path.extname(file.originalname).toLowerCase();
         const isValidFormat = ACCEPTED_IMAGE_FORMATS.includes(ext);
+        // Read the header too, so truncated or mislabelled images are
+        // refused here rather than by cv2.imread inside the script
+        const problem = isValidFormat ? checkUpload(file.originalname, file.buffer) : null;
 
-        if (isValidFormat) {
+        if (isValidFormat && !problem) {
             validFiles.push(file);
         } else {
             invalidFiles.push({
                 name: file.originalname,
                 extension: ext || 'no extension',
-                size: file.size
+                size: file.size,
+                ...(problem && { reason: problem })
             });
         }
     }
@@ -72,13 +251,55 @@ function validateFileFormats(files) {
     return { validFiles, invalidFiles };
 }
 
-// POST /execute with code + optional files
+// Switch a response to server-sent events; `send(type, data)` writes one,
+// and does nothing once the client has gone
+function openEventStream(res) {
+    res.writeHead(200, {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        Connection: 'keep-alive',
+        // Keep reverse proxies from buffering the stream
+        'X-Accel-Buffering': 'no',
+    });
+    res.flushHeaders();
+    return {
+        send(type, data) {
+            if (!res.writableEnded && !res.destroyed) res.write(`event: ${type}\ndata: ${JSON.stringify(data)}\n\n`);
+        },
+    };
+}
+
+// POST /execute with code + optional files.  With `stream=1` (query or
+// body) the response is a server-sent event stream: `stdout`, `stderr`,
+// `figure` and `progress` events while the script runs, then one `result`
+// event with the usual JSON body plus its HTTP `status`.  The result leaves
+// out the output and figures that were already sent as events.
+//
+// A client that disconnects before the reply stops the stream; a run still
+// waiting for a slot is dropped, one already running finishes unobserved.
 app.post('/execute', upload.array('files'), async (req, res) => {
     let scriptPath = '';
+    let events = null;
+    let streamedFigures = 0;
+    const streamed = { stdout: '', stderr: '' };
+    // What of a run's stdout/stderr the client has not seen as events
+    const unstreamed = (kind, text) => (
+        text && text.startsWith(streamed[kind]) ? text.slice(streamed[kind].length) : text);
+    const disconnected = new AbortController();
+    res.on('close', () => {
+        if (!res.writableEnded) disconnected.abort();
+    });
+    const reply = (status, body) => {
+        if (disconnected.signal.aborted) return null;
+        if (!events) return res.status(status).json(body);
+        // Figures already sent as events are not repeated
+        events.send('result', { status, ...body, figures: (body.figures || []).slice(streamedFigures) });
+        return res.end();
+    };
     try {
         const code = req.body.code;
         if (!code) {
-            return res.status(400).json({
+            return reply(400, {
                 error: 'No code provided',
                 output: ['Error: No Python code was provided']
             });
@@ -98,7 +319,9 @@ app.post('/execute', upload.array('files'), async (req, res) => {
                 ];
 
                 invalidFiles.forEach(file => {
-                    errorMessages.push(`  • ${file.name} (${file.extension})`);
+                    errorMessages.push(file.reason
+                        ? `  • ${file.name}: ${file.reason}`
+                        : `  • ${file.name} (${file.extension})`);
                 });
 
                 errorMessages.push(
@@ -111,7 +334,7 @@ app.post('/execute', upload.array('files'), async (req, res) => {
                     '   Online converters are also available for quick conversion.'
                 );
 
-                return res.status(400).json({
+                return reply(400, {
                     error: 'Invalid file format(s)',
                     output: errorMessages,
                     formatError: true,
@@ -128,13 +351,28 @@ app.post('/execute', upload.array('files'), async (req, res) => {
         fs.mkdirSync(tempDir, { recursive: true });
 
         // Save uploaded files (rename image to sample.jpg/png)
+        const uploadHashes = {};
+        const fileHashes = {};
         if (req.files && req.files.length > 0) {
             const uploadedFiles = [];
             for (const file of req.files) {
                 const ext = path.extname(file.originalname).toLowerCase();
                 const isImage = ACCEPTED_IMAGE_FORMATS.includes(ext);
                 const finalName = isImage ? `sample${ext}` : file.originalname;
-                fs.writeFileSync(path.join(tempDir, finalName), file.buffer);
+                const savedPath = path.join(tempDir, finalName);
+                fs.writeFileSync(savedPath, file.buffer);
+                fileHashes[finalName] = crypto.createHash('sha256').update(file.buffer).digest('hex');
+                if (isImage) {
+                    // Keyed by the resolved path, with the size and mtime the
+                    // hash belongs to, so labkit.images can tell when a script
+                    // has since overwritten the file
+                    const stat = fs.statSync(savedPath, { bigint: true });
+                    uploadHashes[fs.realpathSync(savedPath)] = {
+                        sha256: fileHashes[finalName],
+                        size: Number(stat.size),
+                        mtimeNs: stat.mtimeNs.toString(),
+                    };
+                }
                 uploadedFiles.push({ original: file.originalname, saved: finalName });
             }
 
@@ -153,15 +391,40 @@ app.post('/execute', upload.array('files'), async (req, res) => {
         scriptPath = path.join(tempDir, 'script.py');
         fs.writeFileSync(scriptPath, code);
 
-        // Run the code
-        const { stdout, stderr } = await execPromise(
-            `"${pythonPath}" "${scriptPath}"`,
-            {
-                cwd: tempDir,
-                timeout: 10000,
-                windowsHide: true
+        // Before any event is streamed, as it may set the session cookie
+        const user = schedulingKey(req, res);
+        if (['1', 'true'].includes(String(req.query.stream ?? req.body.stream))) {
+            events = openEventStream(res);
+        }
+        const onEvent = events && ((event) => {
+            if (disconnected.signal.aborted) return;
+            if (event.type === 'figure') streamedFigures += 1;
+            if (event.type in streamed) streamed[event.type] += event.text;
+            events.send(event.type, event);
+        });
+
+        // Answer from the result cache, or run the code once the scheduler
+        // admits it.  `cache: false` in the request skips the cache.
+        const useCache = resultCache && !['false', '0', false].includes(req.body.cache);
+        const cacheKey = useCache ? await resultCache.key(code, fileHashes) : null;
+        let run = cacheKey ? await resultCache.get(cacheKey) : null;
+        const cached = Boolean(run);
+        if (cached) {
+            run = { ...run, profile: null, waitMs: 0 };
+        } else {
+            const profile = PROFILE_LEVELS.includes(req.body.profile) ? req.body.profile : DEFAULT_PROFILE;
+            run = await scheduler.run(
+                user, async ({ waitMs }) => ({
+                    ...await runPython(scriptPath, tempDir, uploadHashes, profile, onEvent),
+                    waitMs,
+                }), { signal: disconnected.signal });
+            if (cacheKey) {
+                // Only successful runs get here; runPython throws on failure
+                await resultCache.set(cacheKey, { stdout: run.stdout, stderr: run.stderr, figures: run.figures || [] })
+                    .catch((e) => console.warn('Result cache write failed:', e.message));
             }
-        );
+        }
+        const { stdout, stderr, figures, profile: profileReport, waitMs } = run;
 
         const outputMessages = [];
 
@@ -182,20 +445,38 @@ app.post('/execute', upload.array('files'), async (req, res) => {
         }
 
         // Add Python execution output
-        if (stdout) outputMessages.push(stdout);
-        if (stderr) outputMessages.push(stderr);
+        outputMessages.push(unstreamed('stdout', stdout), unstreamed('stderr', stderr));
 
-        res.json({
+        reply(200, {
             output: outputMessages.filter(Boolean),
+            figures: figures || [],
+            profile: profileReport || null,
+            queue: { waitMs },
+            cached,
             error: null
         });
     } catch (error) {
+        if (disconnected.signal.aborted) return;
+        if (error instanceof SchedulerFullError) {
+            return reply(429, {
+                error: 'Too many runs waiting',
+                output: [`⏳ ${error.message}`],
+                queue: { queued: error.queued, perUser: error.perUser }
+            });
+        }
+
         const errorOutput = [
             `❌ Execution Error: ${error.message}`,
         ];
 
-        if (error.stderr) {
-            errorOutput.push('', '📋 Python Error Details:', error.stderr);
+        // Keep what the script printed before it failed or timed out
+        const errorStdout = unstreamed('stdout', error.stdout);
+        const errorStderr = unstreamed('stderr', error.stderr);
+        if (errorStdout) {
+            errorOutput.push('', '📄 Output before the error:', errorStdout);
+        }
+        if (errorStderr) {
+            errorOutput.push('', '📋 Python Error Details:', errorStderr);
         }
 
         errorOutput.push(
@@ -206,9 +487,11 @@ app.post('/execute', upload.array('files'), async (req, res) => {
             '• Verify your code syntax is correct'
         );
 
-        res.status(500).json({
+        reply(500, {
             error: 'Execution failed',
-            output: errorOutput
+            output: errorOutput,
+            figures: error.figures || [],
+            profile: error.profile || null
         });
     } finally {
         // Clean up temporary directory
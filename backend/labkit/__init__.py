@@ -0,0 +1 @@
+"""Helpers shared by the Python side of the /execute runner and the lab scripts."""
@@ -0,0 +1,392 @@
+"""Benchmark suite for the lab operations across image sizes.
+
+The runner kills any script that takes longer than 10 s, so this measures
+how each operation the exercises use scales from 256x256 to 8K (and beyond
+with ``--sizes``), for gray and colour input, on synthetic images or on
+real photos resized to each size::
+
+    python -m labkit.benchmarks --out bench.json
+    python -m labkit.benchmarks --ops canny,kmeans --sizes 1024,4k,8k --baseline bench.json
+
+Every case reports the median and best wall time over ``--repeat`` runs,
+throughput in megapixels per second and the peak memory the operation
+added on top of its input.  Results are written as JSON; pass an earlier
+file as ``--baseline`` to flag cases that got slower by more than
+``--tolerance`` (the exit status is 1 when any did).
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+# Named sizes as (width, height); bare integers mean a square image
+SIZES = {
+    '256': (256, 256),
+    '512': (512, 512),
+    '1024': (1024, 1024),
+    '2048': (2048, 2048),
+    '4k': (3840, 2160),
+    '8k': (7680, 4320),
+}
+DEFAULT_SIZES = tuple(SIZES)
+MODES = ('gray', 'color')
+RUNNER_TIMEOUT_S = 10.0
+
+
+def _pil_blur(img, radius=2):
+    from PIL import Image, ImageFilter
+    return np.asarray(Image.fromarray(img).filter(ImageFilter.GaussianBlur(radius=radius)))
+
+
+def _enhance_color(img, factor=2.0):
+    from PIL import Image, ImageEnhance
+    return np.asarray(ImageEnhance.Color(Image.fromarray(img)).enhance(factor))
+
+
+def _jpeg(img, quality=90):
+    ok, buf = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    if not ok:
+        raise ValueError('JPEG encoding failed')
+    return buf
+
+
+def _equalize(img):
+    from labkit.histogram import equalize
+    return equalize(img)
+
+
+def _kmeans(img):
+    from labkit.segmentation import segment
+    return segment(img, 3, seed=0)
+
+
+def _kmeans_full(img):
+    # The exercise's own call: every pixel, 10 restarts
+    data = np.float32(img.reshape(-1, 1 if img.ndim == 2 else img.shape[2]))
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+    return cv2.kmeans(data, 3, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+
+
+def _harris(img):
+    from labkit.corners import detect
+    return detect(img, 'harris', min_distance=3)
+
+
+def _shi_tomasi(img):
+    from labkit.corners import detect
+    return detect(img, 'shi_tomasi', min_distance=10, max_corners=100)
+
+
+def _gaussian_noise(img):
+    from labkit.noise import gaussian
+    return gaussian(img, sigma=25, seed=0)
+
+
+def _salt_and_pepper(img):
+    from labkit.noise import salt_and_pepper
+    return salt_and_pepper(img, 0.01, 0.01, seed=0)
+
+
+def _laplacian_abs(img):
+    from labkit.laplacian import laplacian
+    return laplacian(img)
+
+
+def _gray(img):
+    return img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+# name -> (function, modes it applies to, slow: skipped by default above 4 MP)
+OPERATIONS = {
+    'grayscale': (lambda img: cv2.cvtColor(img, cv2.COLOR_BGR2GRAY), ('color',), False),
+    'gaussian_blur': (lambda img: cv2.GaussianBlur(img, (5, 5), 0), MODES, False),
+    'pil_blur': (_pil_blur, MODES, False),
+    'laplacian': (lambda img: cv2.Laplacian(img, cv2.CV_64F), MODES, False),
+    'laplacian_abs': (_laplacian_abs, MODES, False),
+    'canny': (lambda img: cv2.Canny(img, 100, 700), MODES, False),
+    'equalize': (_equalize, MODES, False),
+    'enhance_color': (_enhance_color, ('color',), False),
+    'jpeg': (_jpeg, MODES, False),
+    'kmeans': (_kmeans, MODES, False),
+    'kmeans_full': (_kmeans_full, MODES, True),
+    'harris': (lambda img: _harris(_gray(img)), MODES, False),
+    'shi_tomasi': (lambda img: _shi_tomasi(_gray(img)), MODES, False),
+    'gaussian_noise': (_gaussian_noise, MODES, False),
+    'salt_and_pepper': (_salt_and_pepper, MODES, False),
+}
+SLOW_LIMIT_MP = 4.0
+
+
+def parse_size(spec):
+    """``'4k'``, ``'1024'`` or ``'1920x1080'`` -> ``(width, height)``."""
+    spec = str(spec).lower()
+    if spec in SIZES:
+        return SIZES[spec]
+    if 'x' in spec:
+        width, height = spec.split('x')
+        return int(width), int(height)
+    return int(spec), int(spec)
+
+
+def synthetic_image(width, height, mode='color', seed=0):
+    """Deterministic test image: gradients, filled shapes and mild noise.
+
+    Shapes give the edge and corner detectors real structure and the noise
+    keeps encoders and k-means from seeing a trivially flat image.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    img = np.empty((height, width, 3), np.uint8)
+    img[..., 0] = x
+    img[..., 1] = y
+    img[..., 2] = (x + y) / 2
+
+    scale = max(width, height) / 512
+    for _ in range(int(40 * scale)):
+        cx, cy = int(rng.integers(width)), int(rng.integers(height))
+        size = int(rng.integers(8, 60) * scale)
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        if rng.random() < 0.5:
+            cv2.rectangle(img, (cx, cy), (cx + size, cy + size), color, -1)
+        else:
+            cv2.circle(img, (cx, cy), size // 2, color, -1)
+
+    noise = rng.integers(-8, 9, size=(height, width, 1), dtype=np.int16)
+    img = np.clip(img.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if mode == 'gray' else img
+
+
+def real_image(path, width, height, mode='color'):
+    """``path`` decoded in ``mode`` and resized (area or cubic) to the size."""
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE if mode == 'gray' else cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f'Failed to read {path}. It might be corrupted or unsupported.')
+    shrinking = width * height < img.shape[0] * img.shape[1]
+    return cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_CUBIC)
+
+
+_libc = None
+
+
+def _rss_kb(field):
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith(field):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Reset the kernel's peak-RSS mark (Linux); False if unsupported.
+
+    Freed heap pages are handed back first (``malloc_trim``), otherwise an
+    operation reusing them would not raise the RSS at all.
+    """
+    global _libc
+    if _libc is None:
+        try:
+            import ctypes
+            _libc = ctypes.CDLL('libc.so.6')
+        except OSError:
+            _libc = False
+    if _libc:
+        _libc.malloc_trim(0)
+    try:
+        with open('/proc/self/clear_refs', 'w') as fh:
+            fh.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def measure(func, img, repeat=3, warmup=1):
+    """Time ``func(img)``; returns a dict of timings and peak memory.
+
+    Peak memory is the rise in peak RSS during the first timed run, which
+    counts OpenCV's and PIL's native buffers as well as NumPy's.  Where the
+    peak cannot be reset it falls back to ``tracemalloc``, which only sees
+    allocations made through Python and NumPy.
+    """
+    for _ in range(warmup):
+        func(img)
+
+    peak_kb = None
+    if _reset_peak_rss():
+        before = _rss_kb('VmRSS:')
+        started = time.perf_counter()
+        func(img)
+        times = [time.perf_counter() - started]
+        peak = _rss_kb('VmHWM:')
+        if before is not None and peak is not None:
+            peak_kb = max(peak - before, 0)
+    else:
+        tracemalloc.start()
+        started = time.perf_counter()
+        func(img)
+        times = [time.perf_counter() - started]
+        peak_kb = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        func(img)
+        times.append(time.perf_counter() - started)
+
+    return {
+        'medianMs': round(statistics.median(times) * 1000, 3),
+        'minMs': round(min(times) * 1000, 3),
+        'runs': len(times),
+        'peakMemMb': None if peak_kb is None else round(peak_kb / 1024, 2),
+    }
+
+
+def environment():
+    """Interpreter, library and machine details recorded with every run."""
+    try:
+        import PIL
+        pil_version = PIL.__version__
+    except ImportError:
+        pil_version = None
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'pillow': pil_version,
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'opencvThreads': cv2.getNumThreads(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def case_key(result):
+    return f"{result['op']}/{result['source']}/{result['size']}/{result['mode']}"
+
+
+def run(ops=None, sizes=DEFAULT_SIZES, modes=MODES, images=(), repeat=3, include_slow=False, progress=None):
+    """Run every (operation, image, size, mode) case; returns the result list.
+
+    ``images`` are real photos benchmarked alongside the synthetic image.
+    Slow operations (``kmeans_full``) are skipped above 4 MP unless
+    ``include_slow``.  ``progress`` is called with each finished result.
+    """
+    ops = list(ops or OPERATIONS)
+    unknown = set(ops) - set(OPERATIONS)
+    if unknown:
+        raise ValueError(f'Unknown operations {sorted(unknown)}; expected some of {sorted(OPERATIONS)}')
+
+    sources = [('synthetic', None)] + [(os.path.basename(path), path) for path in images]
+    results = []
+    for spec in sizes:
+        width, height = parse_size(spec)
+        megapixels = width * height / 1e6
+        for mode in modes:
+            for source, path in sources:
+                if path is None:
+                    img = synthetic_image(width, height, mode)
+                else:
+                    img = real_image(path, width, height, mode)
+                for op in ops:
+                    func, op_modes, slow = OPERATIONS[op]
+                    if mode not in op_modes or (slow and megapixels > SLOW_LIMIT_MP and not include_slow):
+                        continue
+                    result = {'op': op, 'source': source, 'size': f'{width}x{height}', 'mode': mode,
+                              'megapixels': round(megapixels, 3)}
+                    try:
+                        result.update(measure(func, img, repeat))
+                        seconds = result['medianMs'] / 1000
+                        result['mpPerS'] = round(megapixels / seconds, 2) if seconds else None
+                        result['overTimeout'] = seconds > RUNNER_TIMEOUT_S
+                        result['error'] = None
+                    except Exception as exc:
+                        result['error'] = f'{type(exc).__name__}: {exc}'
+                    results.append(result)
+                    if progress:
+                        progress(result)
+                del img
+    return results
+
+
+def compare(results, baseline, tolerance=0.2, min_delta_ms=2.0):
+    """Cases slower than ``baseline`` by more than ``tolerance`` (a fraction).
+
+    Differences under ``min_delta_ms`` are ignored so timer noise on tiny
+    images is not reported.  Returns a list of dicts sorted worst first.
+    """
+    previous = {case_key(r): r for r in baseline.get('results', []) if not r.get('error')}
+    regressions = []
+    for result in results:
+        old = previous.get(case_key(result))
+        if old is None or result.get('error'):
+            continue
+        now, then = result['medianMs'], old['medianMs']
+        if then and now > then * (1 + tolerance) and now - then >= min_delta_ms:
+            regressions.append({'case': case_key(result), 'baselineMs': then, 'medianMs': now,
+                                'ratio': round(now / then, 2)})
+    return sorted(regressions, key=lambda r: -r['ratio'])
+
+
+def format_row(result):
+    if result.get('error'):
+        return f"{case_key(result):48s} ERROR {result['error']}"
+    flag = '  > runner timeout' if result['overTimeout'] else ''
+    peak = '-' if result['peakMemMb'] is None else f"{result['peakMemMb']:.1f}"
+    return (f"{case_key(result):48s} {result['medianMs']:10.2f} ms {result['mpPerS']:9.1f} MP/s "
+            f"{peak:>8s} MB{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the lab operations across image sizes.')
+    parser.add_argument('--ops', help=f"comma-separated operations (default: all of {', '.join(OPERATIONS)})")
+    parser.add_argument('--sizes', default=','.join(DEFAULT_SIZES),
+                        help="comma-separated sizes: 256, 4k, 8k or WxH (default: %(default)s)")
+    parser.add_argument('--modes', default=','.join(MODES), help='gray, color or both (default: %(default)s)')
+    parser.add_argument('--images', nargs='*', default=[], help='real images to benchmark alongside synthetic ones')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case (default: %(default)s)')
+    parser.add_argument('--include-slow', action='store_true', help='run kmeans_full above 4 MP too')
+    parser.add_argument('--threads', type=int, default=None, help='cv2.setNumThreads for the run')
+    parser.add_argument('--out', help='write results JSON here')
+    parser.add_argument('--baseline', help='earlier results JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown before a case counts as a regression (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+    ops = args.ops.split(',') if args.ops else None
+    results = run(ops, args.sizes.split(','), args.modes.split(','), args.images, args.repeat,
+                  args.include_slow, progress=lambda r: print(format_row(r), flush=True))
+
+    report = {'environment': environment(), 'results': results}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as fh:
+            baseline = json.load(fh)
+        report['baseline'] = {'path': args.baseline, 'environment': baseline.get('environment'),
+                              'tolerance': args.tolerance,
+                              'regressions': compare(results, baseline, args.tolerance)}
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2)
+
+    regressions = report.get('baseline', {}).get('regressions', [])
+    for reg in regressions:
+        print(f"REGRESSION {reg['case']}: {reg['baselineMs']:.2f} -> {reg['medianMs']:.2f} ms "
+              f"({reg['ratio']}x)", file=sys.stderr)
+    failed = [r for r in results if r.get('error')]
+    return 1 if regressions or failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,293 @@
+"""Gaussian blur whose cost does not grow with the radius.
+
+A direct Gaussian kernel costs ``O(sigma)`` per pixel, so the lab's "turn the
+radius up" step gets slower the further students turn it.  :func:`gaussian`
+picks a strategy from ``sigma`` and the image size:
+
+``exact``
+    Separable sampled kernel truncated at ``4 * sigma``; used for small
+    sigma, where it is both cheapest and exact.
+``box``
+    Three stacked box blurs with widths chosen so their combined variance
+    matches ``sigma ** 2`` (Kovesi's method; PIL's ``GaussianBlur`` is built
+    the same way).  Running sums make each pass constant-time per pixel.
+``iir``
+    Young–van Vliet recursive filter: a third-order forward and backward
+    pass per axis, constant-time per pixel.  Pure NumPy loops over rows, so
+    it is slower than ``box`` in practice; kept for comparison.
+``downsample``
+    For very large sigma: area-downsample by ``f``, blur the small image
+    with the remaining sigma, and upsample bilinearly.
+
+``box`` and ``downsample`` are approximations, and how close they come to
+``exact`` depends on the image, not just on sigma: at sigma 30, images
+tried so far ranged from about 55 dB to over 80 dB PSNR.  Run
+:func:`accuracy_report` on the image at hand before relying on them.
+
+Accepts a NumPy array (gray or colour, any dtype) or a PIL image and returns
+the same kind; ``sigma`` is what PIL calls ``radius``::
+
+    from labkit.blur import gaussian, accuracy_report, format_report
+    soft = gaussian(pil_image, sigma=40)            # picks 'downsample'
+    for row in accuracy_report(img, sigma=12):
+        print(format_report(row))
+"""
+import math
+import time
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+METHODS = ('exact', 'box', 'iir', 'downsample')
+
+# Below this sigma the exact kernel is cheapest (box passes cost about
+# as much as an exact kernel of sigma 5 on OpenCV)
+EXACT_MAX_SIGMA = 6.0
+# Exact kernels are also used while pixels * taps stays under this budget
+EXACT_BUDGET = 1 << 22
+# From this sigma on, blur a downsampled copy
+DOWNSAMPLE_MIN_SIGMA = 20.0
+# Sigma left to apply on the downsampled image
+DOWNSAMPLE_TARGET_SIGMA = 8.0
+# Kernel half-width in sigmas
+TRUNCATE = 4.0
+BOX_PASSES = 3
+
+
+def kernel(sigma, truncate=TRUNCATE):
+    """Normalised 1-D Gaussian kernel of radius ``ceil(truncate * sigma)``."""
+    radius = max(1, int(math.ceil(truncate * sigma)))
+    x = np.arange(-radius, radius + 1, dtype=np.float64)
+    k = np.exp(-(x * x) / (2 * sigma * sigma))
+    return (k / k.sum()).astype(np.float32)
+
+
+def box_sizes(sigma, passes=BOX_PASSES):
+    """Odd box widths whose stacked variance best matches ``sigma ** 2``."""
+    ideal = math.sqrt(12 * sigma * sigma / passes + 1)
+    lower = int(ideal)
+    if lower % 2 == 0:
+        lower -= 1
+    lower = max(lower, 1)
+    upper = lower + 2
+    m = round((12 * sigma * sigma - passes * lower * lower - 4 * passes * lower - 3 * passes)
+              / (-4 * lower - 4))
+    m = min(max(m, 0), passes)
+    return [lower] * m + [upper] * (passes - m)
+
+
+def choose_method(sigma, shape):
+    """Strategy :func:`gaussian` uses for ``sigma`` on an image of ``shape``."""
+    height, width = shape[:2]
+    taps = 2 * int(math.ceil(TRUNCATE * sigma)) + 1
+    if sigma < EXACT_MAX_SIGMA or height * width * taps <= EXACT_BUDGET:
+        return 'exact'
+    factor = _downsample_factor(sigma)
+    if cv2 is not None and factor > 1 and min(height, width) >= 4 * factor:
+        return 'downsample'
+    return 'box'
+
+
+def _downsample_factor(sigma):
+    if sigma < DOWNSAMPLE_MIN_SIGMA:
+        return 1
+    return int(sigma // DOWNSAMPLE_TARGET_SIGMA)
+
+
+def _pad_axis(a, axis, pad):
+    """Reflect-101 padding (what OpenCV does by default) along one axis."""
+    widths = [(0, 0)] * a.ndim
+    widths[axis] = (pad, pad)
+    return np.pad(a, widths, mode='reflect')
+
+
+def _exact(img, sigma):
+    k = kernel(sigma)
+    if cv2 is not None:
+        return cv2.sepFilter2D(img, -1, k, k, borderType=cv2.BORDER_REFLECT_101)
+    radius = len(k) // 2
+    out = img
+    for axis in (0, 1):
+        padded = _pad_axis(out, axis, radius)
+        n = out.shape[axis]
+        acc = np.zeros_like(out)
+        for i, weight in enumerate(k):
+            acc += weight * np.take(padded, np.arange(i, i + n), axis=axis)
+        out = acc
+    return out
+
+
+def _box_axis(a, axis, width):
+    """Mean over a centred window of odd ``width`` along ``axis`` via cumsum."""
+    radius = width // 2
+    padded = _pad_axis(a, axis, radius)
+    csum = np.cumsum(padded, axis=axis, dtype=np.float64)
+    n = a.shape[axis]
+    hi = np.take(csum, np.arange(width - 1, width - 1 + n), axis=axis)
+    lo = np.take(csum, np.arange(-1, n - 1), axis=axis)
+    lo[(slice(None),) * axis + (0,)] = 0
+    return ((hi - lo) / width).astype(np.float32)
+
+
+def _box(img, sigma):
+    out = img
+    for width in box_sizes(sigma):
+        if width == 1:
+            continue
+        if cv2 is not None:
+            out = cv2.blur(out, (width, width), borderType=cv2.BORDER_REFLECT_101)
+        else:
+            out = _box_axis(_box_axis(out, 0, width), 1, width)
+    return out
+
+
+def yvv_coefficients(sigma):
+    """Young–van Vliet (1995) recursion coefficients ``(B, b1, b2, b3)``."""
+    if sigma < 0.5:
+        raise ValueError(f'The recursive filter needs sigma >= 0.5, got {sigma}')
+    if sigma >= 2.5:
+        q = 0.98711 * sigma - 0.96330
+    else:
+        q = 3.97156 - 4.14554 * math.sqrt(1 - 0.26891 * sigma)
+    b0 = 1.57825 + 2.44413 * q + 1.4281 * q * q + 0.422205 * q ** 3
+    b1 = (2.44413 * q + 2.85619 * q * q + 1.26661 * q ** 3) / b0
+    b2 = -(1.4281 * q * q + 1.26661 * q ** 3) / b0
+    b3 = 0.422205 * q ** 3 / b0
+    return 1 - (b1 + b2 + b3), b1, b2, b3
+
+
+def _recurse(rows, coeffs, reverse):
+    """Run the third-order recursion in place over the leading axis."""
+    gain, b1, b2, b3 = coeffs
+    n = len(rows)
+    order = range(n - 1, -1, -1) if reverse else range(n)
+    step = 1 if reverse else -1
+    # Samples before the start take the steady state of a constant signal
+    edge = rows[order[0]].copy()
+    rows *= gain
+    tmp = np.empty_like(edge)
+    for i in order:
+        row = rows[i]
+        for coeff, j in ((b1, 1), (b2, 2), (b3, 3)):
+            k = i + step * j
+            np.multiply(rows[k] if 0 <= k < n else edge, coeff, out=tmp)
+            row += tmp
+    return rows
+
+
+def _iir(img, sigma):
+    coeffs = yvv_coefficients(sigma)
+    # A short reflected margin absorbs the start-up transient
+    out = img
+    for axis in (0, 1):
+        n = out.shape[axis]
+        pad = min(n - 1, int(math.ceil(3 * sigma)))
+        rows = np.moveaxis(_pad_axis(out, axis, pad), axis, 0).astype(np.float32)
+        _recurse(rows, coeffs, reverse=False)
+        _recurse(rows, coeffs, reverse=True)
+        out = np.moveaxis(rows[pad:pad + n], 0, axis)
+    return np.ascontiguousarray(out)
+
+
+def _downsample(img, sigma):
+    factor = _downsample_factor(sigma)
+    if cv2 is None or factor < 2:
+        return _box(img, sigma)
+    height, width = img.shape[:2]
+    small = cv2.resize(img, (max(1, width // factor), max(1, height // factor)),
+                       interpolation=cv2.INTER_AREA)
+    # Area averaging and bilinear upsampling add about f**2 / 4 of variance
+    rest = math.sqrt(max(sigma * sigma - factor * factor / 4, 0)) / factor
+    if rest > 0:
+        small = _exact(small, rest) if rest < EXACT_MAX_SIGMA else _box(small, rest)
+    return cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+_STRATEGIES = {'exact': _exact, 'box': _box, 'iir': _iir, 'downsample': _downsample}
+
+
+def _to_array(img):
+    """``(float32 array, restore)`` where ``restore`` rebuilds the input kind."""
+    if hasattr(img, 'getbands'):  # PIL image
+        from PIL import Image
+
+        if img.mode not in ('L', 'RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+        mode = img.mode
+        arr = np.asarray(img)
+
+        def restore(out):
+            return Image.fromarray(_saturate(out, np.uint8), mode)
+        return arr.astype(np.float32), restore
+
+    arr = np.asarray(img)
+    if arr.ndim not in (2, 3):
+        raise ValueError(f'Expected a 2-D or 3-D image, got shape {arr.shape}')
+    dtype = arr.dtype
+
+    def restore(out):
+        return _saturate(out, dtype)
+    return arr.astype(np.float32), restore
+
+
+def _saturate(values, dtype):
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return np.clip(np.rint(values), info.min, info.max).astype(dtype)
+    return values.astype(dtype, copy=False)
+
+
+def gaussian(img, sigma, method='auto'):
+    """Gaussian-blur ``img`` (array or PIL image) with standard deviation ``sigma``.
+
+    ``method`` is ``'auto'`` (see :func:`choose_method`) or one of
+    :data:`METHODS`.  Integer images are rounded and saturated back to their
+    dtype.
+    """
+    if sigma <= 0:
+        return img.copy()
+    arr, restore = _to_array(img)
+    if method == 'auto':
+        method = choose_method(sigma, arr.shape)
+    elif method not in _STRATEGIES:
+        raise ValueError(f'Unknown method {method!r}; expected auto or one of {", ".join(METHODS)}')
+    return restore(_STRATEGIES[method](arr, float(sigma)))
+
+
+def accuracy_report(img, sigma, methods=METHODS):
+    """Time each method on ``img`` and compare it with the exact kernel.
+
+    Returns one dict per method with ``ms``, ``max_abs`` and ``mean_abs``
+    error (in the image's units, before rounding) and ``psnr`` in dB.
+    """
+    from labkit.metrics import psnr
+
+    arr, _ = _to_array(img)
+    peak = 255.0 if arr.max() > 1 else 1.0
+    reference = None
+    rows = []
+    for method in ('exact',) + tuple(m for m in methods if m != 'exact'):
+        start = time.perf_counter()
+        out = _STRATEGIES[method](arr, float(sigma))
+        ms = (time.perf_counter() - start) * 1e3
+        if reference is None:
+            reference = out
+        err = np.abs(out - reference)
+        row = {
+            'method': method, 'sigma': sigma, 'ms': ms,
+            'max_abs': float(err.max()), 'mean_abs': float(err.mean(dtype=np.float64)),
+            'psnr': psnr(reference, out, data_range=peak),
+        }
+        if method in methods:
+            rows.append(row)
+    return rows
+
+
+def format_report(row):
+    """One aligned line of an :func:`accuracy_report` row."""
+    return (f"{row['method']:<11} sigma={row['sigma']:<6g} {row['ms']:9.1f} ms  "
+            f"max {row['max_abs']:7.3f}  mean {row['mean_abs']:7.4f}  PSNR {row['psnr']:6.1f} dB")
@@ -0,0 +1,453 @@
+"""Grid evaluation of denoising filters against noise models.
+
+The noise exercise adds noise and shows it; this measures how well the
+blur filters used in the other labs take it out again.  Every image gets
+every noise setting, and every filter setting is scored on the result with
+PSNR and SSIM against the clean image::
+
+    python -m labkit.denoise "course/**/*.jpg" --gray --out denoise.json \
+        --noise gaussian:sigma=10,25,50 --noise salt_and_pepper:salt_prob=0.01,0.05 \
+        --filter median:ksize=3,5,7 --filter bilateral:sigma_color=25,75
+
+    from labkit import denoise
+    records = denoise.evaluate(images, denoise.DEFAULT_NOISES, denoise.DEFAULT_FILTERS)
+    print(denoise.format_table(denoise.best(records)))
+
+Parameter ranges are dicts of lists and expand to their product, and every
+setting is tried on a small test image before the grid starts, so a bad
+one (``median:ksize=4``) fails at once.  The grid runs on a process pool,
+one task per (image, noise setting) pair.  Images given as paths are read
+by the task itself, so no process holds more than the images it is
+scoring (the command line works this way); arrays are placed in shared
+memory once and mapped by each task instead of being pickled.  A task draws
+its noise from a seed derived from ``(seed, image, noise setting)``, so
+results do not depend on scheduling, and prepares the clean image's SSIM
+statistics once for all its filters (:class:`labkit.metrics.Reference`).
+A filter that still fails on some image (or an image that cannot be read)
+yields records with an ``error`` message instead of aborting the grid.
+
+Filters: ``none`` (the noisy image, as a baseline), ``gaussian`` (sigma, as
+PIL's ``GaussianBlur(radius)`` in GaussianBlur.py), ``box``, ``median``,
+``bilateral`` and ``nlmeans``.  Images must be uint8: the noise parameters
+are in 0-255 units, and other dtypes raise TypeError.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from labkit import metrics, noise
+
+DEFAULT_NOISES = {
+    'gaussian': {'sigma': [10, 25, 50]},
+    'salt_and_pepper': {'salt_prob': [0.01, 0.05], 'pepper_prob': [0.01]},
+}
+DEFAULT_FILTERS = {
+    'none': {},
+    'gaussian': {'sigma': [1, 2]},
+    'median': {'ksize': [3, 5]},
+    'bilateral': {'d': [9], 'sigma_color': [25, 75]},
+}
+METRICS = ('psnr', 'ssim')
+
+
+def none(img):
+    return img
+
+
+def gaussian(img, sigma=1.0):
+    from labkit.blur import gaussian as blur
+    return blur(img, sigma)
+
+
+def box(img, ksize=3):
+    return cv2.blur(img, (ksize, ksize))
+
+
+def median(img, ksize=3):
+    return cv2.medianBlur(img, ksize)
+
+
+def bilateral(img, d=9, sigma_color=75, sigma_space=75):
+    return cv2.bilateralFilter(img, d, sigma_color, sigma_space)
+
+
+def nlmeans(img, h=10, template=7, search=21):
+    if img.ndim == 3:
+        return cv2.fastNlMeansDenoisingColored(img, None, h, h, template, search)
+    return cv2.fastNlMeansDenoising(img, None, h, template, search)
+
+
+FILTERS = {
+    'none': none,
+    'gaussian': gaussian,
+    'box': box,
+    'median': median,
+    'bilateral': bilateral,
+    'nlmeans': nlmeans,
+}
+
+
+# What a filter or noise model raises for a setting it cannot handle
+_SETTING_ERRORS = (cv2.error, ValueError, TypeError)
+
+
+def _reason(exc):
+    # One line per record; multi-line messages end with what went wrong
+    return str(exc).strip().splitlines()[-1]
+
+
+def expand(spec):
+    """``{name: {param: [values]}}`` to a list of ``(name, params)`` settings."""
+    settings = []
+    for name, ranges in spec.items():
+        keys = list(ranges)
+        values = [v if isinstance(v, (list, tuple)) else [v] for v in ranges.values()]
+        for combo in itertools.product(*values):
+            settings.append((name, dict(zip(keys, combo))))
+    return settings
+
+
+def _check(noises, filters, channels=(3,)):
+    """Raise ValueError for unknown names or settings that fail on a small image."""
+    for name, _ in noises:
+        if name not in noise.GENERATORS:
+            raise ValueError(f'Unknown noise model {name!r}; expected one of {sorted(noise.GENERATORS)}')
+    for name, _ in filters:
+        if name not in FILTERS:
+            raise ValueError(f'Unknown filter {name!r}; expected one of {sorted(FILTERS)}')
+    for c in channels:
+        probe = np.full((32, 32) if c == 1 else (32, 32, c), 128, np.uint8)
+        for kind, settings in (('noise', noises), ('filter', filters)):
+            for name, params in settings:
+                try:
+                    if kind == 'noise':
+                        noise.apply(name, probe, seed=0, **params)
+                    else:
+                        FILTERS[name](probe, **params)
+                except _SETTING_ERRORS as exc:
+                    raise ValueError(f'Bad {kind} setting {name} {_params(params)}: {_reason(exc)}') from None
+
+
+# Shared images ----------------------------------------------------------------
+
+class SharedImages:
+    """Clean images copied once into shared memory, described by picklable specs."""
+
+    def __init__(self, images):
+        self.blocks = []
+        self.specs = []
+        try:
+            for img in images:
+                img = np.ascontiguousarray(img)
+                block = shared_memory.SharedMemory(create=True, size=max(1, img.nbytes))
+                self.blocks.append(block)
+                np.ndarray(img.shape, img.dtype, buffer=block.buf)[...] = img
+                self.specs.append((block.name, img.shape, img.dtype.str))
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Blocks this worker has mapped, by name; kept open for the worker's lifetime
+_attached = {}
+
+
+def _attach(spec):
+    name, shape, dtype = spec
+    block = _attached.get(name)
+    if block is None:
+        block = _attached[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+
+
+# The last image a worker read, as (path, flags, image): tasks are submitted
+# image by image, so a worker often scores several noise settings of one
+_last_read = None
+
+
+def _read(path, flags):
+    global _last_read
+    if _last_read is None or _last_read[:2] != (path, flags):
+        img = cv2.imread(os.fspath(path), flags)
+        if img is None:
+            raise OSError('failed to read')
+        _last_read = (path, flags, img)
+    return _last_read[2]
+
+
+def _init_worker(threads):
+    # One task per core already; keep OpenCV from oversubscribing
+    cv2.setNumThreads(threads)
+
+
+# Evaluation ---------------------------------------------------------------------
+
+def _check_image(img, name=None):
+    # Noise parameters are in 0-255 units and cv2.medianBlur only takes
+    # 8-bit input above ksize 5, so other dtypes would score nonsense
+    if img.dtype != np.uint8:
+        which = '' if name is None else f' for image {name!r}'
+        raise TypeError(f'Expected an 8-bit image, got {img.dtype}{which}; '
+                        'scale a 0..1 float image with (img * 255).round().astype(np.uint8)')
+
+
+def evaluate_one(clean, noise_setting, filters, seed, data_range=None):
+    """Score every filter setting on one noisy version of ``clean``.
+
+    Returns a list of ``(filter index, psnr, ssim, ms, error)``; a filter
+    that raises gets ``None`` scores and its message as ``error``.
+    """
+    _check_image(clean)
+    kind, params = noise_setting
+    noisy = noise.apply(kind, clean, seed=np.random.default_rng(seed), **params)
+    reference = metrics.Reference(clean, data_range)
+    rows = []
+    for index, (name, filter_params) in enumerate(filters):
+        started = time.perf_counter()
+        try:
+            denoised = FILTERS[name](noisy, **filter_params)
+        except _SETTING_ERRORS as exc:
+            rows.append((index, None, None, None, _reason(exc)))
+            continue
+        ms = (time.perf_counter() - started) * 1000
+        rows.append((index, reference.psnr(denoised), reference.ssim(denoised), ms, None))
+    return rows
+
+
+def _score(source, noise_setting, filters, seed, data_range, flags):
+    """:func:`evaluate_one` on an array, shared-memory spec or path; failures become error rows."""
+    try:
+        if isinstance(source, tuple):
+            clean = _attach(source)
+        elif isinstance(source, (str, os.PathLike)):
+            clean = _read(source, flags)
+        else:
+            clean = source
+        return evaluate_one(clean, noise_setting, filters, seed, data_range)
+    except _SETTING_ERRORS + (OSError,) as exc:
+        return [(index, None, None, None, _reason(exc)) for index in range(len(filters))]
+
+
+def evaluate(images, noises=None, filters=None, seed=0, workers=None, data_range=None, names=None, gray=False):
+    """Run the whole grid; returns one record per (image, noise, filter) setting.
+
+    ``images`` are uint8 arrays (shapes may differ) or paths, which each
+    task reads for itself (as grayscale if ``gray``).  ``noises``
+    and ``filters`` are range specs as in :data:`DEFAULT_NOISES` /
+    :data:`DEFAULT_FILTERS`.  ``workers=1`` runs in this process.  Records
+    hold ``image`` (its name, path or index), ``noise``, ``noiseParams``,
+    ``filter``, ``filterParams``, ``psnr``, ``ssim`` and ``ms`` (filter
+    time), and ``error`` (None, or why that cell has no scores).
+    """
+    images = list(images)
+    is_path = [isinstance(img, (str, os.PathLike)) for img in images]
+    names = list(names) if names is not None else [
+        os.fspath(img) if path else i for i, (img, path) in enumerate(zip(images, is_path))]
+    channels = {1 if gray else 3} if any(is_path) else set()
+    for img, name, path in zip(images, names, is_path):
+        if not path:
+            img = np.asarray(img)
+            _check_image(img, name)
+            channels.add(1 if img.ndim == 2 else img.shape[2])
+    noise_settings = expand(DEFAULT_NOISES if noises is None else noises)
+    filter_settings = expand(DEFAULT_FILTERS if filters is None else filters)
+    _check(noise_settings, filter_settings, sorted(channels) or (3,))
+    flags = cv2.IMREAD_GRAYSCALE if gray else cv2.IMREAD_COLOR
+    workers = workers or os.cpu_count() or 1
+
+    def record(i, j, row):
+        index, psnr, ssim, ms, error = row
+        noise_name, noise_params = noise_settings[j]
+        filter_name, filter_params = filter_settings[index]
+        return {
+            'image': names[i],
+            'noise': noise_name,
+            'noiseParams': noise_params,
+            'filter': filter_name,
+            'filterParams': filter_params,
+            'psnr': None if error else round(psnr, 4),
+            'ssim': None if error else round(ssim, 5),
+            'ms': None if error else round(ms, 3),
+            'error': error,
+        }
+
+    def seed_for(i, j):
+        return np.random.SeedSequence([seed, i, j])
+
+    scores = {}
+    if workers == 1:
+        for i, img in enumerate(images):
+            for j, setting in enumerate(noise_settings):
+                scores[i, j] = _score(img, setting, filter_settings, seed_for(i, j), data_range, flags)
+    else:
+        arrays = [i for i, path in enumerate(is_path) if not path]
+        with SharedImages(images[i] for i in arrays) as shared, \
+                ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(1,)) as pool:
+            sources = list(images)
+            for i, spec in zip(arrays, shared.specs):
+                sources[i] = spec
+            futures = {
+                pool.submit(_score, sources[i], setting, filter_settings, seed_for(i, j), data_range, flags): (i, j)
+                for i in range(len(images))
+                for j, setting in enumerate(noise_settings)
+            }
+            for future in as_completed(futures):
+                scores[futures[future]] = future.result()
+    # Grid order, whatever order the tasks finished in
+    return [record(i, j, row) for (i, j) in sorted(scores) for row in scores[i, j]]
+
+
+# Summaries ----------------------------------------------------------------------
+
+def _key(name, params):
+    return name, json.dumps(params, sort_keys=True)
+
+
+def summarize(records):
+    """Mean PSNR, SSIM and time per (noise setting, filter setting), over images.
+
+    Records with an ``error`` are left out.
+    """
+    groups = {}
+    for r in records:
+        if r.get('error'):
+            continue
+        key = _key(r['noise'], r['noiseParams']) + _key(r['filter'], r['filterParams'])
+        groups.setdefault(key, []).append(r)
+    summary = []
+    for rows in groups.values():
+        first = rows[0]
+        psnrs = np.array([r['psnr'] for r in rows], np.float64)
+        summary.append({
+            'noise': first['noise'],
+            'noiseParams': first['noiseParams'],
+            'filter': first['filter'],
+            'filterParams': first['filterParams'],
+            # Identical images have infinite PSNR; keep the mean finite
+            'psnr': round(float(np.mean(np.minimum(psnrs, 100.0))), 3),
+            'ssim': round(float(np.mean([r['ssim'] for r in rows])), 4),
+            'ms': round(float(np.mean([r['ms'] for r in rows])), 2),
+            'images': len(rows),
+        })
+    return summary
+
+
+def best(records, metric='ssim'):
+    """The filter setting with the highest mean ``metric`` for each noise setting."""
+    if metric not in METRICS:
+        raise ValueError(f'Unknown metric {metric!r}; expected one of {METRICS}')
+    winners = {}
+    for row in summarize(records):
+        key = _key(row['noise'], row['noiseParams'])
+        if key not in winners or row[metric] > winners[key][metric]:
+            winners[key] = row
+    return list(winners.values())
+
+
+def _params(params):
+    return ','.join(f'{k}={v}' for k, v in params.items()) or '-'
+
+
+def format_table(rows):
+    """Aligned text table of records, :func:`summarize` or :func:`best` rows."""
+    header = ('noise', 'params', 'filter', 'params', 'PSNR dB', 'SSIM', 'ms')
+    lines = [header]
+    for r in rows:
+        scores = ('error', '-', '-') if r.get('error') else (f"{r['psnr']:.2f}", f"{r['ssim']:.4f}", f"{r['ms']:.1f}")
+        lines.append((r['noise'], _params(r['noiseParams']), r['filter'], _params(r['filterParams'])) + scores)
+    widths = [max(len(line[k]) for line in lines) for k in range(len(header))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip()
+                     for line in lines)
+
+
+# Command line -------------------------------------------------------------------
+
+def parse_spec(text):
+    """``'median:ksize=3,5:iterations=1'`` to ``('median', {'ksize': [3, 5], ...})``."""
+    name, *parts = text.split(':')
+    ranges = {}
+    for part in parts:
+        key, sep, values = part.partition('=')
+        if not sep:
+            raise ValueError(f'Expected KEY=VALUES in {text!r}, got {part!r}')
+        ranges[key] = [json.loads(v) for v in values.split(',')]
+    return name, ranges
+
+
+def main(argv=None):
+    from labkit.batch import find_images
+
+    parser = argparse.ArgumentParser(description='Score denoising filters against noise models.')
+    parser.add_argument('inputs', nargs='+', help='image files, directories or glob patterns')
+    parser.add_argument('--noise', action='append', default=[], metavar='MODEL[:KEY=V1,V2...]',
+                        help='noise model and parameter ranges (repeatable; default: gaussian and salt_and_pepper)')
+    parser.add_argument('--filter', action='append', default=[], metavar='FILTER[:KEY=V1,V2...]',
+                        help='filter and parameter ranges (repeatable; default: none, gaussian, median, bilateral)')
+    parser.add_argument('--gray', action='store_true', help='evaluate on grayscale versions')
+    parser.add_argument('--metric', choices=METRICS, default='ssim', help='metric for the best-filter summary')
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: one per core)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write all records and summaries to this JSON file')
+    args = parser.parse_args(argv)
+
+    try:
+        noises = dict(parse_spec(s) for s in args.noise) or None
+        filters = dict(parse_spec(s) for s in args.filter) or None
+    except ValueError as exc:
+        print(exc, file=sys.stderr)
+        return 1
+
+    paths = find_images(args.inputs)
+    if not paths:
+        print('No images found', file=sys.stderr)
+        return 1
+
+    # Paths, not pixels: each task reads its own image, so memory stays at
+    # a few images per worker however many the patterns match
+    started = time.perf_counter()
+    try:
+        records = evaluate(paths, noises, filters, args.seed, args.workers, gray=args.gray)
+    except ValueError as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - started
+
+    failed = {}
+    for r in records:
+        if r['error']:
+            failed.setdefault((r['image'], r['error']), []).append(r)
+    for (image, error), rows in failed.items():
+        print(f'{image}: {len(rows)} scores failed: {error}', file=sys.stderr)
+
+    winners = best(records, args.metric)
+    print(format_table(winners))
+    print(f'{len(paths)} images, {len(records) - sum(map(len, failed.values()))} scores in {elapsed:.1f} s',
+          file=sys.stderr)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as fh:
+            json.dump({'summary': summarize(records), 'best': winners, 'records': records}, fh, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,300 @@
+"""Colour adjustments with PIL's semantics, with the shared work done once.
+
+``ImageEnhance.Color(img).enhance(f)`` converts the image to grayscale and
+blends towards it on every call, so a row of five factors converts five
+times.  :class:`Enhancer` derives what the adjustments need once (the
+luminance base, the image mean) and then applies each factor in one pass:
+
+``color``
+    PIL ``ImageEnhance.Color``: ``L + f * (v - L)`` per channel, blended
+    against a luminance computed once rather than once per factor.
+``brightness`` / ``contrast``
+    PIL ``ImageEnhance.Brightness`` / ``Contrast``: one 256-entry table.
+``gamma``
+    Power law ``255 * (v / 255) ** g`` (``g < 1`` brightens).
+``saturation``
+    ``space='pil'`` is ``color``; ``'hsv'`` scales S and ``'lab'`` scales
+    a*/b* around neutral, which keep hue and lightness better at large
+    factors.
+
+Results are bit-identical to PIL for the PIL adjustments, including its
+truncation and clipping.  Brightness, contrast and gamma cost one
+``cv2.LUT`` pass per factor, about a fifth of a PIL ``enhance`` call.
+Colour has no such shortcut: a PIL image is blended by PIL itself, an
+array in single-precision OpenCV arithmetic, so only the grayscale
+conversion is saved.  On a 12 MP image (one core) a single factor is at
+parity with ``ImageEnhance.Color`` (0.22 s against 0.19 s for an array,
+the PIL round trip included; 0.12 s against 0.13 s for a PIL image) and
+a row of five takes about two thirds of PIL's time (0.58 s against
+0.86 s; 0.34 s against 0.47 s).
+
+Passing a sequence of factors returns the results stacked on a new first axis::
+
+    from labkit.enhance import Enhancer
+    enh = Enhancer(pil_image)                       # or an RGB/BGR array
+    row = enh.color([0.5, 1, 1.5, 2, 3])            # (5, H, W, 3) uint8
+    brighter = enh.brightness(1.3)                  # PIL image in, PIL image out
+
+NumPy arrays are taken as RGB unless ``order='bgr'`` (``cv2.imread``); a
+fourth channel is alpha and is left untouched, as PIL does.
+"""
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+_LEVELS = np.arange(256, dtype=np.int32)
+
+
+def _blend_table(base, values, factor):
+    """PIL ``Image.blend(base, values, factor)`` for every (base, value) pair.
+
+    Mirrors libImaging: ``base + factor * (value - base)`` in single
+    precision, clipped to 0..255 and truncated.
+    """
+    base = np.asarray(base, np.int32)
+    out = base.astype(np.float32) + np.float32(factor) * (values - base).astype(np.float32)
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def _factors(factor):
+    """``(array of factors, whether the caller passed a sequence)``."""
+    if np.ndim(factor):
+        return [float(f) for f in factor], True
+    return [float(factor)], False
+
+
+def pil_luminance(rgb):
+    """PIL's ``convert('L')``: ``(19595 R + 38470 G + 7471 B + 0x8000) >> 16``."""
+    r, g, b = (rgb[..., i].astype(np.uint32) for i in range(3))
+    return ((r * 19595 + g * 38470 + b * 7471 + 0x8000) >> 16).astype(np.uint8)
+
+
+class Enhancer:
+    """Precomputed state for many adjustments of one 8-bit image."""
+
+    def __init__(self, img, order='rgb'):
+        if order not in ('rgb', 'bgr'):
+            raise ValueError(f"Unknown channel order {order!r}; expected 'rgb' or 'bgr'")
+        self.pil_mode = None
+        self._source = None
+        self._image = None
+        if hasattr(img, 'getbands'):  # PIL image
+            if img.mode not in ('L', 'RGB', 'RGBA'):
+                img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+            self.pil_mode = img.mode
+            # Converted to an array only if an adjustment needs one
+            self._source = img
+            order = 'rgb'
+            self.gray = img.mode == 'L'
+        else:
+            self._image = np.asarray(img)
+            if self._image.dtype != np.uint8:
+                raise TypeError(f'Expected an 8-bit image, got {self._image.dtype}')
+            if self._image.ndim == 3 and self._image.shape[2] not in (3, 4):
+                raise ValueError(f'Expected 1, 3 or 4 channels, got {self._image.shape[2]}')
+            self.gray = self._image.ndim == 2
+        self.order = order
+        self._luminance = None
+        self._mean = None
+        self._pil = None
+        self._degenerate = None
+
+    # Derived once ---------------------------------------------------------
+
+    @property
+    def image(self):
+        """The image as an array (H x W or H x W x C)."""
+        if self._image is None:
+            self._image = np.asarray(self._source)
+        return self._image
+
+    @property
+    def alpha(self):
+        """The alpha channel, or None."""
+        if self.gray or self.image.shape[2] == 3:
+            return None
+        return self.image[..., 3]
+
+    @property
+    def color_channels(self):
+        """The colour channels, without alpha."""
+        return self.image if self.gray else self.image[..., :3]
+
+    @property
+    def luminance(self):
+        """PIL luminance (uint8, H x W)."""
+        if self._luminance is None:
+            if self.gray:
+                self._luminance = self.image
+            elif Image is not None:
+                self._luminance = np.asarray(self._pil_images()[1])
+            else:
+                rgb = self.color_channels if self.order == 'rgb' else self.color_channels[..., ::-1]
+                self._luminance = pil_luminance(rgb)
+        return self._luminance
+
+    @property
+    def mean(self):
+        """``ImageEnhance.Contrast``'s grey level: mean luminance, rounded."""
+        if self._mean is None:
+            counts = np.bincount(self.luminance.ravel(), minlength=256)
+            self._mean = int(float(np.dot(counts, _LEVELS)) / max(counts.sum(), 1) + 0.5)
+        return self._mean
+
+    def _pil_images(self):
+        """The colour channels and their luminance as PIL images (colour order kept)."""
+        if self._pil is None:
+            channels = np.ascontiguousarray(self.color_channels)
+            values = Image.fromarray(channels)
+            if self.order == 'rgb':
+                rgb = values
+            else:
+                rgb = Image.fromarray(channels[..., ::-1] if cv2 is None
+                                      else cv2.cvtColor(channels, cv2.COLOR_BGR2RGB))
+            self._pil = values, rgb.convert('L')
+        return self._pil
+
+    # Output ------------------------------------------------------------------
+
+    def _finish(self, channels, sequence):
+        """Reattach alpha and convert back to PIL if the input was PIL."""
+        if self.alpha is not None:
+            alpha = np.broadcast_to(self.alpha[..., None], channels.shape[:-1] + (1,))
+            channels = np.concatenate([channels, alpha], axis=-1)
+        if self.pil_mode is None:
+            return channels if sequence else channels[0]
+        from PIL import Image
+
+        images = [Image.fromarray(np.ascontiguousarray(c), self.pil_mode) for c in channels]
+        return images if sequence else images[0]
+
+    def apply_tables(self, tables, sequence=True):
+        """Map the colour channels through stacked 256-entry ``tables`` (K x 256)."""
+        tables = np.asarray(tables, np.uint8).reshape(-1, 256)
+        if cv2 is None:
+            return self._finish(tables[:, self.color_channels], sequence)
+        src = np.ascontiguousarray(self.color_channels)
+        out = np.empty((len(tables),) + src.shape, np.uint8)
+        for table, dst in zip(tables, out):
+            cv2.LUT(src, table, dst=dst)
+        return self._finish(out, sequence)
+
+    # Adjustments -------------------------------------------------------------
+
+    def color(self, factor):
+        """``ImageEnhance.Color(img).enhance(factor)``; a sequence gives a stack."""
+        factors, sequence = _factors(factor)
+        if self.gray:
+            return self._finish(np.repeat(self.image[None], len(factors), axis=0), sequence)
+        if self._source is not None:
+            # PIL in, PIL out: ImageEnhance.Color's own steps, converting once
+            if self._degenerate is None:
+                mode = self._source.mode
+                self._degenerate = self._source.convert('LA' if 'A' in mode else 'L').convert(mode)
+            images = [Image.blend(self._degenerate, self._source, f) for f in factors]
+            return images if sequence else images[0]
+        out = np.empty((len(factors),) + self.color_channels.shape, np.uint8)
+        self._blend_rows(out, factors)
+        return self._finish(out, sequence)
+
+    def _blend_rows(self, out, factors, rows=16):
+        """``Image.blend`` towards the luminance, a band of rows at a time.
+
+        Single precision throughout: ``diff * f`` rounded, then ``+ L``
+        rounded, as libImaging does.  (A fused multiply-add, or a product
+        taken in double as ``cv2.scaleAdd`` does, rounds once and differs.)
+        """
+        factors = [float(np.float32(f)) for f in factors]
+        channels = self.color_channels.shape[2]
+        for y in range(0, self.image.shape[0], rows):
+            gray = self.luminance[y:y + rows]
+            values = self.color_channels[y:y + rows]
+            if cv2 is not None:
+                base = cv2.merge([gray] * channels).astype(np.float32)
+                diff = cv2.subtract(values, base, dtype=cv2.CV_32F)
+                for k, f in enumerate(factors):
+                    band = cv2.add(cv2.multiply(diff, (f,) * channels + (0,) * (4 - channels)), base)
+                    cv2.threshold(band, 255, 255, cv2.THRESH_TRUNC, dst=band)
+                    cv2.threshold(band, 0, 0, cv2.THRESH_TOZERO, dst=band)
+                    out[k, y:y + rows] = band  # Truncates, as the C cast does
+            else:
+                base = gray[..., None].astype(np.float32)
+                diff = values.astype(np.float32) - base
+                for k, f in enumerate(factors):
+                    band = diff * np.float32(f)
+                    band += base
+                    np.clip(band, 0, 255, out=band)
+                    out[k, y:y + rows] = band
+
+    def brightness(self, factor):
+        """``ImageEnhance.Brightness(img).enhance(factor)``."""
+        factors, sequence = _factors(factor)
+        return self.apply_tables([_blend_table(0, _LEVELS, f) for f in factors], sequence)
+
+    def contrast(self, factor):
+        """``ImageEnhance.Contrast(img).enhance(factor)``."""
+        factors, sequence = _factors(factor)
+        return self.apply_tables([_blend_table(self.mean, _LEVELS, f) for f in factors], sequence)
+
+    def gamma(self, exponent):
+        """``255 * (v / 255) ** exponent``, rounded; below 1 brightens."""
+        exponents, sequence = _factors(exponent)
+        tables = [np.rint(255 * (_LEVELS / 255.0) ** g) for g in exponents]
+        return self.apply_tables(np.clip(tables, 0, 255), sequence)
+
+    def saturation(self, factor, space='pil'):
+        """Scale colourfulness: ``'pil'`` (as :meth:`color`), ``'hsv'`` or ``'lab'``."""
+        if space == 'pil':
+            return self.color(factor)
+        if space not in ('hsv', 'lab'):
+            raise ValueError(f"Unknown space {space!r}; expected 'pil', 'hsv' or 'lab'")
+        if cv2 is None:
+            raise ImportError(f"saturation(space={space!r}) needs opencv-python")
+        factors, sequence = _factors(factor)
+        if self.gray:
+            return self._finish(np.repeat(self.image[None], len(factors), axis=0), sequence)
+
+        rgb = self.order == 'rgb'
+        to_space, from_space = {
+            ('hsv', True): (cv2.COLOR_RGB2HSV_FULL, cv2.COLOR_HSV2RGB_FULL),
+            ('hsv', False): (cv2.COLOR_BGR2HSV_FULL, cv2.COLOR_HSV2BGR_FULL),
+            ('lab', True): (cv2.COLOR_RGB2LAB, cv2.COLOR_LAB2RGB),
+            ('lab', False): (cv2.COLOR_BGR2LAB, cv2.COLOR_LAB2BGR),
+        }[space, rgb]
+        converted = cv2.cvtColor(np.ascontiguousarray(self.color_channels), to_space)
+        # S scales from 0; a* and b* from the neutral 128
+        centre = 0 if space == 'hsv' else 128
+        channels = (1,) if space == 'hsv' else (1, 2)
+        out = np.empty((len(factors),) + self.color_channels.shape, np.uint8)
+        work = converted.copy()
+        for k, f in enumerate(factors):
+            table = np.clip(np.rint(centre + f * (_LEVELS - centre)), 0, 255).astype(np.uint8)
+            for c in channels:
+                work[..., c] = table[converted[..., c]]
+            cv2.cvtColor(work, from_space, dst=out[k])
+        return self._finish(out, sequence)
+
+
+def color(img, factor, order='rgb'):
+    """One-shot ``ImageEnhance.Color``; see :class:`Enhancer` for many factors."""
+    return Enhancer(img, order).color(factor)
+
+
+def brightness(img, factor, order='rgb'):
+    return Enhancer(img, order).brightness(factor)
+
+
+def contrast(img, factor, order='rgb'):
+    return Enhancer(img, order).contrast(factor)
+
+
+def gamma(img, exponent, order='rgb'):
+    return Enhancer(img, order).gamma(exponent)
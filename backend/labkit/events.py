@@ -0,0 +1,220 @@
+"""Live events from a running lab script.
+
+A run used to report nothing until the script exited, so a k-means lab that
+hits the timeout showed no output at all.  With streaming on, the worker
+reports what the script does as it happens:
+
+``stdout`` / ``stderr``
+    ``{"type": "stdout", "text": "iteration 3\\n"}``, one event per line.
+``figure``
+    A figure as captured by :mod:`labkit.figures`, sent when ``plt.show()``
+    is called rather than at the end of the run.
+``progress``
+    Reported by the script itself::
+
+        from labkit.events import progress
+        for i in range(iterations):
+            ...
+            progress(i + 1, iterations, 'k-means')
+
+    ``progress`` is a no-op outside a streaming run, so scripts keep working
+    unchanged when run locally.
+``result``
+    The final response, the same dict a non-streaming run returns.
+
+Every event also carries ``t``, seconds since the run started.  The pooled
+worker forwards events to the runner as ``{"id": ..., "event": {...}}``
+lines of its existing protocol, and the runner turns them into server-sent
+events.  Standalone, events are written as length-prefixed frames (a
+4-byte big-endian length, then UTF-8 JSON) to stdout or a Unix socket::
+
+    python -m labkit.events script.py --socket /tmp/run.sock --timeout 10
+
+:func:`read_frames` decodes that stream.
+"""
+import argparse
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+_LENGTH = struct.Struct('>I')
+# Frames above this are refused when reading: a corrupt length prefix
+# should not make the reader allocate gigabytes
+MAX_FRAME = 64 * 1024 * 1024
+# Progress events closer together than this are coalesced
+PROGRESS_INTERVAL = 0.1
+
+_sink = None
+_last_progress = 0.0
+
+
+def pack(event):
+    """One frame: length prefix plus the JSON-encoded ``event``."""
+    body = json.dumps(event, separators=(',', ':')).encode('utf-8')
+    return _LENGTH.pack(len(body)) + body
+
+
+def read_frames(stream):
+    """Yield events from a binary stream of frames until it ends.
+
+    ``stream`` is a file object opened in binary mode or a socket.
+    """
+    read = stream.recv if isinstance(stream, socket.socket) else stream.read
+
+    def exactly(n):
+        chunks = []
+        while n:
+            chunk = read(n)
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            n -= len(chunk)
+        return b''.join(chunks)
+
+    while True:
+        header = exactly(_LENGTH.size)
+        if header is None:
+            return
+        (size,) = _LENGTH.unpack(header)
+        if size > MAX_FRAME:
+            raise ValueError(f'Frame of {size} bytes exceeds the {MAX_FRAME} byte limit')
+        body = exactly(size)
+        if body is None:
+            raise ValueError('Stream ended in the middle of a frame')
+        yield json.loads(body)
+
+
+class FrameWriter:
+    """Thread-safe writer of frames to a binary file object or socket."""
+
+    def __init__(self, target):
+        self.target = target
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        frame = pack(event)
+        with self._lock:
+            if isinstance(self.target, socket.socket):
+                self.target.sendall(frame)
+            else:
+                self.target.write(frame)
+                self.target.flush()
+
+
+class LineSplitter:
+    """Feed chunks of a byte stream, get ``on_line(text)`` per complete line."""
+
+    def __init__(self, on_line):
+        self.on_line = on_line
+        self._partial = b''
+
+    def feed(self, data):
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self.on_line(line.decode('utf-8', 'replace') + '\n')
+
+    def close(self):
+        """Pass on a last line that had no newline."""
+        if self._partial:
+            self.on_line(self._partial.decode('utf-8', 'replace'))
+            self._partial = b''
+
+
+def output_lines(kind, emit_event):
+    """:class:`LineSplitter` that emits ``{"type": kind, "text": line}`` events."""
+    return LineSplitter(lambda text: emit_event({'type': kind, 'text': text}))
+
+
+def install(sink):
+    """Send events from this process (progress, figures) to ``sink(event)``."""
+    global _sink, _last_progress
+    _sink = sink
+    _last_progress = 0.0
+
+
+def emit(event):
+    """Send ``event`` if a streaming run is listening; returns whether it was sent."""
+    if _sink is None:
+        return False
+    _sink(event)
+    return True
+
+
+def progress(value, total=None, label=''):
+    """Report progress from a script: ``value`` of ``total`` (if known).
+
+    Calls faster than every ``PROGRESS_INTERVAL`` seconds are dropped,
+    except the final one (``value >= total``), so it is safe in tight loops.
+    """
+    global _last_progress
+    if _sink is None:
+        return
+    now = time.monotonic()
+    final = total is not None and value >= total
+    if not final and now - _last_progress < PROGRESS_INTERVAL:
+        return
+    _last_progress = now
+    event = {'type': 'progress', 'value': value, 'label': str(label)}
+    if total is not None:
+        event['total'] = total
+    _sink(event)
+
+
+def stamp(emit_event, started_at):
+    """Wrap ``emit_event`` so every event gets ``t`` relative to ``started_at``."""
+    def stamped(event):
+        emit_event(dict(event, t=round(time.monotonic() - started_at, 4)))
+    return stamped
+
+
+def _connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    return sock
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a lab script and stream its events as frames.')
+    parser.add_argument('script')
+    parser.add_argument('--socket', metavar='PATH', help='Unix socket to send frames to (default: stdout)')
+    parser.add_argument('--timeout', type=float, default=10.0)
+    parser.add_argument('--profile', default=None, help='labkit.profiler level (default: off)')
+    args = parser.parse_args(argv)
+
+    from labkit import profiler, worker
+
+    if args.socket:
+        target = _connect(args.socket)
+    else:
+        target = sys.stdout.buffer
+    write = FrameWriter(target)
+    script = os.path.abspath(args.script)
+    cwd = os.path.dirname(script)
+    profile = profiler.options(args.profile or 'off')
+
+    worker.preload()
+    started = time.monotonic()
+    if worker.CAN_FORK:
+        result = worker.run_forked(script, cwd, args.timeout, profile=profile, on_event=write)
+    else:
+        # Without fork the output is only known at the end; send it as events anyway
+        result = worker.run_in_process(script, cwd, profile=profile)
+        for kind in ('stdout', 'stderr'):
+            if result[kind]:
+                write({'type': kind, 'text': result[kind]})
+        for figure in result['figures']:
+            write(dict(figure, type='figure'))
+    result['elapsedMs'] = round((time.monotonic() - started) * 1000, 2)
+    write({'type': 'result', **result})
+    if isinstance(target, socket.socket):
+        target.close()
+    return 0 if result['exitCode'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
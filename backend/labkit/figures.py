@@ -0,0 +1,215 @@
+"""Headless capture of matplotlib figures.
+
+Lab scripts end with ``plt.show()``, which draws nothing on the server.
+``install()`` switches matplotlib to the Agg backend and replaces
+``plt.show`` with a hook that encodes every open figure to PNG or WebP and
+keeps it for the runner to return in its JSON result.
+
+Figures made only of ``imshow`` panels with hidden axes (the usual
+"original vs processed" layout) take a fast path: each panel's array is
+colour-mapped and encoded directly, skipping matplotlib rasterisation.
+"""
+import base64
+import io
+import os
+import sys
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+FORMATS = ('png', 'webp')
+
+DEFAULTS = {
+    'format': os.environ.get('LABKIT_FIGURE_FORMAT', 'png'),
+    'dpi': float(os.environ.get('LABKIT_FIGURE_DPI', '100')),
+    'max_dim': int(os.environ.get('LABKIT_FIGURE_MAX_DIM', '1600')),
+    'quality': int(os.environ.get('LABKIT_FIGURE_QUALITY', '90')),
+}
+
+_captured = []
+_options = dict(DEFAULTS)
+# Called with each figure as it is captured (see labkit.events)
+_on_capture = None
+
+
+def encode_image(rgb, fmt='png', max_dim=None, quality=90):
+    """Encode an RGB(A) or gray uint8 array, shrinking it to fit ``max_dim``."""
+    if fmt not in FORMATS:
+        raise ValueError(f'Unsupported figure format {fmt!r}; expected one of {FORMATS}')
+
+    height, width = rgb.shape[:2]
+    if max_dim and max(height, width) > max_dim:
+        scale = max_dim / max(height, width)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        if cv2 is not None:
+            rgb = cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+        else:
+            from PIL import Image
+            rgb = np.asarray(Image.fromarray(rgb).resize(size, Image.BOX))
+        height, width = rgb.shape[:2]
+
+    if cv2 is not None:
+        if rgb.ndim == 3:
+            code = cv2.COLOR_RGBA2BGRA if rgb.shape[2] == 4 else cv2.COLOR_RGB2BGR
+            rgb = cv2.cvtColor(rgb, code)
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality] if fmt == 'webp' else [cv2.IMWRITE_PNG_COMPRESSION, 3]
+        ok, buf = cv2.imencode('.' + fmt, rgb, params)
+        if not ok:
+            raise ValueError(f'Failed to encode figure as {fmt}')
+        data = buf.tobytes()
+    else:
+        from PIL import Image
+        out = io.BytesIO()
+        Image.fromarray(rgb).save(out, format=fmt.upper(), quality=quality)
+        data = out.getvalue()
+
+    return {'format': fmt, 'width': width, 'height': height, 'bytes': len(data), 'data': data}
+
+
+def _panel_images(fig):
+    """Return the AxesImage of every panel if ``fig`` is imshow-only, else None."""
+    if fig.texts or fig.legends or fig.images or fig.patches or fig.lines:
+        return None
+    images = []
+    for ax in fig.axes:
+        if not ax.get_visible():
+            continue
+        if ax.axison or len(ax.images) != 1:
+            return None
+        if ax.lines or ax.collections or ax.patches or ax.texts or ax.artists or ax.get_legend():
+            return None
+        images.append((ax, ax.images[0]))
+    return images or None
+
+
+def _shrink(array, max_dim):
+    """Area-downsample ``array`` so its longest side is at most ``max_dim``."""
+    height, width = array.shape[:2]
+    if not max_dim or max(height, width) <= max_dim:
+        return array
+    scale = max_dim / max(height, width)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if cv2 is None:
+        # Nearest-neighbour stride keeps the fallback dependency-free
+        step = int(np.ceil(1 / scale))
+        return array[::step, ::step]
+    if array.dtype not in (np.uint8, np.uint16, np.float32, np.float64):
+        array = array.astype(np.float32)
+    return cv2.resize(array, size, interpolation=cv2.INTER_AREA)
+
+
+def _panel_rgba(image, max_dim):
+    """Colour-map an AxesImage's data the way matplotlib would display it.
+
+    The raw array is downsampled before colour mapping, so a 12 MP panel is
+    only mapped at display size.  The norm was already fitted to the full
+    data by ``imshow``, so colours match the full-size rendering.
+    """
+    array = image.get_array()
+    small = _shrink(np.ma.getdata(array), max_dim)
+    if np.ma.is_masked(array):
+        small = np.ma.masked_invalid(small)
+    rgba = image.to_rgba(small, bytes=True)
+    if image.origin == 'lower':
+        rgba = rgba[::-1]
+    # Drop alpha when it carries no information
+    if rgba.shape[2] == 4 and (rgba[..., 3] == 255).all():
+        rgba = rgba[..., :3]
+    return np.ascontiguousarray(rgba)
+
+
+def _suptitle(fig):
+    """``fig.get_suptitle()``, which only exists from matplotlib 3.8 on."""
+    if hasattr(fig, 'get_suptitle'):
+        return fig.get_suptitle()
+    title = getattr(fig, '_suptitle', None)
+    return title.get_text() if title else ''
+
+
+def _render(fig, dpi, max_dim):
+    """Rasterise ``fig`` with Agg at a DPI that keeps it within ``max_dim``."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    width_in, height_in = fig.get_size_inches()
+    if max_dim:
+        dpi = min(dpi, max_dim / max(width_in, height_in))
+    fig.set_dpi(dpi)
+    canvas = FigureCanvasAgg(fig)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba())[..., :3].copy()
+
+
+def capture_figure(fig, fmt=None, dpi=None, max_dim=None, quality=None, fast=True):
+    """Encode one figure; returns a JSON-ready dict with base64 image data."""
+    fmt = fmt or _options['format']
+    dpi = dpi or _options['dpi']
+    max_dim = max_dim or _options['max_dim']
+    quality = quality or _options['quality']
+
+    panels = _panel_images(fig) if fast else None
+    if panels:
+        images = []
+        for ax, image in panels:
+            encoded = encode_image(_panel_rgba(image, max_dim), fmt, None, quality)
+            encoded['title'] = ax.get_title()
+            images.append(encoded)
+        mode = 'panels'
+    else:
+        encoded = encode_image(_render(fig, dpi, max_dim), fmt, None, quality)
+        encoded['title'] = _suptitle(fig)
+        images = [encoded]
+        mode = 'rendered'
+
+    for encoded in images:
+        encoded['data'] = base64.b64encode(encoded['data']).decode('ascii')
+    return {'mode': mode, 'images': images}
+
+
+def capture_open_figures(**options):
+    """Encode and close every open figure, appending them to the captured list."""
+    import matplotlib.pyplot as plt
+
+    for num in plt.get_fignums():
+        fig = plt.figure(num)
+        entry = capture_figure(fig, **options)
+        entry['index'] = len(_captured)
+        _captured.append(entry)
+        plt.close(fig)
+        if _on_capture is not None:
+            _on_capture(entry)
+    return _captured
+
+
+def _show(*args, **kwargs):
+    capture_open_figures()
+
+
+def install(on_capture=None, **options):
+    """Use the Agg backend and route ``plt.show()`` into the capture list.
+
+    ``on_capture(entry)``, if given, is called with each figure as soon as
+    it is captured.
+    """
+    global _on_capture
+    _on_capture = on_capture
+    os.environ['MPLBACKEND'] = 'Agg'
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+    import matplotlib.pyplot as plt
+
+    _options.update({k: v for k, v in options.items() if v is not None})
+    plt.show = _show
+    _captured.clear()
+
+
+def collect():
+    """Capture figures the script left open and return everything captured."""
+    if 'matplotlib.pyplot' in sys.modules:
+        capture_open_figures()
+    figures = list(_captured)
+    _captured.clear()
+    return figures
@@ -0,0 +1,202 @@
+"""Content-addressed cache of decoded uploads.
+
+Students rerun the same script on the same upload many times, and every
+run used to decode the JPEG again.  ``imread`` is a drop-in replacement for
+``cv2.imread`` that keys the decoded array on the SHA-256 of the file bytes
+and the read flags, and keeps it in shared memory (``/dev/shm`` on Linux)::
+
+    from labkit.images import imread
+    img = imread('sample.jpg', cv2.IMREAD_GRAYSCALE)
+
+A hit maps the cached pixels copy-on-write (``MAP_PRIVATE``), so there is no
+decode and no copy, and a script that draws on its image never touches the
+cached entry.  The runner passes the upload hashes it already computed in
+``LABKIT_UPLOADS``, keyed by the saved file's resolved path along with its
+size and mtime, so a hit on an unchanged upload does not even read the
+file; any other file, or an upload the script has overwritten, is hashed.  Entries are evicted
+least-recently-used once the cache exceeds ``LABKIT_DECODE_CACHE_MB``.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# magic, dtype string, ndim, up to three dimensions
+_HEADER = struct.Struct('<8s8sI3Q')
+_MAGIC = b'LKIMG001'
+
+BUDGET_BYTES = int(float(os.environ.get('LABKIT_DECODE_CACHE_MB', '512')) * 1024 * 1024)
+
+
+def cache_dir():
+    """Directory holding cache entries; tmpfs when the platform has one."""
+    path = os.environ.get('LABKIT_DECODE_CACHE_DIR')
+    if not path:
+        base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        path = os.path.join(base, 'labkit-decoded')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _recorded(filename):
+    """The runner's record for ``filename``, if it is an upload it saved and
+    the file still has the size and mtime the record was taken at."""
+    try:
+        known = json.loads(os.environ.get('LABKIT_UPLOADS', '{}'))
+    except ValueError:
+        return None
+    record = known.get(os.path.realpath(filename))
+    if not isinstance(record, dict):
+        return None
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    # A script that rewrote the file (cv2.imwrite) changes at least the mtime
+    if stat.st_size != record.get('size') or str(stat.st_mtime_ns) != str(record.get('mtimeNs')):
+        return None
+    return record.get('sha256')
+
+
+def upload_hash(filename):
+    """SHA-256 of a file, taken from the runner when it recorded this very file."""
+    digest = _recorded(filename)
+    if digest:
+        return digest
+
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _entry_path(digest, flags):
+    return os.path.join(cache_dir(), f'{digest}-{flags}.img')
+
+
+def _load_entry(path):
+    """Map a cache entry copy-on-write and return it as an ndarray."""
+    with open(path, 'rb') as fh:
+        header = fh.read(_HEADER.size)
+        magic, dtype, ndim, *dims = _HEADER.unpack(header)
+        if magic != _MAGIC:
+            raise ValueError(f'Corrupt cache entry {path}')
+        shape = tuple(dims[:ndim])
+        if hasattr(mmap, 'MAP_PRIVATE'):
+            buf = mmap.mmap(fh.fileno(), 0, flags=mmap.MAP_PRIVATE,
+                            prot=mmap.PROT_READ | mmap.PROT_WRITE)
+        else:
+            # Windows has no MAP_PRIVATE; ACCESS_COPY gives the same semantics
+            buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_COPY)
+    # Touch for LRU ordering
+    os.utime(path)
+    return np.ndarray(shape, dtype=np.dtype(dtype.rstrip(b'\0').decode()), buffer=buf, offset=_HEADER.size)
+
+
+def _store_entry(path, array):
+    """Write ``array`` to the cache atomically, then enforce the budget."""
+    array = np.ascontiguousarray(array)
+    dims = list(array.shape) + [0] * (3 - array.ndim)
+    header = _HEADER.pack(_MAGIC, array.dtype.str.encode(), array.ndim, *dims)
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(header)
+            fh.write(memoryview(array).cast('B'))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    evict(BUDGET_BYTES)
+
+
+def evict(budget=None):
+    """Drop least-recently-used entries until the cache fits ``budget`` bytes."""
+    budget = BUDGET_BYTES if budget is None else budget
+    directory = cache_dir()
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.img'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= budget:
+            break
+        try:
+            # Mapped readers keep their pages; unlinking only drops the name
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
+
+
+def cached(filename, tag, compute):
+    """Array derived from an upload, cached like a decode.
+
+    ``tag`` names the derivation and its parameters (e.g.
+    ``'canny-nms-a3-l1'``); ``compute()`` runs only on a miss.
+    """
+    if BUDGET_BYTES <= 0:
+        return compute()
+    try:
+        path = _entry_path(upload_hash(filename), tag)
+    except OSError:
+        return compute()
+
+    try:
+        return _load_entry(path)
+    except (FileNotFoundError, ValueError, struct.error):
+        pass
+
+    array = compute()
+    try:
+        _store_entry(path, array)
+    except OSError:
+        pass
+    return array
+
+
+def imread(filename, flags=None):
+    """Cached ``cv2.imread``: returns None for unreadable files, like OpenCV."""
+    if cv2 is None:
+        raise ImportError('labkit.images.imread needs opencv-python')
+    if flags is None:
+        flags = cv2.IMREAD_COLOR
+    if BUDGET_BYTES <= 0:
+        return cv2.imread(filename, flags)
+
+    try:
+        path = _entry_path(upload_hash(filename), flags)
+    except OSError:
+        return None
+
+    try:
+        return _load_entry(path)
+    except (FileNotFoundError, ValueError, struct.error):
+        pass
+
+    img = cv2.imread(filename, flags)
+    if img is not None:
+        try:
+            _store_entry(path, img)
+        except OSError:
+            # A full tmpfs only costs us the cache
+            pass
+    return img
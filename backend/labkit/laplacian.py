@@ -0,0 +1,205 @@
+"""Second-derivative filters with small intermediates.
+
+The Laplacian exercise runs ``cv2.Laplacian(img, cv2.CV_64F)`` on a colour
+image (24 bytes per pixel) and then ``np.uint8(np.absolute(...))``, which
+makes two more full-size copies and wraps values above 255 around instead
+of saturating them.  Here the derivative is taken into int16 (float32 for
+the Laplacian of Gaussian) one band of rows at a time, and
+``cv2.convertScaleAbs`` takes the absolute value and saturates to uint8 in
+the same pass, so the only full-size allocation is the output::
+
+    from labkit import laplacian
+    edges = laplacian.laplacian(img)               # uint8, |L| saturated
+    blobs = laplacian.log(img, sigma=3, gray=True)
+    pyr = laplacian.LaplacianPyramid(img.shape, levels=4)
+    bands = pyr.build(img)                         # int16 detail levels
+    assert (pyr.reconstruct() == img).all()
+
+Bands overlap by the kernel radius and bands on the image edge see the
+same border extrapolation as the whole image, so results are identical to
+running the filter on the full image.
+"""
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# Rows per band; the int16 intermediate is band * width * channels * 2 bytes
+BAND_ROWS = 256
+
+
+def _require_cv2():
+    if cv2 is None:
+        raise ImportError('labkit.laplacian needs opencv-python')
+
+
+def _prepare(img, gray):
+    img = np.asarray(img)
+    if gray and img.ndim == 3:
+        code = cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        img = cv2.cvtColor(img, code)
+    return img
+
+
+def _output(out, shape, dtype):
+    if out is None:
+        return np.empty(shape, dtype)
+    if out.shape != shape or out.dtype != dtype:
+        raise ValueError(f'out must have shape {shape} and dtype {np.dtype(dtype)}, '
+                         f'got {out.shape} and {out.dtype}')
+    return out
+
+
+def _bands(height, halo, band_rows):
+    """Yield ``(y0, y1, py0, py1)``: band interiors and their padded bounds."""
+    for y0 in range(0, height, band_rows):
+        y1 = min(height, y0 + band_rows)
+        yield y0, y1, max(0, y0 - halo), min(height, y1 + halo)
+
+
+# Largest |L| of 8-bit input for the 3x3 kernels: 4 * 255 for ksize=1
+# (0 1 0 / 1 -4 1 / 0 1 0), 8 * 255 for ksize=3 (2 0 2 / 0 -8 0 / 2 0 2)
+_MAX_RESPONSE = {1: 4 * 255, 3: 8 * 255}
+
+
+def _depth(img, ksize, scale):
+    # 8-bit input stays within int16 for the 3x3 kernels unless ``scale``
+    # pushes it past; wider kernels and other inputs use float32
+    bound = _MAX_RESPONSE.get(ksize) if img.dtype == np.uint8 else None
+    if bound is not None and abs(scale) * bound <= np.iinfo(np.int16).max:
+        return cv2.CV_16S
+    return cv2.CV_32F
+
+
+def laplacian(img, ksize=1, scale=1.0, gray=False, signed=False, out=None, band_rows=BAND_ROWS):
+    """Laplacian of ``img``; per channel unless ``gray``.
+
+    Returns ``|scale * L|`` saturated to uint8 by default, or the signed
+    response with ``signed=True``: int16 for 8-bit input with ``ksize <= 3``
+    when ``scale`` keeps it in range, else float32.  ``out`` may be a preallocated result.
+    """
+    _require_cv2()
+    img = _prepare(img, gray)
+    depth = _depth(img, ksize, scale)
+    if signed:
+        out = _output(out, img.shape, np.int16 if depth == cv2.CV_16S else np.float32)
+    else:
+        out = _output(out, img.shape, np.uint8)
+
+    halo = max(1, ksize // 2)
+    for y0, y1, py0, py1 in _bands(img.shape[0], halo, band_rows):
+        band = cv2.Laplacian(img[py0:py1], depth, ksize=ksize, scale=scale)
+        band = band[y0 - py0:y1 - py0]
+        if signed:
+            out[y0:y1] = band
+        else:
+            cv2.convertScaleAbs(band, dst=out[y0:y1])
+    return out
+
+
+def log(img, sigma, ksize=1, gray=False, normalize=False, signed=False, out=None,
+        band_rows=BAND_ROWS):
+    """Laplacian of Gaussian: ``cv2.GaussianBlur`` then :func:`laplacian`.
+
+    The blur is kept in float32 rather than rounded back to 8 bits, which
+    matters for the small second differences of a smooth image.
+    ``normalize`` multiplies by ``sigma ** 2`` so responses are comparable
+    across scales.  Output is ``|LoG|`` saturated to uint8, or float32 with
+    ``signed=True``.
+    """
+    _require_cv2()
+    img = _prepare(img, gray)
+    out = _output(out, img.shape, np.float32 if signed else np.uint8)
+    scale = sigma * sigma if normalize else 1.0
+
+    # Kernel radius cv2.GaussianBlur derives from sigma for float input
+    blur_radius = (int(round(sigma * 4 * 2 + 1)) | 1) // 2
+    height = img.shape[0]
+    for y0, y1, py0, py1 in _bands(height, max(1, ksize // 2), band_rows):
+        # Blur a band wide enough that its rows we keep are exact
+        by0, by1 = max(0, py0 - blur_radius), min(height, py1 + blur_radius)
+        blurred = cv2.GaussianBlur(img[by0:by1].astype(np.float32), (0, 0), sigma,
+                                   borderType=cv2.BORDER_REFLECT_101)
+        band = cv2.Laplacian(blurred[py0 - by0:py1 - by0], cv2.CV_32F, ksize=ksize, scale=scale)
+        band = band[y0 - py0:y1 - py0]
+        if signed:
+            out[y0:y1] = band
+        else:
+            cv2.convertScaleAbs(band, dst=out[y0:y1])
+    return out
+
+
+def _level_shapes(shape, levels):
+    shapes = [tuple(shape)]
+    for _ in range(levels - 1):
+        h, w = shapes[-1][:2]
+        shapes.append(((h + 1) // 2, (w + 1) // 2) + tuple(shape[2:]))
+    return shapes
+
+
+class LaplacianPyramid:
+    """Laplacian pyramid with every level allocated once, up front.
+
+    ``build(img)`` fills ``levels[:-1]`` with detail bands ``G[i] -
+    pyrUp(G[i + 1])`` and ``levels[-1]`` with the coarsest Gaussian level.
+    For 8-bit input the bands are int16 and ``reconstruct()`` is exact; for
+    float input everything is float32.  Building the pyramid of another image
+    of the same shape (video frames, a parameter sweep) reuses the buffers.
+    """
+
+    def __init__(self, shape, levels=4, dtype=np.uint8, gray=False):
+        _require_cv2()
+        if gray and len(shape) == 3:
+            shape = tuple(shape[:2])
+        self.gray = gray
+        self.dtype = np.dtype(dtype)
+        exact = self.dtype == np.uint8
+        self.band_dtype = np.dtype(np.int16 if exact else np.float32)
+        self.work_dtype = np.dtype(np.uint8 if exact else np.float32)
+
+        shapes = _level_shapes(shape, levels)
+        self.gaussian = [np.empty(s, self.work_dtype) for s in shapes]
+        self.levels = [np.empty(s, self.band_dtype) for s in shapes[:-1]]
+        self.levels.append(self.gaussian[-1])
+        # pyrUp scratch, one per level so reconstruct() can reuse them too
+        self._up = [np.empty(s, self.work_dtype) for s in shapes[:-1]]
+
+    def build(self, img):
+        """Fill the pyramid from ``img``; returns ``levels``."""
+        img = _prepare(img, self.gray)
+        if img.shape != self.gaussian[0].shape:
+            raise ValueError(f'Expected an image of shape {self.gaussian[0].shape}, got {img.shape}')
+        np.copyto(self.gaussian[0], img, casting='unsafe')
+        for i in range(len(self.levels) - 1):
+            cv2.pyrDown(self.gaussian[i], dst=self.gaussian[i + 1],
+                        dstsize=self.gaussian[i + 1].shape[1::-1])
+        depth = cv2.CV_16S if self.band_dtype == np.int16 else cv2.CV_32F
+        for i in range(len(self.levels) - 1):
+            up = self._pyr_up(self.gaussian[i + 1], i)
+            cv2.subtract(self.gaussian[i], up, dst=self.levels[i], dtype=depth)
+        return self.levels
+
+    def _pyr_up(self, src, i):
+        return cv2.pyrUp(src, dst=self._up[i], dstsize=self._up[i].shape[1::-1])
+
+    def reconstruct(self, out=None):
+        """Collapse the pyramid back to an image (in the working dtype).
+
+        The Gaussian buffers are reused as scratch, so edit ``levels``, not
+        ``gaussian``, before reconstructing.
+        """
+        out = _output(out, self.gaussian[0].shape, self.work_dtype)
+        depth = cv2.CV_8U if self.work_dtype == np.uint8 else cv2.CV_32F
+        current = self.levels[-1]
+        for i in range(len(self.levels) - 2, -1, -1):
+            up = self._pyr_up(current, i)
+            target = out if i == 0 else self.gaussian[i]
+            cv2.add(up, self.levels[i], dst=target, dtype=depth)
+            current = target
+        return out
+
+    def display(self, i, scale=1.0):
+        """Level ``i`` as uint8 for showing: ``|scale * level|`` saturated."""
+        return cv2.convertScaleAbs(self.levels[i], alpha=scale)
@@ -0,0 +1,123 @@
+"""Image quality metrics: MSE, PSNR and SSIM.
+
+All metrics are vectorised over whole images.  SSIM uses the usual 11x11
+Gaussian window (sigma 1.5) and computes its local means, variances and
+covariance with separable Gaussian filtering in float32, rather than
+looping over windows.  :class:`Reference` keeps the reference image's
+statistics for scoring many candidates against the same original.
+"""
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+
+def _data_range(a, data_range):
+    if data_range is not None:
+        return float(data_range)
+    if np.issubdtype(a.dtype, np.integer):
+        return float(np.iinfo(a.dtype).max)
+    return 1.0
+
+
+def mse(a, b):
+    """Mean squared error between two images of the same shape."""
+    a = np.asarray(a)
+    b = np.asarray(b)
+    if a.shape != b.shape:
+        raise ValueError(f'Shape mismatch: {a.shape} vs {b.shape}')
+    diff = np.subtract(a, b, dtype=np.float32).ravel()
+    return float(np.dot(diff, diff.astype(np.float64)) / diff.size)
+
+
+def psnr(a, b, data_range=None):
+    """Peak signal-to-noise ratio in dB (``inf`` for identical images)."""
+    err = mse(a, b)
+    if err == 0:
+        return float('inf')
+    peak = _data_range(np.asarray(a), data_range)
+    return float(10 * np.log10(peak * peak / err))
+
+
+def _gaussian_kernel(size, sigma):
+    x = np.arange(size, dtype=np.float64) - (size - 1) / 2
+    k = np.exp(-(x * x) / (2 * sigma * sigma))
+    return (k / k.sum()).astype(np.float32)
+
+
+def _filter(img, kernel):
+    """Separable Gaussian filter with reflected borders."""
+    if cv2 is not None:
+        return cv2.sepFilter2D(img, -1, kernel, kernel, borderType=cv2.BORDER_REFLECT)
+    pad = len(kernel) // 2
+    out = np.pad(img, [(pad, pad), (pad, pad)] + [(0, 0)] * (img.ndim - 2), mode='symmetric')
+    for axis in (0, 1):
+        out = np.apply_along_axis(lambda v: np.convolve(v, kernel, mode='valid'), axis, out)
+    return out.astype(np.float32)
+
+
+class Reference:
+    """A reference image prepared for comparison with many candidates.
+
+    Its SSIM window statistics (local mean and variance) are computed once,
+    so each :meth:`ssim` call only filters the candidate and the product
+    with it: three windowed passes instead of five.
+    """
+
+    def __init__(self, a, data_range=None, win_size=11, sigma=1.5, k1=0.01, k2=0.03):
+        self.image = np.asarray(a)
+        self.peak = _data_range(self.image, data_range)
+        self.c1 = (k1 * self.peak) ** 2
+        self.c2 = (k2 * self.peak) ** 2
+        self.kernel = _gaussian_kernel(win_size, sigma)
+
+        self._x = self.image.astype(np.float32)
+        self._mu_x = _filter(self._x, self.kernel)
+        self._mu_xx = self._mu_x * self._mu_x
+        # E[x^2] - mu^2, in place to limit temporaries
+        self._var_x = _filter(self._x * self._x, self.kernel)
+        self._var_x -= self._mu_xx
+
+    def _check(self, b):
+        b = np.asarray(b)
+        if b.shape != self.image.shape:
+            raise ValueError(f'Shape mismatch: {self.image.shape} vs {b.shape}')
+        return b
+
+    def ssim_map(self, b):
+        """Per-pixel SSIM of ``b`` against the reference."""
+        y = self._check(b).astype(np.float32)
+        mu_y = _filter(y, self.kernel)
+        yy = _filter(y * y, self.kernel)
+        yy -= mu_y * mu_y
+        xy = _filter(self._x * y, self.kernel)
+        mu_xy = self._mu_x * mu_y
+        xy -= mu_xy
+
+        num = (2 * mu_xy + self.c1) * (2 * xy + self.c2)
+        den = (self._mu_xx + mu_y * mu_y + self.c1) * (self._var_x + yy + self.c2)
+        return num / den
+
+    def ssim(self, b):
+        """Mean SSIM of ``b`` against the reference."""
+        return float(self.ssim_map(b).mean(dtype=np.float64))
+
+    def psnr(self, b):
+        """PSNR of ``b`` against the reference, in dB."""
+        return psnr(self.image, self._check(b), self.peak)
+
+
+def ssim_map(a, b, data_range=None, win_size=11, sigma=1.5, k1=0.01, k2=0.03):
+    """Per-pixel SSIM (per channel for colour images)."""
+    a = np.asarray(a)
+    b = np.asarray(b)
+    if a.shape != b.shape:
+        raise ValueError(f'Shape mismatch: {a.shape} vs {b.shape}')
+    return Reference(a, data_range, win_size, sigma, k1, k2).ssim_map(b)
+
+
+def ssim(a, b, data_range=None, **kwargs):
+    """Mean structural similarity (Wang et al. 2004) of two images."""
+    return float(ssim_map(a, b, data_range, **kwargs).mean(dtype=np.float64))
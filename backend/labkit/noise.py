@@ -0,0 +1,177 @@
+"""Seeded, batched noise generators for the noise exercises.
+
+Every function takes a single image or a whole batch shaped
+``(N, H, W[, C])`` and returns a new array, or writes into ``out`` (which may
+be the input itself for in-place noise).  Integer images saturate at their
+dtype range instead of wrapping around, and noise is drawn in float32 in
+fixed-size chunks so temporaries stay small however large the batch is.
+
+Randomness comes from ``numpy.random.Generator``; pass ``seed`` (an int or a
+Generator) to make a run reproducible::
+
+    from labkit import noise
+    noisy = noise.gaussian(img, sigma=25, seed=0)
+    batch = noise.salt_and_pepper(stack, salt_prob=0.01, pepper_prob=0.01, seed=1)
+"""
+import numpy as np
+
+# Elements processed per step; fixed so seeded results do not depend on size
+CHUNK = 1 << 22
+
+
+def _rng(seed):
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed)
+
+
+def _prepare(images, out):
+    images = np.asarray(images)
+    if out is None:
+        out = np.empty_like(images)
+    elif out.shape != images.shape or out.dtype != images.dtype:
+        raise ValueError(f'out must have shape {images.shape} and dtype {images.dtype}, '
+                         f'got {out.shape} and {out.dtype}')
+    return images, out
+
+
+def _limits(dtype):
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return info.min, info.max
+    return None, None
+
+
+def _store(values, dest, lo, hi):
+    """Round and saturate float32 ``values`` into ``dest``."""
+    if lo is not None:
+        np.rint(values, out=values)
+        np.clip(values, lo, hi, out=values)
+    dest[...] = values
+
+
+def _chunks(images, out):
+    """Yield matching flat slices of ``images`` and ``out``."""
+    src = images.reshape(-1)
+    if out.flags.c_contiguous:
+        dst = out.reshape(-1)
+        for start in range(0, src.size, CHUNK):
+            yield src[start:start + CHUNK], dst[start:start + CHUNK]
+    else:
+        result = np.empty_like(src)
+        for start in range(0, src.size, CHUNK):
+            yield src[start:start + CHUNK], result[start:start + CHUNK]
+        out[...] = result.reshape(out.shape)
+
+
+def gaussian(images, sigma=25.0, mean=0.0, seed=None, out=None):
+    """Add N(mean, sigma²) noise, saturating at the dtype range."""
+    images, out = _prepare(images, out)
+    images = np.ascontiguousarray(images)
+    rng = _rng(seed)
+    lo, hi = _limits(images.dtype)
+
+    for src, dst in _chunks(images, out):
+        values = rng.standard_normal(src.size, dtype=np.float32)
+        values *= sigma
+        values += mean
+        values += src
+        _store(values, dst, lo, hi)
+    return out
+
+
+def speckle(images, sigma=0.1, seed=None, out=None):
+    """Multiplicative noise: ``img * (1 + n)`` with ``n ~ N(0, sigma²)``."""
+    images, out = _prepare(images, out)
+    images = np.ascontiguousarray(images)
+    rng = _rng(seed)
+    lo, hi = _limits(images.dtype)
+
+    for src, dst in _chunks(images, out):
+        values = rng.standard_normal(src.size, dtype=np.float32)
+        values *= sigma
+        values += 1
+        values *= src
+        _store(values, dst, lo, hi)
+    return out
+
+
+def poisson(images, scale=1.0, seed=None, out=None):
+    """Shot noise: each value becomes ``Poisson(img * scale) / scale``.
+
+    ``scale`` is photons per intensity unit; larger values mean less noise.
+    """
+    images, out = _prepare(images, out)
+    images = np.ascontiguousarray(images)
+    rng = _rng(seed)
+    lo, hi = _limits(images.dtype)
+
+    for src, dst in _chunks(images, out):
+        lam = src.astype(np.float32)
+        if scale != 1:
+            lam *= scale
+        values = rng.poisson(lam).astype(np.float32)
+        if scale != 1:
+            values /= scale
+        _store(values, dst, lo, hi)
+    return out
+
+
+def _channels(images, channels_last):
+    """Number of trailing channel values that share one salt/pepper draw."""
+    if channels_last is None:
+        channels_last = images.ndim >= 3 and images.shape[-1] in (3, 4)
+    return images.shape[-1] if channels_last else 1
+
+
+def salt_and_pepper(images, salt_prob=0.01, pepper_prob=0.01, seed=None, out=None, channels_last=None):
+    """Set a random ``salt_prob`` of pixels to white and ``pepper_prob`` to black.
+
+    All channels of a colour pixel get the same value.  ``channels_last`` says
+    whether the last axis holds channels; by default a trailing axis of 3 or 4
+    is treated as colour.
+    """
+    if salt_prob < 0 or pepper_prob < 0 or salt_prob + pepper_prob > 1:
+        raise ValueError('salt_prob and pepper_prob must be >= 0 and sum to at most 1')
+    images, out = _prepare(images, out)
+    rng = _rng(seed)
+    lo, hi = _limits(images.dtype)
+    white = hi if hi is not None else 1
+    black = lo if lo is not None else 0
+
+    if out is not images:
+        out[...] = images
+
+    channels = _channels(images, channels_last)
+    pixels = out.reshape(-1, channels) if out.flags.c_contiguous else None
+    if pixels is None:
+        # Non-contiguous output: work on a copy and write back
+        pixels = np.ascontiguousarray(out).reshape(-1, channels)
+
+    step = max(1, CHUNK // channels)
+    for start in range(0, pixels.shape[0], step):
+        block = pixels[start:start + step]
+        draw = rng.random(block.shape[0], dtype=np.float32)
+        block[draw < salt_prob] = white
+        block[(draw >= salt_prob) & (draw < salt_prob + pepper_prob)] = black
+
+    if not out.flags.c_contiguous:
+        out[...] = pixels.reshape(out.shape)
+    return out
+
+
+GENERATORS = {
+    'gaussian': gaussian,
+    'salt_and_pepper': salt_and_pepper,
+    'poisson': poisson,
+    'speckle': speckle,
+}
+
+
+def apply(kind, images, seed=None, out=None, **params):
+    """Apply the generator named ``kind`` (see ``GENERATORS``)."""
+    try:
+        generator = GENERATORS[kind]
+    except KeyError:
+        raise ValueError(f'Unknown noise model {kind!r}; expected one of {sorted(GENERATORS)}') from None
+    return generator(images, seed=seed, out=out, **params)
@@ -0,0 +1,274 @@
+"""Lazy pipeline graph for the lab operations.
+
+Each photows script decodes its image and converts colour spaces on its own,
+so a lab that shows the original next to four derived views pays for five
+decodes and several identical conversions.  Here operations are nodes of a
+graph that is only run by :func:`evaluate`::
+
+    from labkit import pipeline as pl
+    img = pl.read('sample.jpg')
+    views = pl.evaluate({
+        'original': img.to_rgb(),
+        'gray': img.to_gray(),
+        'edges': img.to_rgb().canny(100, 700),
+        'laplacian': img.laplacian(),
+        'equalized': img.equalize(),
+    })
+
+Evaluation
+
+* deduplicates structurally equal nodes, so ``img.to_rgb()`` built twice
+  runs once;
+* canonicalises colour conversions as nodes are built: ``to_gray`` of an
+  RGB view reads the BGR source directly, ``to_bgr(to_rgb(x))`` is ``x`` and
+  operations that need gray or RGB input share a single conversion node;
+* recycles intermediate buffers into later operations of the same shape
+  once their last consumer has run;
+* runs independent branches concurrently on a thread pool (OpenCV releases
+  the GIL).
+"""
+import os
+import threading
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+
+class Node:
+    """One operation in the graph; build nodes with :func:`read`/:func:`source`."""
+
+    __slots__ = ('op', 'inputs', 'params', 'space', 'key', 'value')
+
+    def __init__(self, op, inputs=(), params=(), space='BGR', value=None):
+        self.op = op
+        self.inputs = tuple(inputs)
+        self.params = tuple(params)
+        self.space = space
+        self.value = value
+        ident = id(value) if value is not None else None
+        self.key = (op, self.params, ident, tuple(node.key for node in self.inputs))
+
+    def __repr__(self):
+        args = ', '.join(f'{k}={v!r}' for k, v in self.params)
+        return f'<{self.op}({args}) {self.space}>'
+
+    # Colour conversions -------------------------------------------------
+
+    def to_gray(self):
+        if self.space == 'GRAY':
+            return self
+        if self.op in ('to_rgb', 'to_bgr'):
+            # Gray from an RGB/BGR view equals gray from its source
+            return self.inputs[0].to_gray()
+        return Node('to_gray', (self,), space='GRAY')
+
+    def to_rgb(self):
+        if self.space == 'RGB':
+            return self
+        if self.op == 'to_bgr' and self.inputs[0].space == 'RGB':
+            return self.inputs[0]
+        return Node('to_rgb', (self,), space='RGB')
+
+    def to_bgr(self):
+        if self.space == 'BGR':
+            return self
+        if self.op == 'to_rgb' and self.inputs[0].space == 'BGR':
+            return self.inputs[0]
+        return Node('to_bgr', (self,), space='BGR')
+
+    # Operations ---------------------------------------------------------
+
+    def blur(self, ksize=(5, 5), sigma=0):
+        return Node('blur', (self,), (('ksize', tuple(ksize)), ('sigma', sigma)), self.space)
+
+    def laplacian(self, ksize=1):
+        """Absolute Laplacian saturated to 8 bits."""
+        return Node('laplacian', (self,), (('ksize', ksize),), self.space)
+
+    def canny(self, low, high, aperture_size=3, l2_gradient=False):
+        params = (('low', low), ('high', high), ('aperture_size', aperture_size), ('l2_gradient', l2_gradient))
+        return Node('canny', (self,), params, 'GRAY')
+
+    def equalize(self):
+        return Node('equalize', (self.to_gray(),), space='GRAY')
+
+    def enhance_color(self, factor):
+        """PIL ``ImageEnhance.Color``; the result is RGB."""
+        return Node('enhance_color', (self.to_rgb(),), (('factor', factor),), 'RGB')
+
+    def encode(self, ext='.png', params=()):
+        """Encode to image bytes; colour input is converted to BGR first."""
+        target = self if self.space == 'GRAY' else self.to_bgr()
+        return Node('encode', (target,), (('ext', ext), ('params', tuple(params))), None)
+
+
+def read(path, flags=cv2.IMREAD_COLOR):
+    """Decode ``path`` (through the shared decode cache)."""
+    space = 'GRAY' if flags == cv2.IMREAD_GRAYSCALE else 'BGR'
+    return Node('read', params=(('path', os.fspath(path)), ('flags', flags)), space=space)
+
+
+def source(array, space=None):
+    """Wrap an in-memory image; ``space`` defaults to GRAY or BGR by shape."""
+    if space is None:
+        space = 'GRAY' if array.ndim == 2 else 'BGR'
+    return Node('source', space=space, value=array)
+
+
+class BufferPool:
+    """Free intermediate arrays keyed by (shape, dtype) for reuse as ``dst``."""
+
+    def __init__(self):
+        self._free = defaultdict(list)
+        self._lock = threading.Lock()
+        self.reused = 0
+
+    def take(self, shape, dtype):
+        with self._lock:
+            free = self._free.get((tuple(shape), np.dtype(dtype)))
+            if free:
+                self.reused += 1
+                return free.pop()
+        return None
+
+    def give(self, array):
+        with self._lock:
+            self._free[(array.shape, array.dtype)].append(array)
+
+
+def _out_shape(node, inputs):
+    shape = inputs[0].shape
+    if node.space == 'GRAY':
+        return shape[:2]
+    if node.op in ('to_rgb', 'to_bgr') and len(shape) == 2:
+        return shape + (3,)
+    return shape
+
+
+_CONVERSIONS = {
+    ('to_gray', 'BGR'): cv2.COLOR_BGR2GRAY,
+    ('to_gray', 'RGB'): cv2.COLOR_RGB2GRAY,
+    ('to_rgb', 'BGR'): cv2.COLOR_BGR2RGB,
+    ('to_rgb', 'GRAY'): cv2.COLOR_GRAY2RGB,
+    ('to_bgr', 'RGB'): cv2.COLOR_RGB2BGR,
+    ('to_bgr', 'GRAY'): cv2.COLOR_GRAY2BGR,
+}
+
+
+def _compute(node, inputs, dst):
+    """Run one node; ``dst`` is a recycled buffer of the output shape or None."""
+    p = dict(node.params)
+    op = node.op
+    if op == 'read':
+        from labkit.images import imread
+        img = imread(p['path'], p['flags'])
+        if img is None:
+            raise ValueError(f"Failed to read {p['path']}. It might be corrupted or unsupported.")
+        return img
+    if op == 'source':
+        return node.value
+
+    src = inputs[0]
+    if op in ('to_gray', 'to_rgb', 'to_bgr'):
+        return cv2.cvtColor(src, _CONVERSIONS[(op, node.inputs[0].space)], dst=dst)
+    if op == 'blur':
+        return cv2.GaussianBlur(src, p['ksize'], p['sigma'], dst=dst)
+    if op == 'laplacian':
+        lap = cv2.Laplacian(src, cv2.CV_16S, ksize=p['ksize'])
+        return cv2.convertScaleAbs(lap, dst=dst)
+    if op == 'canny':
+        return cv2.Canny(src, p['low'], p['high'], edges=dst,
+                         apertureSize=p['aperture_size'], L2gradient=p['l2_gradient'])
+    if op == 'equalize':
+        return cv2.equalizeHist(src, dst=dst)
+    if op == 'enhance_color':
+        from PIL import Image, ImageEnhance
+        return np.asarray(ImageEnhance.Color(Image.fromarray(src)).enhance(p['factor']))
+    if op == 'encode':
+        ok, buf = cv2.imencode(p['ext'], src, list(p['params']))
+        if not ok:
+            raise ValueError(f"Failed to encode image as {p['ext']}")
+        return buf.tobytes()
+    raise ValueError(f'Unknown operation {op!r}')
+
+
+def plan(outputs):
+    """Unique nodes needed for ``outputs``, inputs before consumers."""
+    canonical = {}
+    order = []
+
+    def visit(node):
+        if node.key in canonical:
+            return canonical[node.key]
+        inputs = tuple(visit(i) for i in node.inputs)
+        if inputs != node.inputs:
+            node = Node(node.op, inputs, node.params, node.space, node.value)
+        canonical[node.key] = node
+        order.append(node)
+        return node
+
+    roots = {name: visit(node) for name, node in outputs.items()}
+    return order, roots
+
+
+# Operations whose output buffers are freshly allocated and safe to recycle
+_POOLED = {'to_gray', 'to_rgb', 'to_bgr', 'blur', 'laplacian', 'canny', 'equalize'}
+
+
+def evaluate(outputs, workers=None, stats=None):
+    """Run the graph for ``outputs`` (a dict of name -> Node).
+
+    Returns a dict of name -> ndarray (or bytes for ``encode``).  Pass a dict
+    as ``stats`` to receive the number of executed nodes and reused buffers.
+    """
+    order, roots = plan(outputs)
+    consumers = defaultdict(list)
+    for node in order:
+        for dep in node.inputs:
+            consumers[dep.key].append(node)
+
+    keep = {node.key for node in roots.values()}
+    remaining_deps = {node.key: len(node.inputs) for node in order}
+    remaining_uses = {node.key: len(consumers[node.key]) for node in order}
+    values = {}
+    pool = BufferPool()
+
+    def run(node):
+        inputs = [values[dep.key] for dep in node.inputs]
+        dst = None
+        if node.op in _POOLED and inputs[0].dtype == np.uint8:
+            dst = pool.take(_out_shape(node, inputs), np.uint8)
+        return _compute(node, inputs, dst)
+
+    workers = workers or min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        for node in order:
+            if remaining_deps[node.key] == 0:
+                pending[executor.submit(run, node)] = node
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = pending.pop(future)
+                values[node.key] = future.result()
+
+                for dep in node.inputs:
+                    remaining_uses[dep.key] -= 1
+                    if remaining_uses[dep.key] == 0 and dep.key not in keep:
+                        value = values.pop(dep.key)
+                        if dep.op in _POOLED:
+                            pool.give(value)
+
+                for consumer in consumers[node.key]:
+                    remaining_deps[consumer.key] -= 1
+                    if remaining_deps[consumer.key] == 0:
+                        pending[executor.submit(run, consumer)] = consumer
+
+    if stats is not None:
+        stats['nodes'] = len(order)
+        stats['ops'] = [repr(node) for node in order]
+        stats['buffersReused'] = pool.reused
+    return {name: values[node.key] for name, node in roots.items()}
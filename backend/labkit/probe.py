@@ -0,0 +1,294 @@
+"""Header-only image probing and reduced-resolution decoding.
+
+Checking an upload with ``cv2.imread`` decodes every pixel just to learn
+that the file is a 6000x4000 JPEG.  :func:`probe` reads the format,
+dimensions, channels and bit depth from the file header (JPEG, PNG, BMP and
+TIFF, which is what the runner accepts) and checks the end of the file for
+truncation, touching a few kilobytes at most::
+
+    from labkit.probe import probe, check, imread_preview
+    info = probe('sample.jpg')          # ImageInfo(format='jpeg', width=6000, ...)
+    check('sample.png')                 # raises ValueError if truncated or not a PNG
+    img, factor = imread_preview('sample.jpg', max_dim=1000)
+
+:func:`imread_preview` decodes at 1/2, 1/4 or 1/8 scale when the image is
+larger than the display needs.  For JPEG both OpenCV (``IMREAD_REDUCED_*``)
+and PIL (``Image.draft``) scale inside the DCT, so a 24 MP photo shown at
+1000 px decodes several times faster than at full size.
+"""
+import io
+import os
+import struct
+from collections import namedtuple
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+ImageInfo = namedtuple('ImageInfo', 'format width height channels bit_depth truncated')
+
+# Extensions each format may be saved under
+EXTENSIONS = {
+    'jpeg': ('.jpg', '.jpeg', '.jpe', '.jfif'),
+    'png': ('.png',),
+    'bmp': ('.bmp', '.dib'),
+    'tiff': ('.tif', '.tiff'),
+}
+
+# How far from the end to look for the end-of-image marker (JPEG) or IEND
+# chunk (PNG); cameras and editors may append data after it
+_TRAILER_TAIL = 1 << 16
+# IEND has no data, so its CRC, and the whole chunk, is fixed
+_PNG_IEND = b'\x00\x00\x00\x00IEND\xaeB`\x82'
+
+# JPEG start-of-frame markers (everything in C0-CF but DHT, JPG and DAC)
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# PNG colour type -> channels
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+
+
+class ProbeError(ValueError):
+    """The file is not a readable image of a supported format."""
+
+
+def _open(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source), len(source)
+    fh = open(source, 'rb')
+    return fh, os.fstat(fh.fileno()).st_size
+
+
+def _read_exact(fh, size):
+    data = fh.read(size)
+    if len(data) != size:
+        raise ProbeError('File ends inside its header')
+    return data
+
+
+def _probe_jpeg(fh, size):
+    fh.seek(2)
+    info = None
+    while info is None:
+        byte = _read_exact(fh, 1)
+        if byte != b'\xff':
+            raise ProbeError('Corrupt JPEG: expected a marker')
+        marker = fh.read(1)
+        while marker == b'\xff':  # Fill bytes
+            marker = fh.read(1)
+        if not marker:
+            raise ProbeError('File ends inside its header')
+        code = marker[0]
+        if code == 0x01 or 0xD0 <= code <= 0xD7:
+            continue  # Standalone markers
+        if code in (0xD9, 0xDA):
+            raise ProbeError('Corrupt JPEG: no frame header before the image data')
+        length = struct.unpack('>H', _read_exact(fh, 2))[0]
+        if code in _SOF_MARKERS:
+            precision, height, width, components = struct.unpack('>BHHB', _read_exact(fh, 6))
+            info = (width, height, components, precision)
+        else:
+            fh.seek(length - 2, io.SEEK_CUR)
+
+    tail = min(size, _TRAILER_TAIL)
+    fh.seek(size - tail)
+    truncated = b'\xff\xd9' not in fh.read(tail)
+    return ImageInfo('jpeg', *info, truncated)
+
+
+def _probe_png(fh, size):
+    fh.seek(8)
+    length, kind = struct.unpack('>I4s', _read_exact(fh, 8))
+    if kind != b'IHDR' or length != 13:
+        raise ProbeError('Corrupt PNG: missing IHDR chunk')
+    width, height, depth, color_type = struct.unpack('>IIBB', _read_exact(fh, 10))
+    if color_type not in _PNG_CHANNELS:
+        raise ProbeError(f'Corrupt PNG: unknown colour type {color_type}')
+    # Palette images carry 1-8 bit indices but decode to 8-bit colour
+    bit_depth = 8 if color_type == 3 else depth
+    start = max(size - _TRAILER_TAIL, 33)  # After the signature and IHDR
+    fh.seek(start)
+    truncated = _PNG_IEND not in fh.read(size - start)
+    return ImageInfo('png', width, height, _PNG_CHANNELS[color_type], bit_depth, truncated)
+
+
+def _probe_bmp(fh, size):
+    fh.seek(2)
+    declared = struct.unpack('<I', _read_exact(fh, 4))[0]
+    fh.seek(14)
+    header_size = struct.unpack('<I', _read_exact(fh, 4))[0]
+    if header_size == 12:  # OS/2 BITMAPCOREHEADER
+        width, height, _, bpp = struct.unpack('<HhHH', _read_exact(fh, 8))
+    else:
+        width, height, _, bpp = struct.unpack('<iiHH', _read_exact(fh, 12))
+    # 32-bit files may carry alpha; everything else decodes to 8-bit BGR
+    channels = 4 if bpp == 32 else 3
+    return ImageInfo('bmp', width, abs(height), channels, 8, size < declared)
+
+
+def _tiff_values(fh, order, kind, count, value_or_offset, size):
+    """Values of one IFD entry (only the integer types TIFF uses for layout)."""
+    fmt = {3: 'H', 4: 'I', 16: 'Q'}.get(kind)
+    if fmt is None:
+        return []
+    item = struct.calcsize(fmt)
+    if item * count <= 4:
+        data = value_or_offset[:item * count]
+    else:
+        offset = struct.unpack(order + 'I', value_or_offset)[0]
+        if offset + item * count > size:
+            raise ProbeError('Corrupt TIFF: tag data beyond the end of the file')
+        fh.seek(offset)
+        data = _read_exact(fh, item * count)
+    return list(struct.unpack(f'{order}{count}{fmt}', data))
+
+
+def _probe_tiff(fh, size):
+    fh.seek(0)
+    order = '<' if fh.read(2) == b'II' else '>'
+    magic, offset = struct.unpack(order + 'HI', _read_exact(fh, 6))
+    if magic != 42:
+        raise ProbeError('BigTIFF files are not supported')
+    if offset + 2 > size:
+        raise ProbeError('Truncated TIFF: image directory beyond the end of the file')
+    fh.seek(offset)
+    count = struct.unpack(order + 'H', _read_exact(fh, 2))[0]
+    entries = _read_exact(fh, 12 * count)
+
+    tags = {}
+    for i in range(count):
+        tag, kind, n = struct.unpack(order + 'HHI', entries[12 * i:12 * i + 8])
+        if tag in (256, 257, 258, 277, 273, 279, 324, 325):
+            tags[tag] = (kind, n, entries[12 * i + 8:12 * i + 12])
+
+    def values(tag, default=None):
+        if tag not in tags:
+            return default
+        return _tiff_values(fh, order, *tags[tag], size)
+
+    width = values(256, [None])[0]
+    height = values(257, [None])[0]
+    if width is None or height is None:
+        raise ProbeError('Corrupt TIFF: missing image dimensions')
+    channels = values(277, [1])[0]
+    bit_depth = values(258, [1])[0]
+
+    offsets = values(273) or values(324) or []
+    counts = values(279) or values(325) or []
+    truncated = any(o + c > size for o, c in zip(offsets, counts))
+    return ImageInfo('tiff', width, height, channels, bit_depth, truncated)
+
+
+def detect_format(head):
+    """Format name from the first bytes of a file, or None."""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'BM'):
+        return 'bmp'
+    if head[:4] in (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+'):
+        return 'tiff'
+    return None
+
+
+_PROBES = {'jpeg': _probe_jpeg, 'png': _probe_png, 'bmp': _probe_bmp, 'tiff': _probe_tiff}
+
+
+def probe(source):
+    """Read an :class:`ImageInfo` from the header of a path or bytes.
+
+    Raises :class:`ProbeError` for unknown formats and corrupt headers; a
+    file whose header is fine but whose data stops early is reported with
+    ``truncated=True``.
+    """
+    fh, size = _open(source)
+    with fh:
+        fmt = detect_format(fh.read(8))
+        if fmt is None:
+            raise ProbeError('Not a JPEG, PNG, BMP or TIFF file')
+        try:
+            return _PROBES[fmt](fh, size)
+        except struct.error as exc:
+            raise ProbeError(f'Corrupt {fmt.upper()} header: {exc}') from None
+
+
+def check(path, formats=tuple(EXTENSIONS)):
+    """Probe ``path`` and reject truncated files and misleading extensions.
+
+    Returns the :class:`ImageInfo`; raises ValueError with a message fit to
+    show a student otherwise.
+    """
+    info = probe(path)
+    name = os.path.basename(os.fspath(path))
+    ext = os.path.splitext(name)[1].lower()
+    if info.format not in formats:
+        raise ValueError(f'{name} is a {info.format.upper()} image, which is not accepted here')
+    if ext and ext not in EXTENSIONS[info.format]:
+        raise ValueError(f'{name} is named {ext} but contains a {info.format.upper()} image')
+    if info.truncated:
+        raise ValueError(f'{name} is truncated: the upload did not finish or the file is damaged')
+    if info.width <= 0 or info.height <= 0:
+        raise ValueError(f'{name} reports an empty {info.width}x{info.height} image')
+    return info
+
+
+def reduction_factor(width, height, max_dim):
+    """Largest of 1, 2, 4, 8 that keeps the longer side at least ``max_dim``."""
+    longest = max(width, height)
+    factor = 1
+    while factor < 8 and longest // (factor * 2) >= max_dim:
+        factor *= 2
+    return factor
+
+
+def _reduced_flag(flags, factor):
+    gray = flags == cv2.IMREAD_GRAYSCALE
+    return {
+        2: cv2.IMREAD_REDUCED_GRAYSCALE_2 if gray else cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_GRAYSCALE_4 if gray else cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_GRAYSCALE_8 if gray else cv2.IMREAD_REDUCED_COLOR_8,
+    }[factor]
+
+
+def imread_preview(path, max_dim=1000, flags=None, backend='opencv'):
+    """Decode ``path`` at reduced resolution for display; returns ``(img, factor)``.
+
+    ``factor`` is the power-of-two reduction applied (1 for small images);
+    the longer side stays at least ``max_dim``.  ``flags`` is
+    ``cv2.IMREAD_COLOR`` (default, BGR) or ``cv2.IMREAD_GRAYSCALE``.
+    ``backend='opencv'`` goes through :func:`labkit.images.imread`, so
+    previews are cached like full decodes; ``'pil'`` uses JPEG draft mode
+    and returns RGB (or L) arrays.  Returns ``(None, 1)`` for unreadable files,
+    like ``cv2.imread``.
+    """
+    if flags is None:
+        flags = cv2.IMREAD_COLOR if cv2 is not None else 1
+    try:
+        info = probe(path)
+    except (ProbeError, OSError):
+        return None, 1
+    factor = reduction_factor(info.width, info.height, max_dim)
+
+    if backend == 'pil':
+        import numpy as np
+        from PIL import Image
+
+        gray = cv2 is not None and flags == cv2.IMREAD_GRAYSCALE
+        with Image.open(path) as im:
+            mode = 'L' if gray else 'RGB'
+            if factor > 1:
+                # JPEG only: picks the DCT scale, at least the requested size
+                im.draft(mode, (info.width // factor, info.height // factor))
+            im = im.convert(mode)
+            if im.width > -(-info.width // factor):
+                im = im.reduce(factor)
+            return np.asarray(im), factor
+    if backend != 'opencv':
+        raise ValueError(f"Unknown backend {backend!r}; expected 'opencv' or 'pil'")
+
+    from labkit.images import imread
+    if factor == 1:
+        return imread(path, flags), 1
+    return imread(path, _reduced_flag(flags, factor)), factor
@@ -0,0 +1,348 @@
+"""Per-phase profile of a lab script run.
+
+A slow run used to come back as bare stdout/stderr or an "Execution Error".
+The worker now wraps each script in a :class:`Profiler` that splits its wall
+time into phases:
+
+``startup``
+    Interpreter start (cold runs) or fork (pooled runs) until the script's
+    first line, including the runner's own imports.
+``imports``
+    ``import`` statements that actually loaded something.
+``decode``
+    ``cv2.imread``/``imdecode``, ``labkit.images.imread`` and PIL's
+    ``Image.open``/``load``.
+``render``
+    ``plt.show()``, ``savefig`` and capturing figures left open at the end.
+``compute``
+    Everything else the script did.
+
+Phases are exclusive: a plugin imported inside ``Image.open`` counts as an
+import, not as decode time.  ``memory`` adds the ``tracemalloc`` peak and the
+allocation sites still holding the most memory when the script finishes
+(NumPy and OpenCV arrays are traced); ``cprofile`` (a sampling rate between 0
+and 1) runs that fraction of scripts under ``cProfile`` and reports the
+functions with the largest cumulative time.
+
+The report is a JSON-ready dict returned as the ``profile`` field of the
+worker's response.  Forked runs also stream phase boundaries to the parent,
+so a run killed at the timeout still reports which phase it was in.
+"""
+import builtins
+import cProfile
+import functools
+import os
+import pstats
+import random
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+PHASES = ('startup', 'imports', 'decode', 'compute', 'render')
+
+# Levels accepted from the runner and LABKIT_PROFILE
+LEVELS = {
+    'off': None,
+    'basic': {},
+    'memory': {'memory': True},
+    'full': {'memory': True, 'cprofile': 1.0},
+}
+
+# Frames from these files are the runner, not the script
+_RUNNER_FILES = ('runpy.py', '<frozen runpy>', os.path.join('labkit', 'worker.py'),
+                 os.path.join('labkit', 'profiler.py'))
+
+
+def options(spec=None):
+    """Normalise a level name or option dict (default ``LABKIT_PROFILE``).
+
+    Returns None when profiling is off, otherwise keyword arguments for
+    :class:`Profiler`.
+    """
+    if spec is None:
+        spec = os.environ.get('LABKIT_PROFILE', 'basic')
+    if isinstance(spec, dict):
+        return {k: spec[k] for k in ('memory', 'cprofile', 'top') if k in spec}
+    if spec is True:
+        spec = 'basic'
+    if spec is False:
+        spec = 'off'
+    if spec not in LEVELS:
+        raise ValueError(f'Unknown profile level {spec!r}; expected one of {tuple(LEVELS)}')
+    return None if LEVELS[spec] is None else dict(LEVELS[spec])
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+def _basename(value):
+    if isinstance(value, (str, bytes, os.PathLike)):
+        return os.path.basename(os.fsdecode(value))
+    return type(value).__name__
+
+
+class Profiler:
+    """Collects exclusive phase times for one script run.
+
+    ``started_at`` is the ``time.monotonic()`` value the run began at (fork
+    or process launch); the gap until :meth:`run` is reported as startup.
+    ``on_mark(phase, event, t)`` is called when a top-level phase starts or
+    ends, with ``t`` from ``time.monotonic()``.
+    """
+
+    def __init__(self, memory=False, cprofile=0.0, top=10, started_at=None, on_mark=None):
+        self.memory = memory
+        self.cprofile = random.random() < float(cprofile or 0)
+        self.top = top
+        self.started_at = started_at
+        self.on_mark = on_mark
+
+        self.totals = dict.fromkeys(PHASES, 0.0)
+        self.imports = {}
+        self.decodes = []
+        self.renders = 0
+        self._stack = []  # [phase, resumed_at]
+        self._patched = []
+        self._script_start = None
+        self._script_end = None
+        self._memory_report = None
+        self._cprofile_report = None
+
+    # Phase accounting ---------------------------------------------------
+
+    @contextmanager
+    def phase(self, name):
+        now = time.monotonic()
+        if self._stack:
+            outer = self._stack[-1]
+            self.totals[outer[0]] += now - outer[1]
+        elif self.on_mark:
+            self.on_mark(name, 'start', now)
+        entry = [name, now]
+        self._stack.append(entry)
+        try:
+            yield entry
+        finally:
+            now = time.monotonic()
+            self._stack.pop()
+            self.totals[name] += now - entry[1]
+            if self._stack:
+                self._stack[-1][1] = now
+            elif self.on_mark:
+                self.on_mark(name, 'end', now)
+
+    def _timed(self, name, func, record=None):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.phase(name):
+                result = func(*args, **kwargs)
+            if record is not None:
+                record(args, result)
+            return result
+        wrapper.__labkit_profiled__ = True
+        return wrapper
+
+    def _patch(self, owner, attr, name, record=None):
+        func = getattr(owner, attr, None)
+        if func is None or getattr(func, '__labkit_profiled__', False):
+            return
+        self._patched.append((owner, attr, func))
+        setattr(owner, attr, self._timed(name, func, record))
+
+    # Instrumentation ----------------------------------------------------
+
+    def _record_decode(self, call):
+        def record(args, result):
+            # Only the first few decodes are listed; times are in the totals
+            if len(self.decodes) >= 20:
+                return
+            shape = getattr(result, 'shape', None) or getattr(result, 'size', None)
+            self.decodes.append({
+                'call': call,
+                'file': _basename(args[0]) if args else None,
+                'shape': list(shape) if shape else None,
+            })
+        return record
+
+    def _patch_loaded(self):
+        """Wrap decode and render entry points of libraries loaded so far."""
+        cv2 = sys.modules.get('cv2')
+        if cv2 is not None and hasattr(cv2, 'imread'):
+            for attr in ('imread', 'imdecode', 'imreadmulti'):
+                self._patch(cv2, attr, 'decode', self._record_decode(f'cv2.{attr}'))
+        images = sys.modules.get('labkit.images')
+        if images is not None:
+            self._patch(images, 'imread', 'decode', self._record_decode('labkit.images.imread'))
+        pil_image = sys.modules.get('PIL.Image')
+        if pil_image is not None:
+            self._patch(pil_image, 'open', 'decode', self._record_decode('PIL.Image.open'))
+            pil_file = sys.modules.get('PIL.ImageFile')
+            if pil_file is not None:
+                self._patch(pil_file.ImageFile, 'load', 'decode')
+        figure = sys.modules.get('matplotlib.figure')
+        if figure is not None:
+            self._patch(figure.Figure, 'savefig', 'render')
+        figures = sys.modules.get('labkit.figures')
+        if figures is not None:
+            def count(args, result):
+                self.renders += 1
+            self._patch(figures, 'capture_open_figures', 'render', count)
+
+    def _import(self, original):
+        def wrapper(name, globals=None, locals=None, fromlist=(), level=0):
+            loaded = sys.modules.get(name) if level == 0 else None
+            if loaded is not None and all(f == '*' or hasattr(loaded, f) for f in fromlist or ()):
+                return original(name, globals, locals, fromlist, level)
+            started = time.monotonic()
+            with self.phase('imports'):
+                module = original(name, globals, locals, fromlist, level)
+            if not self._stack or self._stack[-1][0] != 'imports':
+                # Outermost import: credit the whole load to its top package
+                if level:
+                    name = (globals or {}).get('__package__') or name
+                top = name.partition('.')[0]
+                self.imports[top] = self.imports.get(top, 0.0) + time.monotonic() - started
+                self._patch_loaded()
+            return module
+        wrapper.__labkit_profiled__ = True
+        return wrapper
+
+    def install(self):
+        """Wrap imports, decoders and figure rendering; undo with :meth:`uninstall`."""
+        self._patch_loaded()
+        original = builtins.__import__
+        if not getattr(original, '__labkit_profiled__', False):
+            self._patched.append((builtins, '__import__', original))
+            builtins.__import__ = self._import(original)
+        return self
+
+    def uninstall(self):
+        while self._patched:
+            owner, attr, func = self._patched.pop()
+            setattr(owner, attr, func)
+
+    # Running ------------------------------------------------------------
+
+    def run(self, func, *args, **kwargs):
+        """Call ``func`` (the script) with memory tracing and cProfile as configured."""
+        profile = None
+        if self.memory:
+            # Two frames, so allocations inside our wrappers can be charged
+            # to the script line that called them
+            tracemalloc.start(2)
+        if self.cprofile:
+            profile = cProfile.Profile()
+        self._script_start = time.monotonic()
+        if self.on_mark:
+            self.on_mark('script', 'start', self._script_start)
+        try:
+            if profile is not None:
+                profile.enable()
+            result = func(*args, **kwargs)
+            return result
+        finally:
+            if profile is not None:
+                profile.disable()
+            self._script_end = time.monotonic()
+            if self.memory:
+                # The script's globals (and a traceback's frames) are still alive here
+                self._memory_report = self._memory_stats(tracemalloc.take_snapshot(),
+                                                         tracemalloc.get_traced_memory())
+                tracemalloc.stop()
+            if profile is not None:
+                self._cprofile_report = self._cprofile_stats(profile)
+
+    def _memory_stats(self, snapshot, traced):
+        current, peak = traced
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, '<frozen *>'),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, cProfile.__file__),
+            tracemalloc.Filter(False, pstats.__file__),
+            tracemalloc.Filter(False, '*/profile.py'),
+        ])
+        sites = {}
+        for stat in snapshot.statistics('traceback'):
+            frames = [frame for frame in reversed(stat.traceback) if frame.filename != __file__]
+            frame = frames[0] if frames else stat.traceback[-1]
+            site = f'{frame.filename}:{frame.lineno}'
+            size, count = sites.get(site, (0, 0))
+            sites[site] = (size + stat.size, count + stat.count)
+        ranked = sorted(sites.items(), key=lambda item: -item[1][0])[:self.top]
+        top = [{'site': site, 'sizeKb': round(size / 1024, 1), 'count': count} for site, (size, count) in ranked]
+        return {'peakMb': round(peak / 2 ** 20, 2), 'endMb': round(current / 2 ** 20, 2), 'top': top}
+
+    def _cprofile_stats(self, profile):
+        stats = pstats.Stats(profile)
+        rows = []
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            if filename.endswith(_RUNNER_FILES):
+                continue
+            rows.append({'function': f'{filename}:{line}({name})', 'calls': calls,
+                         'totalMs': _ms(tottime), 'cumulativeMs': _ms(cumtime)})
+        rows.sort(key=lambda r: -r['cumulativeMs'])
+        return rows[:self.top * 2]
+
+    def report(self):
+        """The profile as a JSON-ready dict (call after figures are collected)."""
+        end = self._script_end or time.monotonic()
+        start = self._script_start or end
+        # Figures captured after the script returned still belong to the run
+        end = max(end, time.monotonic())
+        totals = dict(self.totals)
+        if self.started_at is not None:
+            totals['startup'] = max(start - self.started_at, 0.0)
+        totals['compute'] = max(end - start - sum(totals[p] for p in ('imports', 'decode', 'render')), 0.0)
+        imports = sorted(self.imports.items(), key=lambda item: -item[1])[:self.top]
+        return {
+            'totalMs': _ms(end - (self.started_at if self.started_at is not None else start)),
+            'phases': {name: _ms(totals[name]) for name in PHASES},
+            'imports': [{'module': name, 'ms': _ms(seconds)} for name, seconds in imports],
+            'decodes': self.decodes,
+            'renders': self.renders,
+            'memory': self._memory_report,
+            'cprofile': self._cprofile_report,
+            'incomplete': False,
+            'activePhase': None,
+        }
+
+
+def partial_report(marks, started_at, ended_at):
+    """Rebuild phase times from streamed marks of a run that never finished.
+
+    ``marks`` are ``(phase, event, t)`` tuples in order.  The phase open when
+    the run was killed is charged up to ``ended_at`` and named in
+    ``activePhase``.
+    """
+    totals = dict.fromkeys(PHASES, 0.0)
+    script_start = None
+    open_phase = None
+    for phase, event, t in marks:
+        if phase == 'script':
+            script_start = t
+        elif event == 'start':
+            open_phase = (phase, t)
+        elif open_phase is not None:
+            totals[phase] += t - open_phase[1]
+            open_phase = None
+    if open_phase is not None:
+        totals[open_phase[0]] += ended_at - open_phase[1]
+
+    if script_start is None:
+        totals['startup'] = ended_at - started_at
+    else:
+        totals['startup'] = script_start - started_at
+        totals['compute'] = max(ended_at - script_start - sum(totals[p] for p in ('imports', 'decode', 'render')), 0.0)
+    return {
+        'totalMs': _ms(ended_at - started_at),
+        'phases': {name: _ms(totals[name]) for name in PHASES},
+        'imports': [],
+        'decodes': [],
+        'renders': 0,
+        'memory': None,
+        'cprofile': None,
+        'incomplete': True,
+        'activePhase': open_phase[0] if open_phase else ('compute' if script_start is not None else 'startup'),
+    }
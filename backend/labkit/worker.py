@@ -0,0 +1,574 @@
+"""Pre-warmed Python worker used by the /execute runner.
+
+Starting a fresh interpreter for every run means re-importing cv2, numpy and
+matplotlib each time, which is most of the latency of a lab script.  A worker
+imports those libraries once and then serves runs over a line protocol:
+
+    stdin  <- {"id": 1, "script": "/abs/script.py", "cwd": "/abs/dir", "timeout": 10}
+    stdout -> {"id": 1, "stdout": "...", "stderr": "...", "exitCode": 0, "figures": [...], ...}
+
+A request with ``"stream": true`` is first answered with ``{"id": 1,
+"event": {...}}`` lines as the script prints, shows figures or reports
+progress (:mod:`labkit.events`), then with the usual final line.
+
+On POSIX every run happens in a forked child of the warm parent, so each
+script gets a fresh ``__main__`` namespace and cannot leak state into the
+next run.  Where ``fork`` is unavailable the worker runs the script in-process
+and resets ``sys.modules``, ``sys.path`` and the working directory afterwards;
+the pool in ``pythonPool.js`` recycles such workers more aggressively.
+
+Figures shown with ``plt.show()`` are captured by :mod:`labkit.figures` and
+returned in the ``figures`` field, and the per-phase timings collected by
+:mod:`labkit.profiler` in the ``profile`` field (``"profile": "off"`` in a
+request disables it).  ``python -m labkit.worker --run script.py --result
+out.json`` does the same for a single cold run.
+
+Each run is confined so concurrent runs do not fight over the host: OpenCV
+and BLAS/OpenMP thread pools are capped at ``LABKIT_THREADS``, and forked
+children get an ``RLIMIT_CPU`` of ``timeout x threads`` seconds and an
+``RLIMIT_AS`` of ``LABKIT_MAX_MEMORY_MB`` (0 disables it).
+
+Run ``python -m labkit.worker --bench script.py`` to compare cold and warm
+latency for a script.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import runpy
+import selectors
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+
+from labkit import events, figures, profiler
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Libraries every lab script imports; overridable with LABKIT_PRELOAD
+DEFAULT_PRELOAD = ('numpy', 'cv2', 'matplotlib', 'matplotlib.pyplot', 'PIL.Image')
+
+CAN_FORK = hasattr(os, 'fork')
+
+THREAD_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+def pin_threads(threads=None):
+    """Cap OpenCV and BLAS/OpenMP threads at ``threads`` (default ``LABKIT_THREADS``).
+
+    The BLAS variables only take effect if set before numpy is imported,
+    which is why the runner also passes them in the environment.  Returns
+    the thread count, or None when unpinned.
+    """
+    if threads is None:
+        threads = int(os.environ.get('LABKIT_THREADS') or 0)
+    if threads <= 0:
+        return None
+    for var in THREAD_VARS:
+        os.environ.setdefault(var, str(threads))
+    cv2 = sys.modules.get('cv2')
+    if cv2 is not None:
+        cv2.setNumThreads(threads)
+    return threads
+
+
+def cpu_limit(timeout, threads=None):
+    """CPU seconds a run may use: its timeout times its threads, plus one."""
+    return math.ceil(timeout * max(threads or 1, 1)) + 1
+
+
+def apply_limits(timeout, threads=None):
+    """Set CPU-time and address-space rlimits for the current process.
+
+    Hard limits cannot be raised again, so only call this in a process that
+    exits after the run (a forked child or a cold run).  The CPU budget is
+    the wall-clock timeout times the threads the run may use, plus a second,
+    so a run killed by it could not have finished in time anyway.
+    """
+    if resource is None:
+        return
+    cpu = cpu_limit(timeout, threads)
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+    memory_mb = int(os.environ.get('LABKIT_MAX_MEMORY_MB') or 0)
+    if memory_mb > 0:
+        limit = memory_mb << 20
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def preload(modules=None):
+    """Import the heavy lab libraries so forked runs inherit them warm."""
+    if modules is None:
+        env = os.environ.get('LABKIT_PRELOAD')
+        modules = env.split(',') if env else DEFAULT_PRELOAD
+
+    # Scripts run headless; pick a non-interactive backend before pyplot loads
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    threads = pin_threads()
+
+    loaded = []
+    for name in modules:
+        name = name.strip()
+        if not name:
+            continue
+        try:
+            __import__(name)
+            loaded.append(name)
+        except ImportError:
+            # A missing optional library only costs the script its own import
+            pass
+    # cv2 is loaded now; cap its pool too
+    pin_threads(threads)
+    return loaded
+
+
+def rss_kb():
+    """Peak resident set size of this process in KiB (0 if unknown)."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports KiB
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def exec_script(script, cwd, figure_options=None, uploads=None, prof=None, on_figure=None):
+    """Run ``script`` as ``__main__`` inside ``cwd`` and return its exit code.
+
+    ``prof`` is an optional :class:`labkit.profiler.Profiler` to time it with;
+    ``on_figure(entry)`` is called with each figure as ``plt.show()`` captures it.
+    """
+    figures.install(on_capture=on_figure, **(figure_options or {}))
+    if prof is not None:
+        prof.install()
+    if uploads:
+        # Upload content hashes for labkit.images.imread
+        os.environ['LABKIT_UPLOADS'] = json.dumps(uploads)
+    os.chdir(cwd)
+    sys.argv = [script]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    try:
+        if prof is not None:
+            prof.run(runpy.run_path, script, run_name='__main__')
+        else:
+            runpy.run_path(script, run_name='__main__')
+    except SystemExit as exc:
+        if exc.code is None:
+            return 0
+        if isinstance(exc.code, int):
+            return exc.code
+        print(exc.code, file=sys.stderr)
+        return 1
+    except BaseException as exc:
+        # Hide the runner's own frames so the traceback starts in the script
+        tb = exc.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != script:
+            tb = tb.tb_next
+        traceback.print_exception(type(exc), exc, tb or exc.__traceback__)
+        return 1
+    return 0
+
+
+def _make_profiler(options, started_at, on_mark=None):
+    return None if options is None else profiler.Profiler(**options, started_at=started_at, on_mark=on_mark)
+
+
+def _drain(fds, deadline, on_data=None):
+    """Read the child's output pipes until EOF or ``deadline``.
+
+    ``on_data(i, data)`` is called with every chunk read from ``fds[i]``;
+    pipes that are ready together are read in the order of ``fds``.
+    """
+    chunks = {fd: [] for fd in fds}
+    sel = selectors.DefaultSelector()
+    for fd in fds:
+        sel.register(fd, selectors.EVENT_READ)
+
+    open_fds = set(fds)
+    timed_out = False
+    while open_fds:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timed_out = True
+            break
+        ready = sorted((key.fd for key, _ in sel.select(remaining)), key=fds.index)
+        for fd in ready:
+            data = os.read(fd, 65536)
+            if data:
+                chunks[fd].append(data)
+                if on_data is not None:
+                    on_data(fds.index(fd), data)
+            else:
+                sel.unregister(fd)
+                open_fds.discard(fd)
+    sel.close()
+    return [b''.join(chunks[fd]).decode('utf-8', 'replace') for fd in fds], timed_out
+
+
+def _collect_figures():
+    """Encode the run's figures; a broken figure must not fail the run."""
+    try:
+        return figures.collect()
+    except Exception as exc:
+        print(f'Figure capture failed: {type(exc).__name__}: {exc}', file=sys.stderr)
+        return []
+
+
+def _forward_event(line, emit):
+    """Pass on an ``{"event": ...}`` line of the result pipe."""
+    try:
+        message = json.loads(line)
+    except ValueError:
+        return
+    if 'event' in message:
+        emit(message['event'])
+
+
+def run_forked(script, cwd, timeout, figure_options=None, uploads=None, profile=None, on_event=None):
+    """Run a script in a forked child of this (warm) process.
+
+    The child writes JSON lines to a result pipe: profiler phase marks while
+    it runs, then one final line with its figures and profile.  If the run is
+    killed, the marks are enough to rebuild a partial profile.
+
+    With ``on_event``, output lines, figures and progress are also passed to
+    ``on_event(event)`` as they happen (see :mod:`labkit.events`).
+    """
+    started_at = time.monotonic()
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    res_r, res_w = os.pipe()
+
+    # Anything buffered here would otherwise be written twice
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    threads = pin_threads()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            os.close(out_r)
+            os.close(err_r)
+            os.close(res_r)
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, 0)  # The protocol stream belongs to the parent
+            os.dup2(out_w, 1)
+            os.dup2(err_w, 2)
+            sys.stdin = open(0, closefd=False)
+            sys.stdout = io.TextIOWrapper(open(1, 'wb', closefd=False), encoding='utf-8', line_buffering=True)
+            sys.stderr = io.TextIOWrapper(open(2, 'wb', closefd=False), encoding='utf-8', line_buffering=True)
+            res = open(res_w, 'w', encoding='utf-8')
+            res_lock = threading.Lock()
+            apply_limits(timeout, threads)
+
+            def send(message):
+                with res_lock:
+                    res.write(json.dumps(message) + '\n')
+                    res.flush()
+
+            def mark(phase, event, t):
+                send({'mark': [phase, event, t]})
+
+            on_figure = None
+            if on_event is not None:
+                events.install(lambda event: send({'event': event}))
+
+                def on_figure(entry):
+                    # Lines printed before plt.show() go out first
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                    send({'event': dict(entry, type='figure')})
+
+            prof = _make_profiler(profile, started_at, mark)
+            code = exec_script(script, cwd, figure_options, uploads, prof, on_figure)
+            final = {'figures': _collect_figures()}
+            if prof is not None:
+                final['profile'] = prof.report()
+            res.write(json.dumps(final) + '\n')
+            res.close()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(code)
+
+    os.close(out_w)
+    os.close(err_w)
+    os.close(res_w)
+    on_data = None
+    if on_event is not None:
+        emit = events.stamp(on_event, started_at)
+        streams = [events.output_lines('stdout', emit), events.output_lines('stderr', emit),
+                   events.LineSplitter(lambda line: _forward_event(line, emit))]
+
+        def on_data(i, data):
+            streams[i].feed(data)
+
+    (stdout, stderr, payload), timed_out = _drain([out_r, err_r, res_r], started_at + timeout, on_data)
+    if on_event is not None:
+        streams[0].close()
+        streams[1].close()
+    ended_at = time.monotonic()
+    if timed_out:
+        os.kill(pid, signal.SIGKILL)
+    os.close(out_r)
+    os.close(err_r)
+    os.close(res_r)
+
+    _, status, usage = os.wait4(pid, 0)
+    if os.WIFEXITED(status):
+        exit_code = os.WEXITSTATUS(status)
+    else:
+        exit_code = -os.WTERMSIG(status)
+    # The kernel sends SIGXCPU at the soft CPU limit and SIGKILL at the hard
+    # one; any other SIGKILL (the OOM killer, say) is not about CPU time
+    cpu_used = usage.ru_utime + usage.ru_stime
+    if exit_code == -signal.SIGXCPU or (exit_code == -signal.SIGKILL and not timed_out
+                                        and cpu_used >= cpu_limit(timeout, threads)):
+        stderr += f'\nRun stopped: it used more CPU time than its {timeout:g} s limit allows.\n'
+    elif exit_code == -signal.SIGKILL and not timed_out:
+        stderr += '\nRun killed before its time limit; it most likely ran out of memory.\n'
+
+    marks, final = [], None
+    for line in payload.splitlines():
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue  # A line cut short by the kill
+        if 'mark' in message:
+            marks.append(message['mark'])
+        elif 'event' not in message:
+            final = message
+    result = {
+        'stdout': stdout,
+        'stderr': stderr,
+        'exitCode': exit_code,
+        'timedOut': timed_out,
+        'maxRssKb': usage.ru_maxrss,
+        'figures': final['figures'] if final and not timed_out else [],
+    }
+    if profile is not None:
+        result['profile'] = final['profile'] if final else profiler.partial_report(marks, started_at, ended_at)
+    return result
+
+
+def run_in_process(script, cwd, figure_options=None, uploads=None, profile=None):
+    """Run a script in this process, then undo what it changed globally.
+
+    Used where ``fork`` is not available.  C-level writes to fd 1/2 are not
+    captured and a runaway script cannot be interrupted here; the pool kills
+    the whole worker when its timer fires.
+    """
+    saved_modules = set(sys.modules)
+    saved_path = list(sys.path)
+    saved_argv = list(sys.argv)
+    saved_cwd = os.getcwd()
+    saved_uploads = os.environ.get('LABKIT_UPLOADS')
+
+    prof = _make_profiler(profile, time.monotonic())
+    report = None
+    out, err = io.StringIO(), io.StringIO()
+    try:
+        with redirect_stdout(out), redirect_stderr(err):
+            code = exec_script(script, cwd, figure_options, uploads, prof)
+            captured = _collect_figures()
+            report = prof.report() if prof is not None else None
+    finally:
+        if prof is not None:
+            prof.uninstall()
+        for name in set(sys.modules) - saved_modules:
+            del sys.modules[name]
+        sys.path[:] = saved_path
+        sys.argv[:] = saved_argv
+        os.chdir(saved_cwd)
+        if saved_uploads is None:
+            os.environ.pop('LABKIT_UPLOADS', None)
+        else:
+            os.environ['LABKIT_UPLOADS'] = saved_uploads
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
+
+    result = {
+        'stdout': out.getvalue(),
+        'stderr': err.getvalue(),
+        'exitCode': code,
+        'timedOut': False,
+        'maxRssKb': rss_kb(),
+        'figures': captured,
+    }
+    if report is not None:
+        result['profile'] = report
+    return result
+
+
+def handle(request, runs, on_event=None):
+    """Execute one protocol request and build its response.
+
+    For requests with ``"stream": true``, ``on_event`` receives the run's
+    events while it executes (fork mode only; in-process runs answer at
+    the end as usual).
+    """
+    script = request['script']
+    cwd = request.get('cwd') or os.path.dirname(script)
+    timeout = float(request.get('timeout', 10))
+    figure_options = request.get('figures')
+    uploads = request.get('uploads')
+    profile = profiler.options(request.get('profile'))
+
+    started = time.perf_counter()
+    if CAN_FORK and not request.get('inProcess'):
+        stream = on_event if request.get('stream') else None
+        result = run_forked(script, cwd, timeout, figure_options, uploads, profile, stream)
+    else:
+        result = run_in_process(script, cwd, figure_options, uploads, profile)
+    result['elapsedMs'] = round((time.perf_counter() - started) * 1000, 2)
+
+    result['id'] = request.get('id')
+    result['runs'] = runs
+    result['workerRssKb'] = rss_kb()
+    return result
+
+
+def serve(stdin=None, stdout=None):
+    """Answer requests from ``stdin`` until it is closed."""
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+
+    started = time.perf_counter()
+    loaded = preload()
+    ready = {
+        'ready': True,
+        'pid': os.getpid(),
+        'mode': 'fork' if CAN_FORK else 'reset',
+        'preloaded': loaded,
+        'warmupMs': round((time.perf_counter() - started) * 1000, 2),
+    }
+    stdout.write(json.dumps(ready) + '\n')
+    stdout.flush()
+
+    runs = 0
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as exc:
+            response = {'id': None, 'error': f'Invalid request: {exc}'}
+        else:
+            runs += 1
+
+            def on_event(event, run_id=request.get('id')):
+                stdout.write(json.dumps({'id': run_id, 'event': event}) + '\n')
+                stdout.flush()
+
+            try:
+                response = handle(request, runs, on_event)
+            except Exception as exc:
+                response = {'id': request.get('id'), 'error': f'{type(exc).__name__}: {exc}'}
+        stdout.write(json.dumps(response) + '\n')
+        stdout.flush()
+
+
+def bench(script, runs):
+    """Print cold (new interpreter) vs warm (pooled worker) latency for ``script``."""
+    cwd = os.path.dirname(os.path.abspath(script))
+    env = dict(os.environ, MPLBACKEND='Agg')
+
+    cold = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, script], cwd=cwd, env=env, capture_output=True)
+        cold.append((time.perf_counter() - started) * 1000)
+
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'labkit.worker'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env, text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    ready = json.loads(proc.stdout.readline())
+
+    warm = []
+    for i in range(runs):
+        started = time.perf_counter()
+        proc.stdin.write(json.dumps({'id': i, 'script': os.path.abspath(script), 'cwd': cwd}) + '\n')
+        proc.stdin.flush()
+        json.loads(proc.stdout.readline())
+        warm.append((time.perf_counter() - started) * 1000)
+    proc.stdin.close()
+    proc.wait()
+
+    def summary(samples):
+        samples = sorted(samples)
+        return f'min {samples[0]:8.1f} ms   median {samples[len(samples) // 2]:8.1f} ms'
+
+    print(f'script: {script} ({runs} runs, worker warm-up {ready["warmupMs"]:.1f} ms)')
+    print(f'cold:   {summary(cold)}')
+    print(f'warm:   {summary(warm)}')
+
+
+def _launched_at():
+    """``time.monotonic()`` value of this process's launch.
+
+    The runner passes its launch time (epoch ms) in ``LABKIT_LAUNCHED_AT``;
+    otherwise the process start time from ``/proc`` is used where available.
+    """
+    launched = os.environ.get('LABKIT_LAUNCHED_AT')
+    if launched:
+        return time.monotonic() - (time.time() - float(launched) / 1000)
+    try:
+        with open('/proc/self/stat') as fh:
+            # Field 22, after the parenthesised command name
+            start_ticks = int(fh.read().rpartition(')')[2].split()[19])
+        with open('/proc/uptime') as fh:
+            uptime = float(fh.read().split()[0])
+        return time.monotonic() - (uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def run_once(script, result_path, profile=None, timeout=None):
+    """Run one script in this process (cold path) and write its figures and profile to ``result_path``."""
+    if timeout:
+        apply_limits(timeout, pin_threads())
+    prof = _make_profiler(profiler.options(profile), _launched_at())
+    code = exec_script(os.path.abspath(script), os.getcwd(), prof=prof)
+    sys.stdout.flush()
+    result = {'figures': _collect_figures()}
+    if prof is not None:
+        result['profile'] = prof.report()
+    with open(result_path, 'w', encoding='utf-8') as res:
+        json.dump(result, res)
+    return code
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bench', metavar='SCRIPT', help='compare cold and warm latency for SCRIPT')
+    parser.add_argument('--runs', type=int, default=5, help='runs per mode for --bench')
+    parser.add_argument('--run', metavar='SCRIPT', help='run SCRIPT once in this process')
+    parser.add_argument('--result', metavar='FILE', help='where --run writes captured figures')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='for --run: seconds the runner allows, sets the CPU-time rlimit')
+    parser.add_argument('--profile', choices=tuple(profiler.LEVELS), default=None,
+                        help='profile level for --run (default: LABKIT_PROFILE or basic)')
+    args = parser.parse_args(argv)
+
+    if args.run:
+        sys.exit(run_once(args.run, args.result or os.devnull, args.profile, args.timeout))
+    elif args.bench:
+        bench(args.bench, args.runs)
+    else:
+        serve()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+"""Deep-zoom tile pyramid over an image array, built lazily.
+
+Plotting a 50 MP upload with ``plt.imshow`` sends every pixel through
+matplotlib and still shows none of the values.  :class:`TilePyramid` cuts
+the image into the usual deep-zoom layout instead: level ``max_level`` is
+the full image, each level above it is half the size, and each level is
+split into ``tile_size`` squares.  A tile is made only when it is asked
+for, from the four tiles under it (so a coarse tile costs one 2x2 average of
+already-made tiles, never a pass over the image), and kept in a bounded
+least-recently-used cache keyed by ``(level, col, row)``::
+
+    from labkit.zoom import TilePyramid
+    pyr = TilePyramid(image_array)                  # PIL image or ndarray (RGB)
+    pyr.describe()                                  # sizes for the viewer
+    tiles = pyr.viewport(0, 0, 8000, 6000, scale=0.1)   # what a viewer needs
+    png = pyr.encoded(*tiles[0])                    # a few KB per tile
+    values = pyr.pixels(1200, 800, 16, 16)          # raw values, no resampling
+
+At ``scale >= PIXEL_SCALE`` (screen pixels per image pixel, where the
+numbers fit in the cells) :meth:`viewport` returns raw pixel-value tiles of
+the source instead of images.  The layout matches the Deep Zoom (DZI)
+convention with no overlap, so a viewer such as OpenSeadragon can request
+``{level}/{col}_{row}`` directly.
+"""
+import argparse
+import collections
+import json
+import math
+import sys
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+TILE_SIZE = 256
+# Raw pixel tiles are small: their values travel as JSON
+PIXEL_TILE = 32
+# Screen pixels per image pixel from which a viewer can print the values
+PIXEL_SCALE = 16.0
+CACHE_MB = 64
+FORMATS = ('png', 'webp', 'jpg')
+
+
+def _to_uint8(tile):
+    """Display bytes for a tile of any dtype: integers keep their top 8
+    bits, floats are taken as 0..1."""
+    if tile.dtype == np.uint8:
+        return tile
+    if tile.dtype == np.bool_:
+        return tile.view(np.uint8) * np.uint8(255)
+    if np.issubdtype(tile.dtype, np.integer):
+        info = np.iinfo(tile.dtype)
+        shifted = tile.astype(np.int64) - info.min
+        return (shifted >> (info.bits - 8)).astype(np.uint8)
+    return (np.clip(np.nan_to_num(tile), 0, 1) * 255 + 0.5).astype(np.uint8)
+
+
+def _halve(mosaic, size):
+    """2x2 average of ``mosaic`` down to ``size`` (width, height)."""
+    if cv2 is not None:
+        return cv2.resize(mosaic, size, interpolation=cv2.INTER_AREA)
+    # Pad odd edges by repetition so every output pixel averages a 2x2 block
+    h, w = mosaic.shape[:2]
+    pad = [(0, h % 2), (0, w % 2)] + [(0, 0)] * (mosaic.ndim - 2)
+    padded = np.pad(mosaic, pad, mode='edge').astype(np.uint16)
+    summed = padded[0::2, 0::2] + padded[1::2, 0::2] + padded[0::2, 1::2] + padded[1::2, 1::2]
+    return ((summed + 2) >> 2).astype(np.uint8)
+
+
+class TilePyramid:
+    """Lazily computed deep-zoom tiles of one image.
+
+    ``image`` is a PIL image or an array (H x W or H x W x C, RGB unless
+    ``order='bgr'``).  Image tiles are uint8; sources of other dtypes are
+    scaled for display but :meth:`pixels` returns their values unchanged.
+    ``cache_mb`` bounds the memory held by made tiles and their encodings.
+    """
+
+    def __init__(self, image, tile_size=TILE_SIZE, order='rgb', cache_mb=CACHE_MB):
+        if order not in ('rgb', 'bgr'):
+            raise ValueError(f"Unknown channel order {order!r}; expected 'rgb' or 'bgr'")
+        if hasattr(image, 'getbands'):  # PIL image
+            if image.mode not in ('L', 'RGB', 'RGBA', 'I;16', 'I', 'F'):
+                image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+            order = 'rgb'
+        self.source = np.asarray(image)
+        if self.source.ndim not in (2, 3) or self.source.size == 0:
+            raise ValueError(f'Expected a non-empty H x W or H x W x C image, got shape {self.source.shape}')
+        if tile_size < 1:
+            raise ValueError(f'tile_size must be positive, got {tile_size}')
+        self.tile_size = int(tile_size)
+        self.order = order
+        self.height, self.width = self.source.shape[:2]
+        self.max_level = max(0, math.ceil(math.log2(max(self.height, self.width))))
+        self.cache_bytes = int(cache_mb * 1024 * 1024)
+        self._cache = collections.OrderedDict()
+        self._cached_bytes = 0
+        self.stats = {'made': 0, 'hits': 0}
+
+    # Layout ------------------------------------------------------------------
+
+    def level_size(self, level):
+        """``(width, height)`` of ``level``; ``max_level`` is the full image."""
+        self._check_level(level)
+        factor = 2 ** (self.max_level - level)
+        return -(-self.width // factor), -(-self.height // factor)
+
+    def grid(self, level):
+        """``(cols, rows)`` of tiles at ``level``."""
+        width, height = self.level_size(level)
+        return -(-width // self.tile_size), -(-height // self.tile_size)
+
+    def describe(self):
+        """What a viewer needs to lay out the pyramid."""
+        return {
+            'width': self.width,
+            'height': self.height,
+            'channels': 1 if self.source.ndim == 2 else self.source.shape[2],
+            'dtype': str(self.source.dtype),
+            'tileSize': self.tile_size,
+            'overlap': 0,
+            'levels': self.max_level + 1,
+            'pixelTile': PIXEL_TILE,
+            'pixelScale': PIXEL_SCALE,
+        }
+
+    def _check_level(self, level):
+        if not 0 <= level <= self.max_level:
+            raise ValueError(f'level must be in 0..{self.max_level}, got {level}')
+
+    def _check_tile(self, level, col, row):
+        cols, rows = self.grid(level)
+        if not (0 <= col < cols and 0 <= row < rows):
+            raise ValueError(f'Tile ({col}, {row}) is outside the {cols} x {rows} grid of level {level}')
+
+    # Cache -------------------------------------------------------------------
+
+    def _get(self, key):
+        value = self._cache.get(key)
+        if value is not None:
+            self._cache.move_to_end(key)
+            self.stats['hits'] += 1
+        return value
+
+    def _put(self, key, value):
+        self._cache[key] = value
+        self._cached_bytes += len(value) if isinstance(value, bytes) else value.nbytes
+        while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+            _, old = self._cache.popitem(last=False)
+            self._cached_bytes -= len(old) if isinstance(old, bytes) else old.nbytes
+        return value
+
+    # Tiles -------------------------------------------------------------------
+
+    def tile(self, level, col, row):
+        """Image tile (uint8, RGB or gray) at ``(level, col, row)``."""
+        self._check_level(level)
+        self._check_tile(level, col, row)
+        key = (level, col, row)
+        tile = self._get(key)
+        if tile is not None:
+            return tile
+
+        size = self.tile_size
+        if level == self.max_level:
+            tile = self.source[row * size:(row + 1) * size, col * size:(col + 1) * size]
+            tile = _to_uint8(tile)
+            if self.order == 'bgr' and tile.ndim == 3 and tile.shape[2] in (3, 4):
+                tile = tile[..., [2, 1, 0, 3][:tile.shape[2]]]
+            tile = np.array(tile, order='C')  # never a view: tiles are made read-only
+        else:
+            cols, rows = self.grid(level + 1)
+            parts = [[self.tile(level + 1, c, r) for c in range(2 * col, min(2 * col + 2, cols))]
+                     for r in range(2 * row, min(2 * row + 2, rows))]
+            mosaic = np.concatenate([np.concatenate(line, axis=1) for line in parts], axis=0)
+            width, height = self.level_size(level)
+            out_w = min(size, width - col * size)
+            out_h = min(size, height - row * size)
+            tile = _halve(mosaic, (out_w, out_h))
+            if tile.ndim < mosaic.ndim:  # cv2 drops a trailing single channel
+                tile = tile[..., None]
+        tile.setflags(write=False)
+        self.stats['made'] += 1
+        return self._put(key, tile)
+
+    def encoded(self, level, col, row, fmt='png', quality=90):
+        """Tile ``(level, col, row)`` as PNG/WebP/JPEG bytes, cached too."""
+        if fmt not in FORMATS:
+            raise ValueError(f'Unsupported tile format {fmt!r}; expected one of {FORMATS}')
+        key = (level, col, row, fmt, quality)
+        data = self._get(key)
+        if data is not None:
+            return data
+        tile = self.tile(level, col, row)
+        if cv2 is not None:
+            bgr = tile
+            if tile.ndim == 3 and tile.shape[2] in (3, 4):
+                bgr = cv2.cvtColor(tile, cv2.COLOR_RGBA2BGRA if tile.shape[2] == 4 else cv2.COLOR_RGB2BGR)
+            params = {'png': [cv2.IMWRITE_PNG_COMPRESSION, 3],
+                      'webp': [cv2.IMWRITE_WEBP_QUALITY, quality],
+                      'jpg': [cv2.IMWRITE_JPEG_QUALITY, quality]}[fmt]
+            ok, buf = cv2.imencode('.' + fmt, bgr, params)
+            if not ok:
+                raise ValueError(f'Failed to encode tile as {fmt}')
+            data = buf.tobytes()
+        else:
+            import io
+            from PIL import Image
+
+            out = io.BytesIO()
+            Image.fromarray(tile[..., 0] if tile.ndim == 3 and tile.shape[2] == 1 else tile).save(
+                out, {'jpg': 'JPEG'}.get(fmt, fmt.upper()), quality=quality)
+            data = out.getvalue()
+        return self._put(key, data)
+
+    def pixels(self, x, y, width=PIXEL_TILE, height=PIXEL_TILE):
+        """Raw source values of the region at ``(x, y)``, clipped to the image.
+
+        A view of the source, in its own dtype and channel order; at most
+        ``4 * PIXEL_TILE`` on a side since the values are meant for display.
+        """
+        limit = 4 * PIXEL_TILE
+        if width > limit or height > limit:
+            raise ValueError(f'Pixel regions are limited to {limit} x {limit}, got {width} x {height}')
+        x0, y0 = max(0, int(x)), max(0, int(y))
+        return self.source[y0:min(self.height, y0 + int(height)), x0:min(self.width, x0 + int(width))]
+
+    def pixel_tile(self, col, row):
+        """``PIXEL_TILE``-square tile of raw values, on the pixel-tile grid."""
+        return self.pixels(col * PIXEL_TILE, row * PIXEL_TILE)
+
+    # Viewports ---------------------------------------------------------------
+
+    def level_for(self, scale):
+        """Coarsest level with at least ``scale`` level pixels per image pixel
+        (the full image for ``scale >= 1``)."""
+        if scale <= 0:
+            raise ValueError(f'scale must be positive, got {scale}')
+        if scale >= 1:
+            return self.max_level
+        return max(0, self.max_level - int(math.floor(math.log2(1 / scale))))
+
+    def viewport(self, x, y, width, height, scale):
+        """Tiles covering the image region ``(x, y, width, height)`` shown at
+        ``scale`` screen pixels per image pixel.
+
+        Returns ``(level, col, row)`` keys for :meth:`tile` / :meth:`encoded`,
+        or, from ``PIXEL_SCALE`` up, ``('pixels', col, row)`` keys for
+        :meth:`pixel_tile`.  Nothing is computed until the tiles are fetched.
+        """
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(self.width, x + width), min(self.height, y + height)
+        if x1 <= x0 or y1 <= y0:
+            return []
+        if scale >= PIXEL_SCALE:
+            step = PIXEL_TILE
+            level = 'pixels'
+        else:
+            level = self.level_for(scale)
+            factor = 2 ** (self.max_level - level)
+            step = self.tile_size * factor
+        return [(level, col, row)
+                for row in range(int(y0 // step), int(math.ceil(y1 / step)))
+                for col in range(int(x0 // step), int(math.ceil(x1 / step)))]
+
+    def fetch(self, key, fmt='png'):
+        """JSON-ready payload for a key returned by :meth:`viewport`."""
+        level, col, row = key
+        if level == 'pixels':
+            values = self.pixel_tile(col, row)
+            return {'kind': 'pixels', 'col': col, 'row': row,
+                    'x': col * PIXEL_TILE, 'y': row * PIXEL_TILE,
+                    'shape': list(values.shape), 'values': values.tolist()}
+        import base64
+
+        return {'kind': 'image', 'level': level, 'col': col, 'row': row, 'format': fmt,
+                'data': base64.b64encode(self.encoded(level, col, row, fmt)).decode('ascii')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print the deep-zoom tiles of an image viewport as JSON.')
+    parser.add_argument('input', help='image file')
+    parser.add_argument('--viewport', metavar='X,Y,W,H', help='image region (default: whole image)')
+    parser.add_argument('--scale', type=float, default=None,
+                        help='screen pixels per image pixel (default: fit in --screen)')
+    parser.add_argument('--screen', type=int, default=1024, help='viewer size used for the default scale')
+    parser.add_argument('--tile-size', type=int, default=TILE_SIZE)
+    parser.add_argument('--format', choices=FORMATS, default='png')
+    args = parser.parse_args(argv)
+
+    from PIL import Image
+
+    try:
+        with Image.open(args.input) as img:
+            pyr = TilePyramid(img, args.tile_size)
+    except (OSError, ValueError) as exc:
+        print(f'Failed to open {args.input}: {exc}', file=sys.stderr)
+        return 1
+    x, y, w, h = (float(v) for v in args.viewport.split(',')) if args.viewport else (0, 0, pyr.width, pyr.height)
+    scale = args.scale or args.screen / max(w, h)
+    tiles = [pyr.fetch(key, args.format) for key in pyr.viewport(x, y, w, h, scale)]
+    print(json.dumps({'image': pyr.describe(), 'scale': scale, 'tiles': tiles}))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
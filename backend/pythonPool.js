@@ -0,0 +1,243 @@
+import { spawn } from 'child_process';
+import readline from 'readline';
+import os from 'os';
+import path from 'path';
+
+// Pool of long-lived Python workers (labkit/worker.py) that keep cv2, numpy
+// and matplotlib imported between runs.  Each run executes in a fresh
+// namespace inside the worker; workers are recycled after `maxRuns` runs or
+// once their resident memory passes `maxRssMb`.  Workers that die before
+// becoming ready are respawned with exponential backoff; after
+// `maxStartFailures` in a row (or at once if the interpreter cannot be
+// spawned at all) the pool gives up and rejects the queued runs.  The next
+// run() tries again.
+export class PythonWorkerPool {
+    constructor({
+        pythonPath,
+        cwd,
+        size = Math.max(1, os.cpus().length),
+        maxRuns = 100,
+        maxRssMb = 1024,
+        maxStartFailures = 5,
+        backoffMs = 200,
+        maxBackoffMs = 10000,
+        env = process.env,
+    }) {
+        this.pythonPath = pythonPath;
+        this.cwd = cwd;
+        this.size = size;
+        this.maxRuns = maxRuns;
+        this.maxRssMb = maxRssMb;
+        this.maxStartFailures = maxStartFailures;
+        this.backoffMs = backoffMs;
+        this.maxBackoffMs = maxBackoffMs;
+        this.env = { ...env, PYTHONPATH: [cwd, env.PYTHONPATH].filter(Boolean).join(path.delimiter), MPLBACKEND: 'Agg' };
+
+        this.workers = [];
+        this.queue = [];
+        this.nextId = 1;
+        this.stats = { runs: 0, recycled: 0, crashed: 0, startFailures: 0 };
+        // Consecutive workers that died before becoming ready
+        this.startFailures = 0;
+        this.respawnTimer = null;
+        // Error that made the pool give up, until the next run() retries
+        this.broken = null;
+    }
+
+    // Spawn every worker up front so the first requests find them warm
+    start() {
+        while (!this.closed && !this.broken && this.workers.length < this.size) {
+            this.workers.push(this.spawnWorker());
+        }
+        return this;
+    }
+
+    // Replace dead workers, after a delay that doubles with each failed start
+    scheduleRespawn() {
+        if (this.closed || this.broken || this.respawnTimer) return;
+        if (!this.startFailures) {
+            this.start();
+            return;
+        }
+        const delay = Math.min(this.backoffMs * 2 ** (this.startFailures - 1), this.maxBackoffMs);
+        this.respawnTimer = setTimeout(() => {
+            this.respawnTimer = null;
+            this.start();
+        }, delay);
+    }
+
+    // Stop spawning and fail everything waiting for a worker
+    giveUp(message) {
+        this.broken = new Error(message);
+        clearTimeout(this.respawnTimer);
+        this.respawnTimer = null;
+        const queued = this.queue.splice(0);
+        for (const job of queued) {
+            job.reject(this.broken);
+        }
+    }
+
+    spawnWorker() {
+        const proc = spawn(this.pythonPath, ['-m', 'labkit.worker'], {
+            cwd: this.cwd,
+            env: this.env,
+            windowsHide: true,
+        });
+        const worker = { proc, ready: false, mode: null, runs: 0, job: null, retiring: false, gone: false };
+        // A worker that exits mid-write must not crash the server with EPIPE
+        proc.stdin.on('error', () => {});
+
+        readline.createInterface({ input: proc.stdout }).on('line', (line) => {
+            let message;
+            try {
+                message = JSON.parse(line);
+            } catch {
+                return;
+            }
+            if (message.ready) {
+                worker.ready = true;
+                this.startFailures = 0;
+                worker.mode = message.mode;
+                this.dispatch();
+            } else if (message.event) {
+                // Output, figures and progress of a streaming run, before its result
+                if (worker.job && message.id === worker.job.id) worker.job.onEvent?.(message.event);
+            } else {
+                this.finishJob(worker, message);
+            }
+        });
+
+        // Worker-level errors (import failures, crashes) end up here
+        let stderr = '';
+        proc.stderr.on('data', (chunk) => {
+            stderr = (stderr + chunk).slice(-4096);
+        });
+
+        // 'error' fires instead of (or before) 'exit' when the interpreter
+        // cannot be spawned at all, e.g. ENOENT for a wrong PYTHON_PATH
+        const gone = (spawnError) => {
+            if (worker.gone) return;
+            worker.gone = true;
+            this.workers = this.workers.filter((w) => w !== worker);
+            const reason = spawnError
+                ? `Could not start Python (${this.pythonPath}): ${spawnError.message}`
+                : `Python worker exited unexpectedly${stderr ? `: ${stderr}` : ''}`;
+            if (worker.job) {
+                const { job } = worker;
+                worker.job = null;
+                clearTimeout(job.timer);
+                if (job.timedOut) {
+                    job.resolve({ stdout: '', stderr: '', exitCode: null, timedOut: true });
+                } else {
+                    this.stats.crashed += 1;
+                    job.reject(new Error(reason));
+                }
+            }
+
+            if (spawnError) {
+                this.stats.startFailures += 1;
+                this.giveUp(reason);
+            } else if (!worker.ready && !worker.retiring && !this.closed) {
+                this.stats.startFailures += 1;
+                this.startFailures += 1;
+                if (this.startFailures >= this.maxStartFailures) {
+                    this.giveUp(`Python workers failed to start ${this.startFailures} times in a row`
+                        + `${stderr ? `: ${stderr}` : ''}`);
+                }
+            }
+            this.scheduleRespawn();
+            this.dispatch();
+        };
+        proc.on('error', gone);
+        proc.on('exit', () => gone(null));
+
+        return worker;
+    }
+
+    // Run a script in a warm worker; resolves with
+    // { stdout, stderr, exitCode, timedOut, elapsedMs, maxRssKb, workerRssKb, profile }
+    // `uploads` maps saved image paths to { sha256, size, mtimeNs } for labkit.images;
+    // `profile` is a labkit.profiler level ('off', 'basic', 'memory', 'full');
+    // `onEvent` receives the run's stdout/stderr lines, figures and progress
+    // as they happen (labkit/events.py)
+    run({ scriptPath, cwd, timeout = 10000, uploads = {}, profile = 'basic', onEvent = null }) {
+        if (this.broken) {
+            // Try again from scratch; a fixed interpreter path or a freed-up
+            // machine should not need a server restart
+            this.broken = null;
+            this.startFailures = 0;
+            this.start();
+        }
+        return new Promise((resolve, reject) => {
+            this.queue.push({
+                scriptPath, cwd, timeout, uploads, profile, onEvent, resolve, reject, queuedAt: Date.now(),
+            });
+            this.dispatch();
+        });
+    }
+
+    dispatch() {
+        for (const worker of this.workers) {
+            if (!this.queue.length) return;
+            if (!worker.ready || worker.job || worker.retiring) continue;
+
+            const job = this.queue.shift();
+            const id = this.nextId++;
+            job.id = id;
+            worker.job = job;
+            worker.runs += 1;
+
+            // The worker enforces the timeout itself in fork mode; this timer
+            // is the backstop for in-process mode and hung workers.
+            job.timer = setTimeout(() => {
+                job.timedOut = true;
+                worker.proc.kill('SIGKILL');
+            }, job.timeout + 2000);
+
+            worker.proc.stdin.write(JSON.stringify({
+                id,
+                script: job.scriptPath,
+                cwd: job.cwd,
+                timeout: job.timeout / 1000,
+                uploads: job.uploads,
+                profile: job.profile,
+                stream: Boolean(job.onEvent),
+            }) + '\n');
+        }
+    }
+
+    finishJob(worker, message) {
+        const { job } = worker;
+        if (!job || message.id !== job.id) return;
+        worker.job = null;
+        clearTimeout(job.timer);
+        this.stats.runs += 1;
+
+        if (message.error) {
+            job.reject(new Error(message.error));
+        } else {
+            job.resolve({ ...message, queuedMs: Date.now() - job.queuedAt - message.elapsedMs });
+        }
+
+        const overRuns = worker.runs >= this.maxRuns;
+        const overMemory = message.workerRssKb > this.maxRssMb * 1024;
+        if (overRuns || overMemory) {
+            this.retire(worker);
+        }
+        this.dispatch();
+    }
+
+    retire(worker) {
+        worker.retiring = true;
+        this.stats.recycled += 1;
+        worker.proc.stdin.end();
+    }
+
+    close() {
+        this.closed = true;
+        clearTimeout(this.respawnTimer);
+        for (const worker of this.workers) {
+            worker.proc.stdin.end();
+        }
+    }
+}
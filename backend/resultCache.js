@@ -0,0 +1,325 @@
+import fs from 'fs';
+import path from 'path';
+import crypto from 'crypto';
+import util from 'util';
+import { execFile } from 'child_process';
+
+const execFilePromise = util.promisify(execFile);
+
+// Disk cache of /execute results.  Most runs are the unmodified doc
+// exercises on a handful of popular images, so a run is keyed on the
+// normalised script, the uploads' content hashes, the Python, NumPy, OpenCV,
+// matplotlib and Pillow versions, the labkit sources and the figure options
+// (LABKIT_FIGURE_*), and a repeat is answered from disk without starting
+// Python.  Entries are JSON files evicted least-recently-used once the
+// directory exceeds `maxBytes`.
+//
+// Scripts that draw random numbers without a fixed seed (the noise and
+// k-means exercises) are not cached: each run is meant to differ.  A script
+// counts as seeded only if every random call in it is: calls on a global
+// generator need that generator seeded with a literal, and calls that take
+// a `seed` argument need a literal one on the same line.  A
+// `# labkit: no-cache` comment opts a script out explicitly and
+// `# labkit: cache` opts it back in.
+
+const NO_CACHE_MARKER = /#\s*labkit:\s*no-cache\b/;
+const CACHE_MARKER = /#\s*labkit:\s*cache\b(?!-)/;
+
+// Calls that draw from a random generator, each with what makes it
+// reproducible: `seededBy` seeds the generator for the whole script, and
+// must come before the first draw; `inlineSeed` means the call itself must
+// pass a literal `seed=`.  Only literal seeds count: `seed=seed` passes
+// along whatever the caller chose, often None.
+const LABKIT_CALLS = [
+    { call: /\bnoise\.(gaussian|speckle|poisson|salt_and_pepper|apply)\s*\(/g, inlineSeed: true },
+    { call: /\bsegment\s*\(/g, inlineSeed: true },
+    { call: /\bsegmentation\.sweep\s*\(/g, inlineSeed: true },
+];
+const LITERAL_SEED_ARG = /\bseed\s*=\s*\d/;
+const STDLIB_DRAWS = 'random|randint|uniform|gauss|choice|choices|sample|shuffle|normalvariate|randrange';
+// numpy.random names that build or seed a generator rather than draw
+const NP_NOT_DRAWS = ['seed', 'default_rng', 'Generator', 'RandomState'];
+
+// The names a script binds to NumPy, numpy.random, the random module and
+// cv2, and to functions imported from them, so that `import numpy as xp`,
+// `from numpy import random` or `from random import randint as r` are
+// recognised as well as the usual spellings.
+function randomNames(code) {
+    const names = {
+        numpy: new Set(['np', 'numpy']), npRandom: new Set(), random: new Set(['random']), cv2: new Set(['cv2']),
+        npFunctions: new Map(), randomFunctions: new Map(),
+    };
+    for (const [, list] of code.matchAll(/^[ \t]*import[ \t]+([^\n#;]+)/gm)) {
+        for (const item of list.split(',')) {
+            const [name, alias] = item.trim().split(/\s+as\s+/);
+            if (name === 'numpy') names.numpy.add(alias || name);
+            else if (name === 'numpy.random') (alias ? names.npRandom : names.numpy).add(alias || 'numpy');
+            else if (name === 'random' || name === 'cv2') names[name].add(alias || name);
+        }
+    }
+    for (const [, module, list] of code.matchAll(/^[ \t]*from[ \t]+([\w.]+)[ \t]+import[ \t]+(\([^)]*\)|[^\n#;]+)/gm)) {
+        for (const item of list.replace(/[()]/g, '').split(',')) {
+            const [name, alias] = item.trim().split(/\s+as\s+/);
+            const local = alias || name;
+            if (!name) continue;
+            if (module === 'numpy' && name === 'random') {
+                names.npRandom.add(local);
+                names.random.delete(local);
+            } else if (module === 'numpy.random') {
+                names.npFunctions.set(local, name);
+            } else if (module === 'random') {
+                names.randomFunctions.set(local, name);
+            }
+        }
+    }
+    return names;
+}
+
+const escapeName = (name) => name.replace(/\./g, '\\.');
+const either = (names) => [...names].map(escapeName).join('|');
+// A name not preceded by an attribute access (`x.rand` is not `rand`)
+const bare = (names) => `(?:^|[^\\w.])(?:${either(names)})`;
+const importedAs = (functions, test) => [...functions].filter(([, name]) => test(name)).map(([local]) => local);
+
+// The random-call rules for this script, given the names it imports
+function randomCalls(code) {
+    const names = randomNames(code);
+    const rules = [...LABKIT_CALLS];
+
+    // NumPy's global generator: np.random.*, an aliased numpy.random, or
+    // functions imported from it
+    const npModules = [...[...names.numpy].map((n) => `${n}.random`), ...names.npRandom];
+    const npSeeds = [...npModules.map((m) => `${m}.seed`),
+        ...importedAs(names.npFunctions, (name) => name === 'seed')];
+    const npSeed = new RegExp(`${bare(npSeeds)}\\s*\\(\\s*\\d`, 'm');
+    rules.push({
+        call: new RegExp(`${bare(npModules)}\\.(?!(?:${NP_NOT_DRAWS.join('|')})\\b)\\w+\\s*\\(`, 'gm'),
+        seededBy: npSeed,
+    });
+    const npDraws = importedAs(names.npFunctions, (name) => !NP_NOT_DRAWS.includes(name));
+    if (npDraws.length) rules.push({ call: new RegExp(`${bare(npDraws)}\\s*\\(`, 'gm'), seededBy: npSeed });
+
+    // Generators built without a seed, or with seed None, draw from OS entropy
+    const factories = ['default_rng', 'RandomState',
+        ...importedAs(names.npFunctions, (name) => name === 'default_rng' || name === 'RandomState')];
+    rules.push({ call: new RegExp(`\\b(?:${either(factories)})\\(\\s*(?:(?:seed\\s*=\\s*)?None\\s*,?\\s*)?\\)`, 'g') });
+
+    // The random module's global generator
+    const randomSeeds = [...[...names.random].map((m) => `${m}.seed`),
+        ...importedAs(names.randomFunctions, (name) => name === 'seed')];
+    const randomSeed = randomSeeds.length ? new RegExp(`${bare(randomSeeds)}\\s*\\(\\s*\\d`, 'm') : null;
+    if (names.random.size) {
+        rules.push({ call: new RegExp(`${bare(names.random)}\\.(${STDLIB_DRAWS})\\s*\\(`, 'gm'), seededBy: randomSeed });
+    }
+    const randomDraws = importedAs(names.randomFunctions, (name) => new RegExp(`^(${STDLIB_DRAWS})$`).test(name));
+    if (randomDraws.length) {
+        rules.push({ call: new RegExp(`${bare(randomDraws)}\\s*\\(`, 'gm'), seededBy: randomSeed });
+    }
+
+    // OpenCV's global generator, which cv2.kmeans also draws from
+    const cv2Seed = new RegExp(`${bare([...names.cv2].map((m) => `${m}.setRNGSeed`))}\\s*\\(\\s*\\d`, 'm');
+    rules.push({ call: new RegExp(`${bare(names.cv2)}\\.(randn|randu|randShuffle)\\s*\\(`, 'gm'), seededBy: cv2Seed });
+    rules.push({ call: /\bKMEANS_(RANDOM|PP)_CENTERS\b/g, seededBy: cv2Seed });
+    return rules;
+}
+
+function unseededCall(code, { call, seededBy, inlineSeed }) {
+    const seedAt = seededBy ? code.search(seededBy) : -1;
+    for (const match of code.matchAll(call)) {
+        if (seedAt !== -1 && seedAt < match.index) continue;
+        if (inlineSeed) {
+            const rest = code.slice(match.index).split('\n', 1)[0];
+            if (LITERAL_SEED_ARG.test(rest)) continue;
+        }
+        return true;
+    }
+    return false;
+}
+
+// Normalise line endings, trailing whitespace, blank lines and (when the
+// script has no multi-line strings that could contain them) comment-only
+// lines, so cosmetic edits still hit the cache.
+export function normalizeScript(code) {
+    const keepComments = /"""|'''/.test(code);
+    return code
+        .replace(/^\uFEFF/, '')
+        .split(/\r\n|\r|\n/)
+        .map((line) => line.replace(/\s+$/, ''))
+        .filter((line) => line && (keepComments || !/^\s*#/.test(line)))
+        .join('\n');
+}
+
+// True when the script's output is not expected to repeat between runs
+export function usesUnseededRandomness(code) {
+    if (CACHE_MARKER.test(code)) return false;
+    if (NO_CACHE_MARKER.test(code)) return true;
+    return randomCalls(code).some((rule) => unseededCall(code, rule));
+}
+
+export class ResultCache {
+    // `labkitDir` is the labkit package the scripts import; `env` the
+    // environment runs get, for the figure options
+    constructor({ dir, maxBytes = 256 * 1024 * 1024, pythonPath, labkitDir, env = process.env }) {
+        this.dir = dir;
+        this.maxBytes = maxBytes;
+        this.pythonPath = pythonPath;
+        this.labkitDir = labkitDir;
+        this.figureOptions = Object.keys(env).filter((name) => name.startsWith('LABKIT_FIGURE_')).sort()
+            .map((name) => [name, env[name]]);
+        this.labkit = { signature: null, hash: null };
+        this.entries = new Map();  // key -> size, least recently used first
+        this.totalBytes = 0;
+        this.stats = { hits: 0, misses: 0, stored: 0, evicted: 0, skipped: 0 };
+        this.runtime = null;
+
+        fs.mkdirSync(dir, { recursive: true });
+        const existing = [];
+        for (const name of fs.readdirSync(dir)) {
+            if (!name.endsWith('.json')) continue;
+            try {
+                const stat = fs.statSync(path.join(dir, name));
+                existing.push({ key: name.slice(0, -5), size: stat.size, atime: stat.atimeMs });
+            } catch {
+                // Removed by another process meanwhile
+            }
+        }
+        existing.sort((a, b) => a.atime - b.atime);
+        for (const { key, size } of existing) {
+            this.entries.set(key, size);
+            this.totalBytes += size;
+        }
+    }
+
+    // Python, NumPy, OpenCV, matplotlib and Pillow versions of the
+    // interpreter that runs scripts; a failure disables caching rather than
+    // risking stale results
+    runtimeVersions() {
+        if (!this.runtime) {
+            const probe = [
+                'import json, sys, numpy, cv2, matplotlib, PIL',
+                'print(json.dumps([sys.version.split()[0], numpy.__version__, cv2.__version__,'
+                    + ' matplotlib.__version__, PIL.__version__]))',
+            ].join('\n');
+            this.runtime = execFilePromise(this.pythonPath, ['-c', probe], { windowsHide: true })
+                .then(({ stdout }) => stdout.trim())
+                .catch(() => null);
+        }
+        return this.runtime;
+    }
+
+    // Hash of the labkit sources.  Files are only re-read when a name, size
+    // or mtime changed, so a deploy without a restart still changes the key.
+    labkitVersion() {
+        if (!this.labkitDir) return null;
+        const files = [];
+        const walk = (dir) => {
+            for (const entry of fs.readdirSync(dir, { withFileTypes: true })) {
+                const full = path.join(dir, entry.name);
+                if (entry.isDirectory() && entry.name !== '__pycache__') walk(full);
+                else if (entry.isFile() && entry.name.endsWith('.py')) files.push(full);
+            }
+        };
+        try {
+            walk(this.labkitDir);
+            files.sort();
+            const stats = files.map((file) => {
+                const stat = fs.statSync(file);
+                return `${path.relative(this.labkitDir, file)}:${stat.size}:${stat.mtimeMs}`;
+            });
+            const signature = stats.join('\n');
+            if (signature !== this.labkit.signature) {
+                const hash = crypto.createHash('sha256');
+                for (const file of files) {
+                    hash.update(path.relative(this.labkitDir, file)).update('\0').update(fs.readFileSync(file));
+                }
+                this.labkit = { signature, hash: hash.digest('hex') };
+            }
+            return this.labkit.hash;
+        } catch {
+            return null;
+        }
+    }
+
+    // Cache key for a run, or null when the run must not be cached.
+    // `uploads` maps saved file names to their SHA-256.
+    async key(code, uploads) {
+        if (usesUnseededRandomness(code)) {
+            this.stats.skipped += 1;
+            return null;
+        }
+        const runtime = await this.runtimeVersions();
+        if (!runtime) return null;
+        const labkit = this.labkitVersion();
+        if (this.labkitDir && !labkit) return null;
+        const files = Object.keys(uploads).sort().map((name) => [name, uploads[name]]);
+        return crypto.createHash('sha256')
+            .update(JSON.stringify({
+                v: 2, runtime, labkit, figures: this.figureOptions, files, script: normalizeScript(code),
+            }))
+            .digest('hex');
+    }
+
+    entryPath(key) {
+        return path.join(this.dir, `${key}.json`);
+    }
+
+    async get(key) {
+        if (!key || !this.entries.has(key)) {
+            if (key) this.stats.misses += 1;
+            return null;
+        }
+        try {
+            const value = JSON.parse(await fs.promises.readFile(this.entryPath(key), 'utf-8'));
+            // Move to the most recently used end
+            const size = this.entries.get(key);
+            this.entries.delete(key);
+            this.entries.set(key, size);
+            const now = new Date();
+            fs.promises.utimes(this.entryPath(key), now, now).catch(() => {});
+            this.stats.hits += 1;
+            return value;
+        } catch {
+            this.forget(key);
+            this.stats.misses += 1;
+            return null;
+        }
+    }
+
+    async set(key, value) {
+        if (!key) return;
+        const data = JSON.stringify(value);
+        const size = Buffer.byteLength(data);
+        if (size > this.maxBytes / 4) return;  // One huge result must not flush the cache
+
+        // Write then rename so a concurrent reader never sees half a file
+        const target = this.entryPath(key);
+        const temp = `${target}.${process.pid}.${crypto.randomBytes(4).toString('hex')}.tmp`;
+        await fs.promises.writeFile(temp, data);
+        await fs.promises.rename(temp, target);
+
+        this.forget(key, false);
+        this.entries.set(key, size);
+        this.totalBytes += size;
+        this.stats.stored += 1;
+        this.evict();
+    }
+
+    forget(key, unlink = true) {
+        if (!this.entries.has(key)) return;
+        this.totalBytes -= this.entries.get(key);
+        this.entries.delete(key);
+        if (unlink) fs.promises.rm(this.entryPath(key), { force: true }).catch(() => {});
+    }
+
+    evict() {
+        for (const key of this.entries.keys()) {
+            if (this.totalBytes <= this.maxBytes) break;
+            this.forget(key);
+            this.stats.evicted += 1;
+        }
+    }
+
+    snapshot() {
+        return { entries: this.entries.size, bytes: this.totalBytes, maxBytes: this.maxBytes, ...this.stats };
+    }
+}
@@ -0,0 +1,153 @@
+// Admission control and fair scheduling for /execute runs.
+//
+// At most `concurrency` runs execute at once; the rest wait in one FIFO queue
+// per user.  A free slot goes to the waiting user with the fewest runs in
+// progress (round-robin among ties), so a student who clicks "Run" ten times
+// cannot starve the rest of the class.  Requests are refused up front
+// (instead of queueing until they time out) once the whole queue or a single
+// user's queue is full.  A run whose `signal` aborts while it is still
+// waiting (its client went away) leaves the queue without running.
+export class SchedulerFullError extends Error {
+    constructor(message, { queued, perUser }) {
+        super(message);
+        this.name = 'SchedulerFullError';
+        this.queued = queued;
+        this.perUser = perUser;
+    }
+}
+
+export class FairScheduler {
+    constructor({ concurrency, maxQueued = concurrency * 8, maxQueuedPerUser = 3, historySize = 200 }) {
+        this.concurrency = Math.max(1, concurrency);
+        this.maxQueued = maxQueued;
+        this.maxQueuedPerUser = maxQueuedPerUser;
+        this.historySize = historySize;
+
+        this.running = 0;
+        this.runningByUser = new Map();
+        this.queues = new Map();   // user -> [job], in arrival order
+        this.rotation = [];        // users with queued jobs, next to serve first
+        this.waits = [];           // recent wait times (ms) for the stats
+        this.stats = { admitted: 0, rejected: 0, completed: 0, failed: 0, cancelled: 0 };
+    }
+
+    get queued() {
+        let total = 0;
+        for (const queue of this.queues.values()) total += queue.length;
+        return total;
+    }
+
+    // Run `task({ waitMs, queuedBehind })` once a slot is free; resolves or
+    // rejects with the task's result.  Throws SchedulerFullError immediately
+    // when the run cannot be admitted, and rejects with `signal.reason` if
+    // `signal` aborts before the run starts.
+    run(user, task, { signal } = {}) {
+        if (signal?.aborted) return Promise.reject(signal.reason);
+        const key = String(user || 'anonymous');
+        const queue = this.queues.get(key) || [];
+        const queued = this.queued;
+        if (queued >= this.maxQueued || queue.length >= this.maxQueuedPerUser) {
+            this.stats.rejected += 1;
+            return Promise.reject(new SchedulerFullError(
+                queue.length >= this.maxQueuedPerUser
+                    ? `You already have ${queue.length} runs waiting; wait for them to finish`
+                    : `The server is busy (${queued} runs waiting); try again shortly`,
+                { queued, perUser: queue.length }));
+        }
+
+        this.stats.admitted += 1;
+        return new Promise((resolve, reject) => {
+            const job = { task, resolve, reject, queuedAt: Date.now(), queuedBehind: queued };
+            if (signal) {
+                job.onAbort = () => this.cancel(key, job, signal.reason);
+                job.signal = signal;
+                signal.addEventListener('abort', job.onAbort, { once: true });
+            }
+            queue.push(job);
+            if (!this.queues.has(key)) {
+                this.queues.set(key, queue);
+                this.rotation.push(key);
+            }
+            this.pump();
+        });
+    }
+
+    // Drop a job that has not started yet
+    cancel(key, job, reason) {
+        const queue = this.queues.get(key);
+        const index = queue ? queue.indexOf(job) : -1;
+        if (index < 0) return;
+        queue.splice(index, 1);
+        if (!queue.length) {
+            this.queues.delete(key);
+            this.rotation = this.rotation.filter((k) => k !== key);
+        }
+        this.stats.cancelled += 1;
+        job.reject(reason);
+    }
+
+    pump() {
+        while (this.running < this.concurrency && this.rotation.length) {
+            // Fewest runs in progress wins; the served user moves to the back
+            let index = 0;
+            for (let i = 1; i < this.rotation.length; i++) {
+                if (this.activeRuns(this.rotation[i]) < this.activeRuns(this.rotation[index])) index = i;
+            }
+            const [key] = this.rotation.splice(index, 1);
+            const queue = this.queues.get(key);
+            const job = queue.shift();
+            if (queue.length) {
+                this.rotation.push(key);
+            } else {
+                this.queues.delete(key);
+            }
+            this.start(key, job);
+        }
+    }
+
+    activeRuns(key) {
+        return this.runningByUser.get(key) || 0;
+    }
+
+    start(key, job) {
+        job.signal?.removeEventListener('abort', job.onAbort);
+        const waitMs = Date.now() - job.queuedAt;
+        this.waits.push(waitMs);
+        if (this.waits.length > this.historySize) this.waits.shift();
+
+        this.running += 1;
+        this.runningByUser.set(key, this.activeRuns(key) + 1);
+        Promise.resolve()
+            .then(() => job.task({ waitMs, queuedBehind: job.queuedBehind }))
+            .then((value) => {
+                this.stats.completed += 1;
+                job.resolve(value);
+            }, (error) => {
+                this.stats.failed += 1;
+                job.reject(error);
+            })
+            .finally(() => {
+                this.running -= 1;
+                if (this.activeRuns(key) > 1) {
+                    this.runningByUser.set(key, this.activeRuns(key) - 1);
+                } else {
+                    this.runningByUser.delete(key);
+                }
+                this.pump();
+            });
+    }
+
+    // Queue depth and wait-time percentiles over the last `historySize` runs
+    snapshot() {
+        const waits = [...this.waits].sort((a, b) => a - b);
+        const pick = (q) => (waits.length ? waits[Math.min(waits.length - 1, Math.floor(q * waits.length))] : 0);
+        return {
+            concurrency: this.concurrency,
+            running: this.running,
+            queued: this.queued,
+            users: this.queues.size,
+            waitMs: { p50: pick(0.5), p95: pick(0.95), max: waits.length ? waits[waits.length - 1] : 0 },
+            ...this.stats,
+        };
+    }
+}
@@ -1,6 +1,8 @@
 import cv2
 import matplotlib.pyplot as plt
 import os
+# Header-only checks, and a reduced-resolution decode for the preview
+from labkit.probe import check, imread_preview
 
 # Define accepted formats
 ACCEPTED_FORMATS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
@@ -45,7 +47,14 @@ print(f"✅ Using image: {image_file}")
 
 # Try to read the image
 try:
-    img = cv2.imread(image_file, cv2.IMREAD_GRAYSCALE)
+    # Reads only the header: rejects truncated or mislabelled files cheaply
+    info = check(image_file)
+    print(f"📊 Image info: {info.width}x{info.height} pixels, {info.format.upper()}, "
+          f"{info.channels} channel(s), {info.bit_depth}-bit")
+
+    # The figure is about 1000 px wide, so a large photo is decoded at 1/2,
+    # 1/4 or 1/8 scale, which is much faster than a full decode
+    img, factor = imread_preview(image_file, max_dim=1000, flags=cv2.IMREAD_GRAYSCALE)
     
     if img is None:
         print(f"\n❌ IMAGE READING ERROR:")
@@ -58,7 +67,8 @@ try:
         print(f"\n💡 Try re-uploading the image or use a different file")
         raise ValueError(f"Failed to read {image_file}. It might be corrupted or unsupported.")
     
-    print(f"📊 Image info: {img.shape[1]}x{img.shape[0]} pixels")
+    if factor > 1:
+        print(f"🔎 Preview decoded at 1/{factor} scale: {img.shape[1]}x{img.shape[0]} pixels")
     
     # Display the image
     plt.figure(figsize=(10, 8))
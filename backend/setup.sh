@@ -1,6 +1,8 @@
 #!/bin/bash
 echo "Installing required Python packages..."
 pip install opencv-python numpy matplotlib
+# Optional: lets labkit.tiled read large TIFFs tile by tile
+pip install tifffile
 
 echo "Starting backend service..."
 node index.js
\ No newline at end of file
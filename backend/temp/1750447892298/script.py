@@ -3,6 +3,9 @@ import cv2
 import numpy as np
 # Import Matplotlib for plotting
 import matplotlib.pyplot as plt  
+# Colour-quantisation k-means: clusters the distinct colours weighted by
+# pixel count instead of every pixel
+from labkit.segmentation import segment
 
 # Fixed image filename
 path = 'sample.jpg'
@@ -17,24 +20,18 @@ else:
     # Convert BGR (OpenCV default) to RGB for correct color display in matplotlib
     img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
-    # Reshape the image into a 2D array of pixels and convert to float32 for k-means
-    Z = img.reshape((-1, 3)).astype(np.float32)
-
-    # Define the criteria for K-means clustering:
-    # Stop either after 10 iterations or if the accuracy is less than 1.0
-    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
-
     K = 3  # Number of clusters (segments)
 
-    # Apply K-means clustering
-    # Returns compactness, labels (which cluster each pixel belongs to), and centers (cluster centers)
-    _, label, center = cv2.kmeans(Z, K, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+    # Same criteria as cv2.kmeans: stop after 10 iterations or when centres
+    # move less than 1.0, keeping the best of 10 attempts
+    result = segment(img, K, attempts=10, max_iter=10, eps=1.0)
 
-    # Convert cluster centers to uint8 (pixel values)
-    center = np.uint8(center)
+    # Cluster centers as uint8 (pixel values) and the label of each pixel
+    center = result.centers
+    label = result.labels
 
-    # Replace each pixel with its corresponding center value to create segmented image
-    segmented = center[label.flatten()].reshape(img.shape)
+    # Each pixel replaced by its cluster center value
+    segmented = result.segmented
 
     # Convert segmented image to RGB for matplotlib display
     segmented_rgb = cv2.cvtColor(segmented, cv2.COLOR_BGR2RGB)
@@ -4,6 +4,8 @@ import cv2
 import numpy as np  
 # Import Matplotlib for plotting
 import matplotlib.pyplot as plt  
+# Corner detection with non-maximum suppression and vectorised drawing
+from labkit import corners
 
 # Read the image and convert it to grayscale
 img = cv2.imread('sample.png')  # Load the image (color)
@@ -13,18 +15,17 @@ if img is None:
 gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)  # Convert the image to grayscale for corner detection
 
 # Harris Corner Detection
-gray_float = np.float32(gray)  # Convert the grayscale image to float32 type (required by cornerHarris)
-harris_corners = cv2.cornerHarris(gray_float, 2, 3, 0.04)  # Apply Harris corner detection
-img_harris = img.copy()  # Copy the original image to draw Harris corners
-# Mark detected corners in red on the copy of the original image
-img_harris[harris_corners > 0.01 * harris_corners.max()] = [0, 0, 255]  # BGR red color
+# Keep only local maxima of the Harris response above 1% of the strongest,
+# so each corner is one point instead of a thresholded blob
+harris_corners = corners.detect(gray, 'harris', quality=0.01, min_distance=3)
+# Mark detected corners in red on a copy of the original image
+img_harris = corners.draw(img, harris_corners, color=(0, 0, 255), radius=2)  # BGR red color
 
 # Shi-Tomasi Corner Detection
-shi_corners = cv2.goodFeaturesToTrack(gray, 100, 0.01, 10)  # Detect corners using Shi-Tomasi method
-img_shi = img.copy()  # Copy original image to draw Shi-Tomasi corners
-for i in shi_corners:
-    x, y = i.ravel()  # Extract x and y coordinates of each corner
-    cv2.circle(img_shi, (int(x), int(y)), 3, (0, 255, 0), -1)  # Draw green circles at corners
+# Up to 100 strongest corners, at least 10 pixels apart
+shi_corners = corners.detect(gray, 'shi_tomasi', quality=0.01, min_distance=10, max_corners=100)
+# Draw green circles at all corners in one call
+img_shi = corners.draw(img, shi_corners, color=(0, 255, 0), radius=3)
 
 # Convert images from BGR to RGB for matplotlib display
 img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
@@ -0,0 +1,54 @@
+import test from 'node:test';
+import assert from 'node:assert/strict';
+import { usesUnseededRandomness } from '../resultCache.js';
+
+const unseeded = (lines) => usesUnseededRandomness(lines.join('\n'));
+
+test('draws without a seed are not cached', () => {
+    assert.equal(unseeded(['import numpy as np', 'x = np.random.rand(3)']), true);
+    assert.equal(unseeded(['import random', 'x = random.random()']), true);
+    assert.equal(unseeded(['import cv2', 'cv2.randn(img, 0, 25)']), true);
+    assert.equal(unseeded(['import numpy as np', 'img = np.zeros((8, 8))']), false);
+});
+
+test('a seed counts only before the first draw', () => {
+    assert.equal(unseeded(['import numpy as np', 'np.random.seed(0)', 'x = np.random.rand(3)']), false);
+    assert.equal(unseeded(['import numpy as np', 'x = np.random.rand(3)', 'np.random.seed(0)']), true);
+    assert.equal(unseeded(['import random', 'x = random.random()', 'random.seed(1)']), true);
+    assert.equal(unseeded(['import cv2', 'cv2.setRNGSeed(0)', 'cv2.randu(img, 0, 255)']), false);
+});
+
+test('aliased modules and imported functions are recognised', () => {
+    assert.equal(unseeded(['from numpy import random', 'x = random.rand(3)']), true);
+    assert.equal(unseeded(['from numpy import random', 'random.seed(0)', 'x = random.rand(3)']), false);
+    assert.equal(unseeded(['import random as r', 'x = r.random()']), true);
+    assert.equal(unseeded(['import random as r', 'r.seed(2)', 'x = r.random()']), false);
+    assert.equal(unseeded(['import numpy as xp', 'x = xp.random.normal(0, 1, 5)']), true);
+    assert.equal(unseeded(['import numpy.random as npr', 'x = npr.randint(0, 9)']), true);
+    assert.equal(unseeded(['from numpy.random import rand, seed', 'seed(3)', 'x = rand(3)']), false);
+    assert.equal(unseeded(['from numpy.random import rand as draw', 'x = draw(3)']), true);
+    assert.equal(unseeded(['from random import (', '    randint,', ')', 'x = randint(0, 9)']), true);
+    assert.equal(unseeded(['import cv2 as cv', 'cv.randn(img, 0, 25)']), true);
+    // A method that happens to share a draw's name is not a draw
+    assert.equal(unseeded(['from random import shuffle', 'deck.shuffle()']), false);
+});
+
+test('generators need a literal seed', () => {
+    assert.equal(unseeded(['rng = np.random.default_rng()']), true);
+    assert.equal(unseeded(['rng = np.random.default_rng(None)']), true);
+    assert.equal(unseeded(['rng = np.random.default_rng(seed=None)']), true);
+    assert.equal(unseeded(['rng = np.random.default_rng(42)']), false);
+    assert.equal(unseeded(['from numpy.random import default_rng as make', 'rng = make()']), true);
+    assert.equal(unseeded(['rs = np.random.RandomState(None)']), true);
+});
+
+test('labkit calls need a literal seed argument', () => {
+    assert.equal(unseeded(['out = noise.gaussian(img, sigma=25)']), true);
+    assert.equal(unseeded(['out = noise.gaussian(img, sigma=25, seed=0)']), false);
+    assert.equal(unseeded(['out = noise.gaussian(img, sigma=25, seed=seed)']), true);
+});
+
+test('cache markers override detection', () => {
+    assert.equal(unseeded(['# labkit: cache', 'x = np.random.rand(3)']), false);
+    assert.equal(unseeded(['# labkit: no-cache', 'print(1)']), true);
+});
@@ -0,0 +1,52 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def clip(tmp_path):
+    path = tmp_path / 'clip.avi'
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'MJPG'), 25, (160, 120))
+    rng = np.random.default_rng(0)
+    for _ in range(30):
+        writer.write(rng.integers(0, 256, (120, 160, 3), dtype=np.uint8))
+    writer.release()
+    return path
+
+
+def test_process_pool_survives_repeated_runs(clip, tmp_path):
+    # A second run used to fork its pool from a process that still had the
+    # first run's capture/writer threads, and could deadlock
+    script = textwrap.dedent(f'''
+        import os, json
+        from labkit import video
+
+        forks = []
+        real_fork = os.fork
+        def counting_fork():
+            forks.append(1)
+            return real_fork()
+        os.fork = counting_fork
+
+        runs = [video.run('canny', {str(clip)!r}, {str(tmp_path / 'out.avi')!r}, pool='process', workers=2)
+                for _ in range(2)]
+        print(json.dumps({{'pools': [r['pool'] for r in runs], 'processed': [r['processed'] for r in runs],
+                           'forksAfterFirst': len(forks) - max(2, os.cpu_count() or 1)}}))
+    ''')
+    result = subprocess.run([sys.executable, '-c', script], cwd=BACKEND, capture_output=True, text=True,
+                            timeout=60, env=dict(os.environ, PYTHONPATH=BACKEND))
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    assert report['pools'] == ['process', 'process']
+    assert report['processed'] == [30, 30]
+    # The pool is forked once and reused
+    assert report['forksAfterFirst'] == 0
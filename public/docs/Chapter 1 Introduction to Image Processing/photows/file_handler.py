@@ -1,12 +1,21 @@
 # file_handler.py
-from tkinter import Tk, filedialog
+import os
+import sys
 
 
 def get_image_path():
+    # Headless runs: take the image from the command line or LAB_IMAGE_PATH
+    if len(sys.argv) > 1:
+        return sys.argv[1]
+    if os.environ.get('LAB_IMAGE_PATH'):
+        return os.environ['LAB_IMAGE_PATH']
+
+    from tkinter import Tk, filedialog
+
     root = Tk()
     root.withdraw()
     file_path = filedialog.askopenfilename(
         title="اختر صورة",
         filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp")]
     )
-    return file_path
\ No newline at end of file
+    return file_path
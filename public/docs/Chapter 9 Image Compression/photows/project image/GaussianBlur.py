@@ -1,13 +1,24 @@
-from PIL import Image, ImageFilter
+from PIL import Image
 import matplotlib.pyplot as plt
 from file_handler import get_image_path  
+try:
+    # Picks an exact kernel for small radii and a radius-independent one for large
+    from labkit.blur import gaussian
+except ImportError:  # Outside the lab runner: Pillow's own filter
+    from PIL import ImageFilter
+
+    def gaussian(image, sigma):
+        return image.filter(ImageFilter.GaussianBlur(radius=sigma))
+
 # Open a Gaussian Noised Image and convert it to RGB
 path = get_image_path()
 input_image = Image.open(path).convert('RGB')
 
 # Apply Gaussian blur with a specified radius
 # The radius controls the amount of blurring; a higher value results in more blur
-blurred_image = input_image.filter(ImageFilter.GaussianBlur(radius=2))
+# (try 2, 10 or 50: large radii take no longer than small ones)
+radius = 2
+blurred_image = gaussian(input_image, sigma=radius)
 
 # Display the original and blurred images side by side
 plt.figure(figsize=(12, 6))
@@ -21,7 +32,7 @@ plt.axis('off')  # Hide axes
 # Blurred Image
 plt.subplot(1, 2, 2)
 plt.imshow(blurred_image)
-plt.title("Blurred Image (Gaussian Blur)")
+plt.title(f"Blurred Image (Gaussian Blur, radius={radius})")
 plt.axis('off')  # Hide axes
 
 # Show the images
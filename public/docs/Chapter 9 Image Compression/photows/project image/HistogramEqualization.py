@@ -8,13 +8,38 @@ path = get_image_path()
 
 img = cv2.imread(path,0)
 
-hist,bins = np.histogram(img.flatten(),256,[0,256])
+# Count pixels per intensity (0-255); ravel() is a view, so nothing is copied
+hist = np.bincount(img.ravel(), minlength=256)
 
 cdf = hist.cumsum()
 cdf_normalized = cdf * hist.max()/ cdf.max()
 
-plt.plot(cdf_normalized, color = 'b')
-plt.hist(img.flatten(),256,[0,256], color = 'r')
-plt.xlim([0,256])
-plt.legend(('cdf','histogram'), loc = 'upper left')
-plt.show()
\ No newline at end of file
+# Equalize the image and count its pixels the same way
+equalized = cv2.equalizeHist(img)
+hist_eq = np.bincount(equalized.ravel(), minlength=256)
+cdf_eq = hist_eq.cumsum()
+cdf_eq_normalized = cdf_eq * hist_eq.max()/ cdf_eq.max()
+
+fig, axs = plt.subplots(2, 2, figsize=(12, 8))
+
+axs[0, 0].imshow(img, cmap='gray')
+axs[0, 0].set_title('Original Image')
+axs[0, 0].axis('off')
+
+# Draw the precomputed counts instead of re-binning with plt.hist
+axs[0, 1].plot(cdf_normalized, color = 'b', label = 'cdf')
+axs[0, 1].stairs(hist, np.arange(257), fill = True, color = 'r', label = 'histogram')
+axs[0, 1].set_xlim([0,256])
+axs[0, 1].legend(loc = 'upper left')
+
+axs[1, 0].imshow(equalized, cmap='gray')
+axs[1, 0].set_title('Equalized Image')
+axs[1, 0].axis('off')
+
+axs[1, 1].plot(cdf_eq_normalized, color = 'b', label = 'cdf')
+axs[1, 1].stairs(hist_eq, np.arange(257), fill = True, color = 'r', label = 'histogram')
+axs[1, 1].set_xlim([0,256])
+axs[1, 1].legend(loc = 'upper left')
+
+plt.tight_layout()
+plt.show()
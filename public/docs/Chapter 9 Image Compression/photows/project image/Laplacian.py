@@ -2,6 +2,12 @@ import cv2  # Import the OpenCV library for image processing
 import numpy as np  # Import NumPy for numerical operations
 import matplotlib.pyplot as plt  # Import Matplotlib for displaying images
 from file_handler import get_image_path  
+try:
+    # Laplacian with small intermediates and a saturating absolute value
+    from labkit.laplacian import laplacian
+except ImportError:  # Outside the lab runner: the same result in one cv2 call each
+    def laplacian(img):
+        return cv2.convertScaleAbs(cv2.Laplacian(img, cv2.CV_16S))
 
 # Read the image
 path = get_image_path()
@@ -9,11 +15,10 @@ img = cv2.imread(path)
 
 
 # Apply the Laplacian filter to the image
-# cv2.CV_64F specifies that the output image will be of type double (64-bit float)
-laplacian = cv2.Laplacian(img, cv2.CV_64F)
-
-# Convert the output image to uint8 format for proper display
-laplacian_abs = np.uint8(np.absolute(laplacian))
+# The second derivative can be negative, so it is computed in 16-bit signed
+# integers; its absolute value is then clipped to 0-255 for proper display
+# (same as np.clip(np.absolute(cv2.Laplacian(img, cv2.CV_64F)), 0, 255))
+laplacian_abs = laplacian(img)
 
 # Set up the figure for displaying images side by side
 plt.figure(figsize=(12, 6))
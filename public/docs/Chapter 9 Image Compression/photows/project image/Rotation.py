@@ -1,5 +1,7 @@
 # Import the OpenCV library for image processing
 import cv2 
+# Import NumPy to wrap the encoded bytes for decoding
+import numpy as np
 # Import os to handle file sizes
 import os  
 # Import Matplotlib for plotting
@@ -16,14 +18,14 @@ img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
 # Get the size of the original image
 original_size = os.path.getsize(path)  # Size in bytes
 
-# Save the image as a compressed JPEG file
-# Specify a valid path for the compressed image
-compressed_image_path = 'compressed_image.jpg'  
+# Compress the image to JPEG in memory (no temporary file on disk)
 # Quality can be adjusted (0-100, where 100 is best quality)
-cv2.imwrite(compressed_image_path, img, [int(cv2.IMWRITE_JPEG_QUALITY), 90]) 
+success, compressed_buffer = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
+if not success:
+    raise RuntimeError("JPEG encoding failed")
 
 # Get the size of the compressed image
-compressed_size = os.path.getsize(compressed_image_path)  # Size in bytes
+compressed_size = compressed_buffer.nbytes  # Size in bytes
 
 # Calculate the compression ratio
 compression_ratio = original_size / compressed_size
@@ -33,8 +35,8 @@ print(f"Size of Original Image: {original_size} bytes")
 print(f"Size of Compressed Image: {compressed_size} bytes")
 print(f"Compression Ratio: {compression_ratio:.2f}")
 
-# Load the compressed image for display
-compressed_img = cv2.imread(compressed_image_path, cv2.IMREAD_GRAYSCALE)
+# Decode the compressed bytes for display
+compressed_img = cv2.imdecode(np.frombuffer(compressed_buffer, np.uint8), cv2.IMREAD_GRAYSCALE)
 
 # Create a figure to display the original and compressed images
 plt.figure(figsize=(12, 6))  # Set the figure size
@@ -4,6 +4,10 @@ import numpy as np  # Import NumPy to represent images as arrays
 import matplotlib.pyplot as plt  # Import Matplotlib for plotting
 
 from file_handler import get_image_path  # Import the function to get the image path
+try:
+    from labkit.zoom import TilePyramid  # Multi-resolution tiles, made only when needed
+except ImportError:  # Outside the lab runner: a Pillow thumbnail and array slicing
+    TilePyramid = None
 
 # Get the image path using the provided function
 path = get_image_path()
@@ -15,19 +19,53 @@ image = Image.open(image_path)  # Open the image using Pillow
 # Convert the image to a NumPy array
 image_array = np.array(image)  # Convert the image to a NumPy array
 
+width, height = image.size
+print(f"Image size: {width} x {height}, array shape {image_array.shape}, dtype {image_array.dtype}")
+x, y = max(0, width // 2 - 4), max(0, height // 2 - 4)
+
+if TilePyramid is not None:
+    # Tile pyramid over the array: a small overview for the left panel, and the
+    # exact pixel values of any region without plotting the whole array
+    pyramid = TilePyramid(image_array)
+
+    # Overview: the tiles that cover the whole image at about 800 pixels across
+    scale = min(1.0, 800 / max(width, height))
+    tiles = pyramid.viewport(0, 0, width, height, scale)
+    level = tiles[0][0]
+    cols, rows = pyramid.grid(level)
+    overview = np.concatenate([np.concatenate([pyramid.tile(level, c, r) for c in range(cols)], axis=1)
+                               for r in range(rows)], axis=0)
+
+    # Raw values of an 8 x 8 block at the centre of the image
+    block = pyramid.pixels(x, y, 8, 8)
+else:
+    thumbnail = image.copy()
+    thumbnail.thumbnail((800, 800))
+    overview = np.array(thumbnail)
+    block = image_array[y:y + 8, x:x + 8]
+
 # Display the image and its array representation
-plt.figure(figsize=(8, 6))  # Set the figure size for the plot
+plt.figure(figsize=(12, 6))  # Set the figure size for the plot
 
 # Display the original image
 plt.subplot(1, 2, 1)  # Create a subplot for the original image
-plt.imshow(image)  # Show the original image
+plt.imshow(overview, cmap='gray' if overview.ndim == 2 else None)  # Show the overview
+# Overview pixels per image pixel, to place and size the block's marker
+sx, sy = overview.shape[1] / width, overview.shape[0] / height
+plt.gca().add_patch(plt.Rectangle((x * sx, y * sy), 8 * sx, 8 * sy,
+                                  fill=False, edgecolor='red'))  # Mark the block shown on the right
 plt.title("Original Image")  # Set the title for the original image
 plt.axis('off')  # Hide the axes
 
-# Display the array representation of the image
+# Display the array representation of the block, with each pixel's values
 plt.subplot(1, 2, 2)  # Create a subplot for the image array
-plt.imshow(image_array)  # Show the image array
-plt.title("Image Array Representation")  # Set the title for the array representation
+plt.imshow(block, cmap='gray' if block.ndim == 2 else None)  # Show the image array
+for (row, col), _ in np.ndenumerate(block[..., 0] if block.ndim == 3 else block):
+    values = block[row, col]
+    label = "\n".join(str(v) for v in np.atleast_1d(values)[:3])
+    plt.text(col, row, label, ha='center', va='center', fontsize=7,
+             color='white' if np.mean(values) < 128 else 'black')
+plt.title(f"Image Array Representation (pixels {x}..{x + block.shape[1] - 1}, {y}..{y + block.shape[0] - 1})")
 plt.axis('off')  # Hide the axes
 
 plt.show()  # Render the entire plot
\ No newline at end of file
@@ -1,17 +1,32 @@
-from PIL import Image, ImageEnhance
+from PIL import Image
 import matplotlib.pyplot as plt
 from file_handler import get_image_path 
+try:
+    from labkit.enhance import Enhancer
+except ImportError:  # Outside the lab runner: ImageEnhance.Color for every factor
+    from PIL import ImageEnhance
+
+    class Enhancer:
+        def __init__(self, image):
+            self.enhancer = ImageEnhance.Color(image)
+
+        def color(self, factor):
+            if isinstance(factor, (list, tuple)):
+                return [self.enhancer.enhance(f) for f in factor]
+            return self.enhancer.enhance(factor)
 
 # Open an image file
 path = get_image_path()
 image = Image.open(path)  # Use the path obtained from get_image_path()
 
-# Create a Color enhancer object
-color_enhancer = ImageEnhance.Color(image)
+# Create a Color enhancer object (same results as ImageEnhance.Color; the
+# grayscale version is computed once, so trying more factors is cheap)
+color_enhancer = Enhancer(image)
 
 # Enhance the color with a factor of 2.0
 # A factor of 1.0 means no change, less than 1.0 reduces color, and greater than 1.0 enhances color
-colorful_image = color_enhancer.enhance(2.0) 
+# Pass a list, e.g. color_enhancer.color([0.5, 1.0, 2.0]), to get several at once
+colorful_image = color_enhancer.color(2.0) 
 
 # Set up the figure for displaying images side by side
 plt.figure(figsize=(12, 6))
@@ -19,6 +19,8 @@ export async function runPythonCode(code, files) {
         const response = await fetch('http://localhost:5000/execute', {
             method: 'POST',
             body: formData,
+            // Sends the runner's session cookie, its fair-share key per browser
+            credentials: 'include',
         });
 
         if (!response.ok) {